@@ -1,15 +1,30 @@
-from flask import Flask, request, jsonify
-from arxiv import get_recommendation_paper_info_list, Document_Reader
+from flask import Flask, request, jsonify, g, Response
+from arxiv import get_recommendation_paper_info_list, get_base_info_with_paper_id_list
 from models import *
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 import os
+import json
+import logging
+import time
+from threading import Thread
+from concurrent.futures import Future
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import uuid
 from user_profile import get_user_profile_response
-from utils import get_problems_for_article
-from constants import CHOSE_PAPER_NUM, DEFAULT_PDF_NUMBER_PER_PAGE, STATIC_PREFIX, DOCUMENT_DIR_PREFIX, SECRET_KEY, SQLALCHEMY_DATABASE_URI, TIME_ZONE, SQLALCHEMY_TRACK_MODIFICATIONS, USE_DEFAULT_USER, USE_LOW_USER_AUTHORIZATION
-from functools import wraps
+from utils import get_problems_for_article, get_arxiv_id_from_link
+from model_registry import MODEL_REGISTRY
+from semantic_search import LIBRARY_INDEX
+from embedding_service import get_embedding_service
+from fts_index import index_document, search_keywords
+from judge_cache import JUDGEMENT_CACHE
+from metrics import REGISTRY, HTTP_REQUEST_SECONDS, HTTP_HANDLED_ERRORS
+from llm_scheduler import llm_context, LLMRejected, INTERACTIVE, GENERATION, BACKGROUND
+from singleflight import SingleFlight
+from ingestion import IngestionPipeline, DOCUMENT_STAGES
+from bulk_import import read_arxiv_id_list, read_bibtex_arxiv_id_list, create_import_documents, unique
+from constants import CHOSE_PAPER_NUM, DEFAULT_PDF_NUMBER_PER_PAGE, STATIC_PREFIX, DOCUMENT_DIR_PREFIX, SECRET_KEY, SQLALCHEMY_DATABASE_URI, TIME_ZONE, SQLALCHEMY_TRACK_MODIFICATIONS, USE_DEFAULT_USER, USE_LOW_USER_AUTHORIZATION, PRELOAD_MODELS, USE_EMBEDDING_GRADING, SEARCH_TOP_K, KEYWORD_SEARCH_LIMIT, EXAM_GENERATION_DEADLINE, MAX_IMPORT_DOCUMENT_NUMBER
+from functools import wraps, partial
 from error_message import *
 
 app = Flask(__name__, static_folder=STATIC_PREFIX)
@@ -30,6 +45,30 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 
+# the concurrent requests generating an exam of the same document
+EXAM_FLIGHT = SingleFlight("exam")
+
+REGISTRY.gauge("readhub_model_memory_bytes", "The memory of the loaded models", lambda: MODEL_REGISTRY.memory)
+REGISTRY.gauge("readhub_judgement_cache_hits", "The judgements answered from the cache", lambda: JUDGEMENT_CACHE.hit_number)
+REGISTRY.gauge("readhub_judgement_cache_misses", "The judgements not found in the cache", lambda: JUDGEMENT_CACHE.miss_number)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request_time(response):
+    if 'request_start' in g:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - g.request_start,
+            endpoint=request.url_rule.rule if request.url_rule else "unknown",
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
+
 @login_manager.user_loader
 def load_user(user_id: int):
     return db.session.get(User, int(user_id))
@@ -54,13 +93,15 @@ def handle_error(func):
         try:
             func_ret = func(*args, **kwargs)
             if func_ret is None or isinstance(func_ret, str):
+                HTTP_HANDLED_ERRORS.inc(endpoint=request.url_rule.rule if request.url_rule else "unknown")
                 db.session.rollback()
                 return jsonify({'success': False, 'message': func_ret or "Unknown error"})
             else:
                 return func_ret
         except Exception as e:
+            HTTP_HANDLED_ERRORS.inc(endpoint=request.url_rule.rule if request.url_rule else "unknown")
             db.session.rollback()
-            print(str(e))
+            app.logger.exception(f"{request.path} failed: {e}")
             # TODO Note that the exception message should not be returned to the front end in the production environment
             return jsonify({'success': False, 'message': str(e)})
     return wrapper
@@ -223,51 +264,189 @@ def update_recommendation(user: User):
     return True if recommendation_paper_info_list else False
 
 
-def auto_update_user_profile():
-    user = get_logined_user()
-    user.upload_document_number += 1
-    db.session.commit()
-    if user.upload_document_number % 5 == 0 or user.upload_document_number == 1:
-        update_user_profile(user)
-        update_recommendation(user)
-    
+def refresh_user_profile(user: User):
+    try:
+        with llm_context(BACKGROUND, user.id):
+            update_user_profile(user)
+            update_recommendation(user)
+    except LLMRejected as e:
+        # the refresh is skipped when the LLM calls are saturated, the uploaded document is already saved
+        app.logger.warning(f"The profile update of {user.username} is deferred: {e}")
+
+
+def refresh_user_profile_in_background(user_id: int):
+    with app.app_context():
+        try:
+            refresh_user_profile(db.session.get(User, user_id))
+        except Exception:
+            # the documents are already ready, the profile is refreshed again after the next documents
+            db.session.rollback()
+            app.logger.exception(f"Failed to refresh the profile of the user {user_id}")
+
+
+def profile_refresh_due(user: User) -> bool:
+    """
+    the profile is refreshed after the first uploaded document and every 5 documents
+    """
+    return user.upload_document_number % 5 == 0 or user.upload_document_number == 1
+
+
+def derive_document(document: Document):
+    """
+    the last stage of the ingestion of an uploaded document, committed with the ready status
+    """
+    document.user.upload_document_number += 1
+
+
+def refresh_after_ingestion(document_id: int):
+    """
+    called by the ingestion pipeline when a document is ready, the refresh of the profile and the recommendations
+    runs in its own thread, so the LLM calls of a user neither fail the document nor hold up the other ingestions
+    """
+    with app.app_context():
+        document = db.session.get(Document, document_id)
+        # the profile is refreshed once at the end of a bulk import
+        if document.import_id is not None:
+            return
+        if profile_refresh_due(document.user):
+            Thread(target=refresh_user_profile_in_background, args=(document.user_id,), daemon=True).start()
+
+
+def finish_import(import_id: int):
+    """
+    queue the documents of the import which are not in the pipeline yet and refresh the profile of the user once
+    they are ingested
+    """
+    with app.app_context():
+        document_import = db.session.get(DocumentImport, import_id)
+        user_id = document_import.user_id
+        document_status_list = [(document.id, document.status) for document in document_import.documents]
+        db.session.commit()
+    for document_id, status in document_status_list:
+        INGESTION_PIPELINE.submit(document_id, status)
+    INGESTION_PIPELINE.wait_documents([document_id for document_id, _ in document_status_list])
+    refresh_user_profile_in_background(user_id)
+    with app.app_context():
+        db.session.get(DocumentImport, import_id).finished = True
+        db.session.commit()
+
+
+def resume_imports() -> int:
+    """
+    continue the imports interrupted by a restart, call it in the app context after INGESTION_PIPELINE.resume()
+    return:
+        the number of the imports
+    """
+    import_id_list = [document_import.id for document_import in DocumentImport.query.filter_by(finished=False)]
+    for import_id in import_id_list:
+        Thread(target=finish_import, args=(import_id,), daemon=True).start()
+    return len(import_id_list)
+
+
+INGESTION_PIPELINE = IngestionPipeline(app, DOCUMENT_STAGES + [('derive', derive_document)], on_ready=refresh_after_ingestion)
+REGISTRY.gauge("readhub_ingestion_documents_in_flight", "The documents in the ingestion pipeline", lambda: len(INGESTION_PIPELINE.in_flight))
+
 
 @app.route('/upload_document', methods=['POST'])
 @login_wrapper
 @handle_error
 def upload_document():
     """
-    1. get the file content
-    2. split the file to chunks
-    3. create a Document object and Chunk objects to store the file
-    4. chat with GLM to get the  question templates and create QuestionTemplate objects
+    create a pending document and return at once, the document is fetched, parsed, chunked and indexed by the
+    ingestion pipeline, see ingestion.py, its progress is given by get_document_status
     
     args:
         pdf_url: str
+    return:
+        document_id: int
+        status: str
     """
     user = get_logined_user()
     pdf_url = request.form.get('pdf_url')
 
     if not pdf_url:
         return FORM_NOT_COMPLETE
-    doc_reader = Document_Reader(pdf_url)
-    base_dir_name = str(uuid.uuid4())
-    base_dir_path = os.path.join(DOCUMENT_DIR_PREFIX, base_dir_name)
+    arxiv_id = get_arxiv_id_from_link(pdf_url)
+    base_dir_path = os.path.join(DOCUMENT_DIR_PREFIX, str(uuid.uuid4()))
+    # the title is the arxiv id until the metadata stage
     document = Document(
-        user=user, base_dir=base_dir_path, title=doc_reader.title, 
-        abstract=doc_reader.abstract, arxiv_id=doc_reader.arxiv_id
+        user=user, base_dir=base_dir_path, title=arxiv_id, arxiv_id=arxiv_id, status=DocumentStatus.PENDING
     )
-    
     db.session.add(document)
+    db.session.commit()
+    INGESTION_PIPELINE.submit(document.id)
+    return jsonify({'success': True, 'document_id': document.id, 'status': document.status})
 
-    chunk_path_list = doc_reader.save_pdf_chunks(base_dir_path)
-    for chunk_path in chunk_path_list:
-        chunk = Chunk(document=document, file_path=chunk_path)
-        db.session.add(chunk)
+@app.route('/import_documents', methods=['POST'])
+@login_wrapper
+@handle_error
+def import_documents():
+    """
+    import a library of arXiv papers at once, the metadata of the papers is fetched by batched queries before returning,
+    the documents are ingested in the background like the uploaded ones and the profile is refreshed once at the end
+    
+    args:
+        arxiv_ids: optional, str, the arXiv ids or urls separated by whitespaces or commas
+        bibtex: optional, file, a BibTeX file, the arXiv ids are read from the eprint, url, doi or journal fields
+    return:
+        document_ids: list[int], the documents being ingested
+        not_found: list[str], the ids not found on arXiv
+        duplicated: list[str], the ids of the papers the user already has
+        unrecognized: list[str], the items and the BibTeX entry keys without an arXiv id
+    """
+    user = get_logined_user()
+    arxiv_id_list, unrecognized_list = read_arxiv_id_list(request.form.get('arxiv_ids', ''))
+    if 'bibtex' in request.files:
+        bibtex_arxiv_id_list, bibtex_unrecognized_list = read_bibtex_arxiv_id_list(request.files['bibtex'].read().decode('utf-8', errors='replace'))
+        arxiv_id_list = unique(arxiv_id_list + bibtex_arxiv_id_list)
+        unrecognized_list += bibtex_unrecognized_list
+    if not arxiv_id_list and not unrecognized_list:
+        return FORM_NOT_COMPLETE
+    exist_arxiv_ids = {document.arxiv_id for document in user.documents}
+    duplicated_list = [arxiv_id for arxiv_id in arxiv_id_list if arxiv_id in exist_arxiv_ids]
+    arxiv_id_list = [arxiv_id for arxiv_id in arxiv_id_list if arxiv_id not in exist_arxiv_ids]
+    if len(arxiv_id_list) > MAX_IMPORT_DOCUMENT_NUMBER:
+        return TOO_MANY_DOCUMENTS
+    paper_info_dict = get_base_info_with_paper_id_list(arxiv_id_list)
+    import_id, document_id_list = create_import_documents(user, paper_info_dict)
+    if import_id is not None:
+        Thread(target=finish_import, args=(import_id,), daemon=True).start()
+    return jsonify({
+        'document_ids': document_id_list,
+        'not_found': [arxiv_id for arxiv_id in arxiv_id_list if arxiv_id not in paper_info_dict],
+        'duplicated': duplicated_list,
+        'unrecognized': unrecognized_list,
+        'success': True
+    })
 
-    db.session.commit()
-    auto_update_user_profile()
-    return jsonify({'success': True, 'document_id': document.id})
+@app.route('/get_document_status', methods=['GET'])
+@login_wrapper
+@handle_error
+def get_document_status():
+    """
+    Args:
+        document_id: int
+    return:
+        status: str, pending, the last completed stage of the ingestion, ready or failed
+        completed_stage_number: int
+        stage_number: int
+        error: str | None, the stage and the error if the ingestion failed
+    """
+    user = get_logined_user()
+    document_id = request.args.get('document_id')
+    if not document_id:
+        return FORM_NOT_COMPLETE
+    document = db.session.get(Document, int(document_id))
+    if document is None or document.user_id != user.id:
+        return DOCUMENT_NOT_FOUND
+    return jsonify({
+        'document_id': document.id,
+        'status': document.status,
+        'completed_stage_number': document.completed_stage_number,
+        'stage_number': len(INGESTION_STAGE_LIST),
+        'error': document.ingestion_error,
+        'success': True
+    })
 
 @app.route('/get_documents', methods=['GET'])
 @login_wrapper
@@ -292,7 +471,8 @@ def get_documents():
         document_data_list.append({
             'document_id': document.id,
             'title': document.title,
-            'created_time': document.created_time.timestamp()
+            'created_time': document.created_time.timestamp(),
+            'status': document.status
         })
     return jsonify({
         'documents': document_data_list,
@@ -301,6 +481,80 @@ def get_documents():
         'success': True
     })
 
+@app.route('/search', methods=['GET'])
+@login_wrapper
+@handle_error
+def search():
+    """
+    semantic search over the chunks of the user's documents
+    Args:
+        query: str
+        top_k: optional, int
+    return:
+        results: list[dict], the most similar chunks sorted by score, with the passage which matches the query best
+        success: bool
+    """
+    user = get_logined_user()
+    query = request.args.get('query')
+    top_k = int(request.args.get('top_k', SEARCH_TOP_K))
+    if not query:
+        return FORM_NOT_COMPLETE
+    results = LIBRARY_INDEX.search(user.id, query, top_k)
+    chunks: dict[int, Chunk] = {chunk.id: chunk for chunk in Chunk.query.filter(Chunk.id.in_([result['chunk_id'] for result in results]))}
+    result_data_list: list[dict] = []
+    for result in results:
+        chunk = chunks.get(result['chunk_id'])
+        if chunk is None:
+            continue
+        result_data_list.append({
+            'chunk_id': chunk.id,
+            'document_id': chunk.document_id,
+            'title': chunk.document.title,
+            'score': result['score'],
+            'passage': chunk.chunk_text[result['passage_start']: result['passage_end']],
+        })
+    return jsonify({'results': result_data_list, 'success': True})
+
+@app.route('/search_keywords', methods=['GET'])
+@login_wrapper
+@handle_error
+def search_keywords_in_documents():
+    """
+    keyword search over the titles, abstracts and chunks of the user's documents, ranked by bm25
+    Args:
+        keywords: str
+        limit: optional, int
+        offset: optional, int
+    return:
+        results: list[dict], document_id, chunk_id (None if the title or abstract is matched), title, snippet
+        success: bool
+    """
+    user = get_logined_user()
+    keywords = request.args.get('keywords')
+    limit = int(request.args.get('limit', KEYWORD_SEARCH_LIMIT))
+    offset = int(request.args.get('offset', 0))
+    if not keywords:
+        return FORM_NOT_COMPLETE
+    results = search_keywords(user.id, keywords, limit, offset)
+    return jsonify({
+        'results': [
+            {
+                'document_id': result['document_id'],
+                'chunk_id': result['chunk_id'],
+                'title': result['title'],
+                'snippet': result['snippet'],
+            } for result in results
+        ],
+        'success': True
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    the latency histograms and counters in the Prometheus text format
+    """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/get_recommendations', methods=['GET'])
 @login_wrapper
@@ -355,6 +609,7 @@ def get_exams():
                 'done': exam.done,
                 'done_number': exam.done_number,
                 'quesiton_number': exam.question_number,
+                'is_complete': exam.is_complete,
             } for exam in exams
         ],
         'success': True
@@ -368,14 +623,15 @@ def get_exam():
         exam_id: int
     Return:
         questions: list[dict]
+        is_complete: bool, False if more questions are still being generated
         success: bool
     """
     exam_id = request.args.get('exam_id')
     exam: Exam = Exam.query.get(exam_id)
     if exam is None:
         return EXAM_NOT_FOUND
-    # sorted by created_time
-    questions: list[Question] = Question.query.filter_by(exam_id=exam.id).order_by(Question.created_time).all()
+    # sorted by created_time, the questions inserted by one bulk insert are in the order of their ids
+    questions: list[Question] = Question.query.filter_by(exam_id=exam.id).order_by(Question.created_time, Question.id).all()
     question_data_list: list[dict] = []
     for question in questions:
         question_data_list.append({
@@ -391,11 +647,55 @@ def get_exam():
             'standard_answer': question.standard_answer if question.done else None,
             'review': question.standard_review
         })
-    return jsonify({'questions': question_data_list, 'success': True})
+    return jsonify({'questions': question_data_list, 'is_complete': exam.is_complete, 'success': True})
+
+def append_late_questions(exam_id: int, document_id: int, chunk_id_list: list[int], late_questions: Future):
+    """
+    save the questions generated after the deadline of the exam and mark the exam complete
+    args:
+        chunk_id_list: the chunk id of each chunk index
+    """
+    with app.app_context():
+        try:
+            question_data_list, chunk_index_list = late_questions.result()
+            Question.bulk_create(exam_id, document_id, question_data_list, [chunk_id_list[chunk_index] if chunk_index != -1 else None for chunk_index in chunk_index_list])
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(f"The late questions of the exam {exam_id} are not generated: {e}")
+        exam: Exam = db.session.get(Exam, exam_id)
+        exam.is_complete = True
+        db.session.commit()
+
+def create_exam(document: Document) -> int:
+    """
+    generate the questions of the document and save them as a new exam, the questions which are not ready
+    by EXAM_GENERATION_DEADLINE are appended to the exam later
+    return:
+        the id of the exam
+    """
+    exam = Exam(document=document)
+    chunk_object_list: list[Chunk] = Chunk.query.filter_by(document=document).all()
+    chunk_text_list = [chunk.chunk_text for chunk in chunk_object_list]
+    deadline = time.monotonic() + EXAM_GENERATION_DEADLINE if EXAM_GENERATION_DEADLINE > 0 else None
+    with llm_context(GENERATION, document.user_id):
+        question_data_list, chunk_index_list, late_questions = get_problems_for_article(chunk_text_list, deadline)
+
+    exam.is_complete = late_questions is None
+    db.session.add(exam)
+    db.session.flush()
+    chunk_id_list = [chunk_object_list[chunk_index].id if chunk_index != -1 else None for chunk_index in chunk_index_list]
+    Question.bulk_create(exam.id, document.id, question_data_list, chunk_id_list)
+    db.session.commit()
+    if late_questions is not None:
+        all_chunk_id_list = [chunk.id for chunk in chunk_object_list]
+        late_questions.add_done_callback(partial(append_late_questions, exam.id, document.id, all_chunk_id_list))
+    return exam.id
 
 @app.route('/generate_exam', methods=['POST'])
+@handle_error
 def generate_exam():
     """
+    the requests for a document arriving while its exam is being generated get the same exam
     Args:
         document_id: int
     Return:
@@ -405,25 +705,10 @@ def generate_exam():
     document = Document.query.get(document_id)
     if document is None:
         return DOCUMENT_NOT_FOUND
-    exam = Exam(document=document)
-    chunk_object_list: list[Chunk] = Chunk.query.filter_by(document=document).all()
-    chunk_text_list = [chunk.chunk_text for chunk in chunk_object_list]
-    question_data_list, chunk_index_list = get_problems_for_article(chunk_text_list)
-    
-    for question_data, chunk_index in zip(question_data_list, chunk_index_list):
-        chunk_object = chunk_object_list[chunk_index] if chunk_index != -1 else None
-        question = Question(
-            document=document,
-            exam=exam,
-            chunk=chunk_object,
-            question_type=question_data['question_type'],
-            question_content=question_data['question_content'],
-            standard_answer=question_data['standard_answer'],
-        )
-        db.session.add(question)
-    db.session.add(exam)
-    db.session.commit()
-    return jsonify({'exam_id': exam.id, 'success': True})
+    if not document.ready:
+        return DOCUMENT_NOT_READY
+    exam_id = EXAM_FLIGHT.do(document.id, create_exam, document)
+    return jsonify({'exam_id': exam_id, 'success': True})
 
 
 @app.route('/answer_question', methods=['POST'])
@@ -447,7 +732,8 @@ def answer_question():
     question: Question = db.session.get(Question, question_id)
     if question.done:
         return QUESTION_NOT_FOUND
-    question.set_user_answer(user_answer)
+    with llm_context(INTERACTIVE, question.document.user_id):
+        question.set_user_answer(user_answer)
     db.session.commit()
     return jsonify({
         'success': True,
@@ -458,10 +744,63 @@ def answer_question():
         'standard_answer': question.standard_answer
     })
 
+@app.route('/answer_exam', methods=['POST'])
+@handle_error
+def answer_exam():
+    """
+    submit the answers of an exam at once, all the answers are committed in one transaction
+    args:
+        exam_id: int
+        user_answers: str, json dict of question_id -> user_answer
+    return:
+        success: bool
+        questions: list[dict], the result of each answered question, the same as answer_question
+    """
+    exam_id = request.form.get('exam_id')
+    user_answers = request.form.get('user_answers')
+    if not exam_id or not user_answers:
+        return FORM_NOT_COMPLETE
+    exam: Exam = db.session.get(Exam, exam_id)
+    if exam is None:
+        return EXAM_NOT_FOUND
+    user_answers = {int(question_id): user_answer for question_id, user_answer in json.loads(user_answers).items() if user_answer}
+    with llm_context(INTERACTIVE, exam.document.user_id):
+        questions = exam.set_user_answers(user_answers)
+    db.session.commit()
+    return jsonify({
+        'success': True,
+        'questions': [
+            {
+                'question_id': question.id,
+                'score': question.score,
+                'review': question.standard_review,
+                'passed': question.passed,
+                'answer_time': question.answer_time.timestamp(),
+                'standard_answer': question.standard_answer
+            } for question in questions
+        ]
+    })
+
 if __name__ == "__main__":
+    debug = True
+    # the reloader of the debug mode serves the app in a child process with WERKZEUG_RUN_MAIN set and its parent only
+    # restarts the child, so only the serving process resumes the ingestion and loads the models
+    serving = not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+    # the messages of the module loggers, e.g. the model loads and the ingestion failures
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s in %(name)s: %(message)s")
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        add_missing_columns()
         add_default_user()
+        if serving:
+            INGESTION_PIPELINE.resume()
+            resume_imports()
+    if serving:
+        preload_models = list(PRELOAD_MODELS)
+        if USE_EMBEDDING_GRADING:
+            # the encoder of the blank answers is loaded before the first exam is submitted instead of in its request
+            preload_models.append(get_embedding_service().model_name)
+        MODEL_REGISTRY.preload(preload_models)
     
-    app.run(debug=True, host='0.0.0.0', port=10086)
+    app.run(debug=debug, host='0.0.0.0', port=10086)
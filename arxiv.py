@@ -1,9 +1,15 @@
 import os
-from pathlib import Path
+import re
+import time
 import pickle
-from constants import CHOSE_PAPER_NUM, DOCUMENT_DIR_PREFIX, SEARCH_PAPER_NUM
+from constants import CHOSE_PAPER_NUM, DOCUMENT_DIR_PREFIX, SEARCH_PAPER_NUM, ARXIV_API_URL, ARXIV_ID_LIST_BATCH_SIZE, ARXIV_LIMIT_TIME_PER_REQUEST
 import feedparser
-from utils import decode_pdf, get_json_response_with_max_try, get_arxiv_id_from_link, save_pdf_text_chunks
+from metrics import timed
+from cache_manager import DOCUMENT_CACHE
+from utils import get_json_response_with_max_try, get_arxiv_id_from_link, atomic_write
+
+# the id of an entry is the abs url with the version, e.g. http://arxiv.org/abs/2309.10305v2
+ENTRY_ID_PATTERN = re.compile(r"arxiv\.org/abs/(.+?)(v\d+)?$")
 
 def parse_entry(entry):
     pdf_link = None
@@ -31,6 +37,7 @@ def parse_entries(data) -> list[dict[str, str]]:
     return paper_info_list
 
 
+@timed("arxiv_fetch")
 def get_arxiv_response(url):
     data = feedparser.parse(url)
     return data
@@ -43,7 +50,7 @@ def get_base_info_with_paper_id(paper_id: str):
     Returns:
         data (dict): key-value pairs of the abstract, title, authors, date, link, id of the paper
     """
-    api_query = f'http://export.arxiv.org/api/query?id_list={paper_id}'
+    api_query = f'{ARXIV_API_URL}?id_list={paper_id}'
     data = get_arxiv_response(api_query)
     if len(data.entries) == 0:
         return data
@@ -51,9 +58,31 @@ def get_base_info_with_paper_id(paper_id: str):
     return parse_entry(entry)
 
 
+def get_base_info_with_paper_id_list(paper_id_list: list[str], batch_size: int = ARXIV_ID_LIST_BATCH_SIZE) -> dict[str, dict]:
+    """get the base info of many papers with an id_list query per batch_size papers instead of a query per paper
+    Args:
+        paper_id_list (list[str]): the ids without the version, like 2309.10305
+    Returns:
+        paper_info_dict (dict): paper id -> the base info as get_base_info_with_paper_id, the ids not found are left out
+    """
+    paper_info_dict = {}
+    for begin in range(0, len(paper_id_list), batch_size):
+        if begin:
+            time.sleep(ARXIV_LIMIT_TIME_PER_REQUEST)
+        batch = paper_id_list[begin: begin + batch_size]
+        # the api returns 10 entries by default
+        data = get_arxiv_response(f"{ARXIV_API_URL}?id_list={','.join(batch)}&max_results={len(batch)}")
+        for entry in data.entries:
+            # the ids which are not found give an error entry
+            match = ENTRY_ID_PATTERN.search(entry.get('id', ''))
+            if match is not None and match.group(1) in batch:
+                paper_info_dict[match.group(1)] = parse_entry(entry)
+    return paper_info_dict
+
+
 # 获取arxiv的api接口
 def get_arxiv_search_url(search_labels: list[str], start_index: int = 0, max_results: int = 10):
-    url_base = "http://export.arxiv.org/api/query?search_query="
+    url_base = f"{ARXIV_API_URL}?search_query="
     search_query_list = []
     for label in search_labels:
         label_search = []
@@ -151,39 +180,30 @@ def get_recommendation_paper_info_list(person_labels: str, person_description: s
         print(f"Error: {e}")
         return paper_info_list[:chose_paper_num]
 
-class Document_Reader:
-    def __init__(self, pdf_url: str):
-        self.arxiv_id = get_arxiv_id_from_link(pdf_url)
-        self.init_document_info()
-        
-    def init_paper_info(self, paper_info: dict[str, str]):
-        self.title = paper_info['title']
-        self.abstract = paper_info['abstract']
-        self.authors = paper_info['authors']
-        self.date = paper_info['date']
-        self.link = paper_info['link']
-                
-    def init_document_info(self):
-        file_name = f"{self.arxiv_id}.pkl"
-        save_doc_cache_path = os.path.join(DOCUMENT_DIR_PREFIX, file_name)
-        if os.path.exists(save_doc_cache_path):
-            with open(save_doc_cache_path, "rb") as f:
-                document_data: dict = pickle.load(f)
-            self.doc = document_data.pop("doc")
-            self.init_paper_info(document_data)
-        else:
-            paper_info = get_base_info_with_paper_id(self.arxiv_id)
-            self.init_paper_info(paper_info)
-            self.doc = decode_pdf(self.link)
-            
-            paper_info['doc'] = self.doc
-            with open(save_doc_cache_path, "wb") as f:
-                pickle.dump(paper_info, f)
-        
-    def save_pdf_chunks(self, save_dir: str | Path) -> list[str]:
-        return save_pdf_text_chunks(self.doc, save_dir)
-    
-    @staticmethod
-    def get_chunk_text(chunk_path: str | Path) -> str:
-        with open(chunk_path, "r", encoding='utf-8') as f:
-            return f.read()
+def document_cache_path(arxiv_id: str) -> str:
+    return os.path.join(DOCUMENT_DIR_PREFIX, f"{arxiv_id}.pkl")
+
+def write_document_data(path: str, paper_info: dict, doc):
+    """
+    the parse cache of a paper: the paper info and the decoded pdf are pickled one after the other,
+    so that the paper info is read without unpickling the pdf
+    """
+    def write(f):
+        pickle.dump({key: value for key, value in paper_info.items() if key != 'doc'}, f)
+        pickle.dump(doc, f)
+    atomic_write(path, write, binary=True)
+
+def load_document_data(arxiv_id: str, with_doc: bool = True) -> dict:
+    """
+    the paper info and, if with_doc, the decoded pdf (key doc) in the parse cache of the paper
+    """
+    save_doc_cache_path = document_cache_path(arxiv_id)
+    with open(save_doc_cache_path, "rb") as f:
+        document_data = pickle.load(f)
+        # the caches written before the pdf was pickled separately hold it in the paper info
+        if with_doc and 'doc' not in document_data:
+            document_data['doc'] = pickle.load(f)
+    DOCUMENT_CACHE.touch(save_doc_cache_path)
+    if not with_doc:
+        document_data.pop('doc', None)
+    return document_data
@@ -0,0 +1,107 @@
+"""
+Compare the ORM unit of work with the bulk insert path for the two heaviest write paths:
+the chunks of an uploaded document and the questions of a generated exam.
+
+usage:
+    python benchmarks/bench_bulk_insert.py [chunk_number] [question_number]
+"""
+import os
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, User, Document, Chunk, Exam, Question, QuestionType
+
+
+def create_app() -> Flask:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def create_document() -> Document:
+    user = User(username=f'bench{time.time_ns()}', password_hash='')
+    document = Document(user=user, title='bench', base_dir='bench')
+    db.session.add(document)
+    db.session.commit()
+    return document
+
+
+def fake_question_data_list(question_number: int) -> list[dict]:
+    return [
+        {
+            'question_type': QuestionType.FILL_IN_THE_BLANK,
+            'question_content': f'question {i} ' + 'x' * 200,
+            'standard_answer': f'answer {i}',
+        } for i in range(question_number)
+    ]
+
+
+def orm_chunks(document: Document, chunk_number: int):
+    for i in range(chunk_number):
+        db.session.add(Chunk(document=document, file_path=f'chunk{i}.txt'))
+    db.session.commit()
+
+
+def bulk_chunks(document: Document, chunk_number: int):
+    Chunk.bulk_create(document.id, [f'chunk{i}.txt' for i in range(chunk_number)])
+    db.session.commit()
+
+
+def orm_questions(document: Document, question_number: int):
+    exam = Exam(document=document)
+    for question_data in fake_question_data_list(question_number):
+        db.session.add(Question(document=document, exam=exam, chunk=None, **question_data))
+    db.session.add(exam)
+    db.session.commit()
+
+
+def bulk_questions(document: Document, question_number: int):
+    exam = Exam(document=document)
+    db.session.add(exam)
+    db.session.flush()
+    Question.bulk_create(exam.id, document.id, fake_question_data_list(question_number), [None] * question_number)
+    db.session.commit()
+
+
+def measure(func, *args) -> tuple[float, int]:
+    """
+    return:
+        the time cost in seconds and the peak memory in bytes
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    cost = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cost, peak
+
+
+def bench_bulk_insert(chunk_number: int = 2000, question_number: int = 2000) -> dict[str, tuple[float, int]]:
+    app = create_app()
+    results = {}
+    with app.app_context():
+        db.create_all()
+        for name, func, number in [
+            ('orm_chunks', orm_chunks, chunk_number),
+            ('bulk_chunks', bulk_chunks, chunk_number),
+            ('orm_questions', orm_questions, question_number),
+            ('bulk_questions', bulk_questions, question_number),
+        ]:
+            document = create_document()
+            results[name] = measure(func, document, number)
+            db.session.expunge_all()
+        db.drop_all()
+    return results
+
+
+if __name__ == "__main__":
+    chunk_number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    question_number = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    for name, (cost, peak) in bench_bulk_insert(chunk_number, question_number).items():
+        print(f"{name:<16} time: {cost * 1000:9.2f} ms    peak memory: {peak / 1024:9.1f} KiB")
@@ -0,0 +1,58 @@
+"""
+Compare the pairwise calculate_similarity of the clip_model encoders with the dynamic batching embedding service
+when many threads ask for similarities at the same time.
+
+usage:
+    python benchmarks/bench_embedding_service.py [model_name] [pair_number] [thread_number]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import EMBEDDING_MODEL
+from embedding_service import EmbeddingService
+from model_registry import MODEL_REGISTRY
+
+
+def fake_pairs(pair_number: int) -> list[tuple[str, str]]:
+    return [(f"自注意力机制的第{i}种变体", f"the {i}th variant of self attention") for i in range(pair_number)]
+
+
+def bench_embedding_service(model_name: str = EMBEDDING_MODEL, pair_number: int = 512, thread_number: int = 16) -> dict[str, float]:
+    """
+    return:
+        the number of similarities per second of each method
+    """
+    service = EmbeddingService(model_name)
+    pairs = fake_pairs(pair_number)
+    results = {}
+    with MODEL_REGISTRY.use(model_name) as encoder:
+        results.update(compare(encoder, service, pairs, thread_number))
+    start = time.perf_counter()
+    service.pairwise_similarity(pairs)
+    results['service_many_pairs'] = pair_number / (time.perf_counter() - start)
+    return results
+
+
+def compare(encoder, service: EmbeddingService, pairs: list[tuple[str, str]], thread_number: int) -> dict[str, float]:
+    results = {}
+    for name, func in [
+        ('pairwise', lambda pair: encoder.calculate_similarity(*pair)),
+        ('service', lambda pair: service.similarity(*pair)),
+    ]:
+        func(pairs[0])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=thread_number) as pool:
+            list(pool.map(func, pairs))
+        results[name] = len(pairs) / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == "__main__":
+    model_name = sys.argv[1] if len(sys.argv) > 1 else EMBEDDING_MODEL
+    pair_number = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    thread_number = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    for name, throughput in bench_embedding_service(model_name, pair_number, thread_number).items():
+        print(f"{name:<20} {throughput:9.1f} pairs/s")
@@ -0,0 +1,70 @@
+"""
+The LLM calls and input tokens of the problem generation of an exam with one prompt per problem type and chunk,
+and with the fused prompt which asks for the choice, tf and blank problems of a chunk at once, with the stand-in backend.
+
+usage:
+    python benchmarks/bench_fused_problems.py [--exams 20] [--chunks 6] [--chunk-words 1500] [--malformed-rate 0.1]
+"""
+import argparse
+import os
+import random
+import sys
+from collections import Counter
+from threading import Lock
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import utils
+from llm_backend import StandInBackend, detect_prompt_family, estimate_tokens
+from synthetic import random_paragraph
+
+
+class CountingLLM:
+    def __init__(self, backend: StandInBackend):
+        self.backend = backend
+        self.lock = Lock()
+        self.calls = Counter()
+        self.input_tokens = 0
+
+    def __call__(self, prompt: str) -> str:
+        with self.lock:
+            self.calls[detect_prompt_family(prompt)] += 1
+            self.input_tokens += estimate_tokens(prompt)
+        return self.backend.chat(prompt)
+
+
+def run(fused: bool, exams: int, chunks: int, chunk_words: int, malformed_rate: float) -> tuple[CountingLLM, int]:
+    """
+    return:
+        the counting LLM, the number of the generated questions
+    """
+    rng = random.Random(0)
+    llm = CountingLLM(StandInBackend(latency_scale=0, malformed_rate=malformed_rate))
+    utils.USE_FUSED_PROBLEM_PROMPT = fused
+    utils.USE_HEDGING = False
+    utils._call_llm = llm
+    question_number = 0
+    for i in range(exams):
+        article = [random_paragraph(rng, chunk_words) + f" {i}" for _ in range(chunks)]
+        questions, _, _ = utils.get_problems_for_article(article)
+        question_number += len(questions)
+    return llm, question_number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM calls and input tokens per exam with and without the fused problem prompt")
+    parser.add_argument("--exams", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=6)
+    parser.add_argument("--chunk-words", type=int, default=1500)
+    parser.add_argument("--malformed-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    for name, fused in [("per type", False), ("fused", True)]:
+        llm, question_number = run(fused, args.exams, args.chunks, args.chunk_words, args.malformed_rate)
+        problem_calls = sum(number for family, number in llm.calls.items() if family in ('choice', 'tf', 'blank', 'fused'))
+        print(f"{name:<9} calls per exam: {sum(llm.calls.values()) / args.exams:5.1f} (problems {problem_calls / args.exams:4.1f})  "
+              f"input tokens per exam: {llm.input_tokens / args.exams:8.0f}  questions per exam: {question_number / args.exams:4.1f}")
+
+
+if __name__ == "__main__":
+    main()
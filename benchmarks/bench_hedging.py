@@ -0,0 +1,87 @@
+"""
+The time of the exam generation with and without hedging, with the LLM latencies of the stand-in backend and a heavy tail:
+an exam is a fan-out of parallel calls and lasts as long as its slowest call, so a few stragglers set the p99.
+
+usage:
+    python benchmarks/bench_hedging.py [--exams 200] [--calls 12] [--latency lognormal:100,0.3] [--straggler-rate 0.02] [--straggler-factor 10]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hedging import Hedger, LatencyTracker, HedgeBudget
+from llm_backend import LatencyDistribution
+
+
+class SlowLLM:
+    def __init__(self, latency: str, straggler_rate: float, straggler_factor: float, seed: int = 0):
+        self.latency = LatencyDistribution(latency)
+        self.straggler_rate = straggler_rate
+        self.straggler_factor = straggler_factor
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.call_number = 0
+
+    def call(self):
+        with self.lock:
+            self.call_number += 1
+            latency = self.latency.sample(self.rng)
+            if self.rng.random() < self.straggler_rate:
+                latency *= self.straggler_factor
+        time.sleep(latency)
+
+
+def run(hedger: Hedger | None, llm: SlowLLM, exams: int, calls: int) -> list[float]:
+    """
+    return:
+        the seconds of each exam
+    """
+    times = []
+    with ThreadPoolExecutor(max_workers=calls) as pool:
+        for _ in range(exams):
+            start = time.perf_counter()
+            if hedger is None:
+                futures = [pool.submit(llm.call) for _ in range(calls)]
+            else:
+                futures = [pool.submit(hedger.call, "exam", llm.call) for _ in range(calls)]
+            for future in futures:
+                future.result()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exam generation time with and without hedged LLM calls")
+    parser.add_argument("--exams", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=12, help="the parallel LLM calls of an exam")
+    parser.add_argument("--latency", default="lognormal:100,0.3", help="the latency distribution of a call in ms")
+    parser.add_argument("--straggler-rate", type=float, default=0.02)
+    parser.add_argument("--straggler-factor", type=float, default=10)
+    parser.add_argument("--budget-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for name in ["no hedging", "hedging"]:
+        llm = SlowLLM(args.latency, args.straggler_rate, args.straggler_factor)
+        hedger = None
+        if name == "hedging":
+            hedger = Hedger(tracker=LatencyTracker(), budget=HedgeBudget(args.budget_ratio), max_workers=args.calls * 2)
+            # warm up the latency percentile
+            run(hedger, llm, 5, args.calls)
+            llm.call_number = 0
+        times = run(hedger, llm, args.exams, args.calls)
+        print(f"{name:<12} p50: {percentile(times, 0.5) * 1000:7.1f}ms  p99: {percentile(times, 0.99) * 1000:7.1f}ms  "
+              f"extra calls: {llm.call_number / (args.exams * args.calls) - 1:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
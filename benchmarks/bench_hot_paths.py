@@ -0,0 +1,100 @@
+"""
+Microbenchmarks of the CPU-bound hot paths, run by benchmarks/run_benchmarks.py.
+Each case_* function prepares the inputs and returns the function to time, no network and no LLM is used.
+
+usage:
+    python benchmarks/run_benchmarks.py hot_paths
+"""
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feedparser
+from synthetic import synthetic_layout, synthetic_llm_outputs, synthetic_library, synthetic_labels, synthetic_atom_feed, synthetic_arxiv_id
+
+
+def case_save_pdf_text_chunks():
+    from utils import save_pdf_text_chunks
+    doc = synthetic_layout(paragraph_number=2000)
+    temp_dir = tempfile.TemporaryDirectory()
+    def run():
+        # the temporary directory is kept alive by the closure
+        return save_pdf_text_chunks(doc, temp_dir.name)
+    return run
+
+
+def case_jsonfy_response():
+    from utils import jsonfy_response
+    outputs = synthetic_llm_outputs()
+    def run():
+        for response, _ in outputs:
+            jsonfy_response(response)
+    return run
+
+
+def case_check_problem_format():
+    from utils import check_problem_format
+    outputs = synthetic_llm_outputs()
+    def run():
+        # get_problems passes the raw responses, the ones with a leading sentence are rejected and retried
+        for response, problem_type in outputs:
+            try:
+                check_problem_format(response, problem_type)
+            except ValueError:
+                pass
+    return run
+
+
+def case_get_user_profile_prompt():
+    from user_profile import get_user_profile_prompt
+    documents = synthetic_library(document_number=1000)
+    return lambda: get_user_profile_prompt(documents)
+
+
+def case_get_average_score():
+    from flask import Flask
+    from models import db, User, Document, Exam, Question
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    app.app_context().push()
+    db.create_all()
+    user = User(username='bench', password_hash='')
+    db.session.add(user)
+    # a deep history: 100 documents with 10 exams of 10 answered questions each
+    for i in range(100):
+        document = Document(user=user, title=f'document {i}', base_dir='bench')
+        for j in range(10):
+            exam = Exam(document=document)
+            for k in range(10):
+                db.session.add(Question(
+                    document=document, exam=exam, question_type=k % 4,
+                    question_content='question', standard_answer='answer', score=(i + j + k) % 101,
+                ))
+    db.session.commit()
+    user_id = user.id
+    def run():
+        # load the history from the database every time, like a new request
+        db.session.expunge_all()
+        return db.session.get(User, user_id).get_average_score()
+    return run
+
+
+def case_get_arxiv_search_url():
+    from arxiv import get_arxiv_search_url
+    labels = synthetic_labels(label_number=50)
+    return lambda: get_arxiv_search_url(labels, 0, 100)
+
+
+def case_parse_feed():
+    from arxiv import parse_entries
+    feed = synthetic_atom_feed([synthetic_arxiv_id(i) for i in range(200)])
+    return lambda: parse_entries(feedparser.parse(feed))
+
+
+def case_parse_entries():
+    from arxiv import parse_entries
+    data = feedparser.parse(synthetic_atom_feed([synthetic_arxiv_id(i) for i in range(200)]))
+    return lambda: parse_entries(data)
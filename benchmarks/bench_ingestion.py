@@ -0,0 +1,155 @@
+"""
+The throughput of the ingestion pipeline of the uploaded documents with one worker per stage and with the workers of
+INGESTION_STAGE_WORKERS, of the bulk import (the metadata of all the papers fetched by batched id_list queries), and the
+time of the synchronous upload before the pipeline for comparison.
+arXiv, the pdf download and llmsherpa are the HTTP stand-ins of stand_in_services.py with their latencies, the derive
+stage (the profile refresh by the LLM) is left out. Each run uses distinct papers, so the caches of the earlier runs
+are not hit.
+
+usage:
+    python benchmarks/bench_ingestion.py [--documents 32] [--service-latency-scale 1] [--paragraphs 200]
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import synthetic_arxiv_id
+
+
+def find_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def create_documents(user_id: int, arxiv_id_list: list[str]) -> list[int]:
+    from models import db, Document, DocumentStatus
+    from constants import DOCUMENT_DIR_PREFIX
+    documents = [
+        Document(user_id=user_id, base_dir=os.path.join(DOCUMENT_DIR_PREFIX, str(uuid.uuid4())), title=arxiv_id, arxiv_id=arxiv_id, status=DocumentStatus.PENDING)
+        for arxiv_id in arxiv_id_list
+    ]
+    db.session.add_all(documents)
+    db.session.commit()
+    return [document.id for document in documents]
+
+
+def run_pipeline(app, user_id: int, arxiv_id_list: list[str], stage_workers: dict[str, int]) -> tuple[float, int]:
+    """
+    return:
+        the seconds until all the documents are ingested, the number of the ready documents
+    """
+    from ingestion import IngestionPipeline, DOCUMENT_STAGES
+    from models import Document, DocumentStatus
+    pipeline = IngestionPipeline(app, DOCUMENT_STAGES, stage_workers)
+    with app.app_context():
+        document_id_list = create_documents(user_id, arxiv_id_list)
+    start = time.perf_counter()
+    for document_id in document_id_list:
+        pipeline.submit(document_id)
+    pipeline.wait_idle()
+    seconds = time.perf_counter() - start
+    with app.app_context():
+        ready_number = Document.query.filter(Document.id.in_(document_id_list), Document.status == DocumentStatus.READY).count()
+    return seconds, ready_number
+
+
+def run_import(app, user_id: int, arxiv_id_list: list[str], stage_workers: dict[str, int]) -> tuple[float, int]:
+    """
+    the bulk import: one id_list query per ARXIV_ID_LIST_BATCH_SIZE papers, then the pipeline from the download stage
+    return:
+        the seconds until all the documents are ingested, the number of the ready documents
+    """
+    from arxiv import get_base_info_with_paper_id_list
+    from bulk_import import create_import_documents
+    from ingestion import IngestionPipeline, DOCUMENT_STAGES
+    from models import db, Document, DocumentStatus, User, INGESTION_STAGE_LIST
+    pipeline = IngestionPipeline(app, DOCUMENT_STAGES, stage_workers)
+    start = time.perf_counter()
+    with app.app_context():
+        _, document_id_list = create_import_documents(db.session.get(User, user_id), get_base_info_with_paper_id_list(arxiv_id_list))
+    for document_id in document_id_list:
+        pipeline.submit(document_id, INGESTION_STAGE_LIST[0])
+    pipeline.wait_idle()
+    seconds = time.perf_counter() - start
+    with app.app_context():
+        ready_number = Document.query.filter(Document.id.in_(document_id_list), Document.status == DocumentStatus.READY).count()
+    return seconds, ready_number
+
+
+def run_synchronous(app, user_id: int, arxiv_id_list: list[str], uploads: int) -> float:
+    """
+    the stages run back to back on the request threads, as the upload before the pipeline
+    return:
+        the seconds until all the documents are ingested
+    """
+    from ingestion import DOCUMENT_STAGES
+    from models import db, Document
+
+    def upload(document_id: int):
+        with app.app_context():
+            document = db.session.get(Document, document_id)
+            for _, func in DOCUMENT_STAGES:
+                func(document)
+            db.session.commit()
+
+    with app.app_context():
+        document_id_list = create_documents(user_id, arxiv_id_list)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=uploads) as pool:
+        list(pool.map(upload, document_id_list))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of the ingestion pipeline")
+    parser.add_argument("--documents", type=int, default=32, help="the documents of each run")
+    parser.add_argument("--uploads", type=int, default=4, help="the concurrent synchronous uploads")
+    parser.add_argument("--paragraphs", type=int, default=200, help="the paragraphs of each parsed pdf")
+    parser.add_argument("--service-latency-scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="read-hub-bench-ingestion-")
+    # the data directories of the app are relative to the working directory
+    os.chdir(work_dir)
+    service_port = find_free_port()
+    os.environ["ARXIV_API_URL"] = f"http://127.0.0.1:{service_port}/api/query"
+    os.environ["LLMSERPA_API_URL"] = f"http://127.0.0.1:{service_port}/parse"
+    os.environ["LLM_BACKEND"] = "stand_in"
+
+    from stand_in_services import StandInServices
+    from app import app, db, add_default_user
+    from constants import INGESTION_STAGE_WORKERS
+    from models import User
+    services = StandInServices(port=service_port, latency_scale=args.service_latency_scale, paragraph_number=args.paragraphs).start()
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.abspath('bench_ingestion.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        add_default_user()
+        user_id = User.query.filter_by(username='default').first().id
+    print(f"{args.documents} documents per run, work dir {work_dir}")
+
+    runs = [
+        (f"synchronous x{args.uploads}", lambda arxiv_id_list: (run_synchronous(app, user_id, arxiv_id_list, args.uploads), len(arxiv_id_list))),
+        ("pipeline 1 per stage", lambda arxiv_id_list: run_pipeline(app, user_id, arxiv_id_list, {})),
+        ("pipeline " + ",".join(str(workers) for workers in INGESTION_STAGE_WORKERS.values()),
+         lambda arxiv_id_list: run_pipeline(app, user_id, arxiv_id_list, INGESTION_STAGE_WORKERS)),
+        ("bulk import", lambda arxiv_id_list: run_import(app, user_id, arxiv_id_list, INGESTION_STAGE_WORKERS)),
+    ]
+    for run_index, (name, run) in enumerate(runs):
+        arxiv_id_list = [synthetic_arxiv_id(10000 * (run_index + 1) + i) for i in range(args.documents)]
+        seconds, ready_number = run(arxiv_id_list)
+        print(f"{name:<24} {seconds:7.2f}s  {ready_number / seconds:6.2f} documents/s  ready: {ready_number}/{args.documents}")
+    services.stop()
+
+
+if __name__ == "__main__":
+    main()
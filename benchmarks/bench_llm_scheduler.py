@@ -0,0 +1,89 @@
+"""
+The latency of the interactive LLM calls while many background and generation calls are flooding the scheduler,
+compared with the plain semaphore the calls used to share.
+
+usage:
+    python benchmarks/bench_llm_scheduler.py [--seconds 5] [--flood-threads 48] [--call-ms 200] [--interactive-ms 50]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from threading import Event, Semaphore, Thread, Timer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_scheduler import LLMScheduler, INTERACTIVE, GENERATION, BACKGROUND
+
+UNLIMITED = {INTERACTIVE: 10 ** 6, GENERATION: 10 ** 6, BACKGROUND: 10 ** 6}
+
+
+class SemaphoreScheduler:
+    """
+    the Semaphore(16) the LLM calls used to share
+    """
+    def __init__(self, max_concurrency: int = 16):
+        self.semaphore = Semaphore(max_concurrency)
+
+    def acquire(self, priority: str, user_id: int, cost: float):
+        self.semaphore.acquire()
+
+    def release(self, priority: str):
+        self.semaphore.release()
+
+
+def run(scheduler: LLMScheduler | SemaphoreScheduler, prioritized: bool, seconds: float, flood_threads: int, call_ms: float, interactive_ms: float) -> list[float]:
+    """
+    return:
+        the latency in ms of each interactive call, waiting included
+    """
+    stop = Event()
+
+    def flood(i: int):
+        priority = (BACKGROUND if i % 2 else GENERATION) if prioritized else GENERATION
+        rng = random.Random(i)
+        while not stop.is_set():
+            scheduler.acquire(priority, i % 4, 1000)
+            time.sleep(call_ms * rng.uniform(0.5, 1.5) / 1000)
+            scheduler.release(priority)
+
+    threads = [Thread(target=flood, args=(i,), daemon=True) for i in range(flood_threads)]
+    for thread in threads:
+        thread.start()
+    latencies = []
+    priority = INTERACTIVE if prioritized else GENERATION
+    # the semaphore is not fair, an interactive call may wait until the flood stops
+    timer = Timer(seconds, stop.set)
+    timer.start()
+    while not stop.is_set():
+        start = time.monotonic()
+        scheduler.acquire(priority, 100, 100)
+        time.sleep(interactive_ms / 1000)
+        scheduler.release(priority)
+        latencies.append((time.monotonic() - start) * 1000)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interactive LLM latency under background load")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--flood-threads", type=int, default=48)
+    parser.add_argument("--call-ms", type=float, default=200)
+    parser.add_argument("--interactive-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    for name, prioritized, scheduler in [
+        ("semaphore", False, SemaphoreScheduler()),
+        ("scheduler", True, LLMScheduler(tokens_per_minute=None, queue_limit=UNLIMITED, max_wait=UNLIMITED)),
+    ]:
+        latencies = sorted(run(scheduler, prioritized, args.seconds, args.flood_threads, args.call_ms, args.interactive_ms))
+        print(f"{name:<16} interactive calls: {len(latencies):4d}  p50: {statistics.median(latencies):7.1f}ms  "
+              f"p95: {latencies[int(len(latencies) * 0.95)]:7.1f}ms  max: {latencies[-1]:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
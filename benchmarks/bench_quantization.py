@@ -0,0 +1,82 @@
+"""
+Accuracy vs latency of the fp32 and the dynamic int8 quantized clip_model encoders on paired sentence fixtures.
+The similarity drift is the difference between the similarities of the same pair given by the two encoders.
+
+usage:
+    python benchmarks/bench_quantization.py [model_name] [repeat]
+"""
+import io
+import json
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from constants import EMBEDDING_MODEL
+from embedding_service import normalize, to_numpy
+from model_registry import load_clip_model, get_model_key
+
+SENTENCE_PAIRS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "sentence_pairs.json")
+
+
+def load_sentence_pairs() -> list[tuple[str, str]]:
+    with open(SENTENCE_PAIRS_FILE, "r", encoding='utf-8') as f:
+        return [tuple(pair) for pair in json.load(f)]
+
+
+def serialized_size(encoder) -> int:
+    """
+    the size of the state dict of the encoder in bytes, the int8 packed weights are not parameters of the quantized modules,
+    so counting the parameters would underestimate the int8 encoder
+    """
+    import torch
+    buffer = io.BytesIO()
+    torch.save(encoder.model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def pair_similarity(encoder, sentence_pairs: list[tuple[str, str]]) -> np.ndarray:
+    embeddings = normalize(to_numpy(encoder.encode([text for pair in sentence_pairs for text in pair])))
+    return np.einsum('ij,ij->i', embeddings[0::2], embeddings[1::2])
+
+
+def encode_latency(encoder, sentence_pairs: list[tuple[str, str]], repeat: int) -> float:
+    """
+    return:
+        the mean latency in ms of encoding one pair
+    """
+    encoder.encode(list(sentence_pairs[0]))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for pair in sentence_pairs:
+            encoder.encode(list(pair))
+    return (time.perf_counter() - start) / repeat / len(sentence_pairs) * 1000
+
+
+def bench_quantization(model_name: str = EMBEDDING_MODEL, repeat: int = 5) -> dict[str, float]:
+    sentence_pairs = load_sentence_pairs()
+    results = {}
+    similarity = {}
+    for quantize in [False, True]:
+        name = 'int8' if quantize else 'fp32'
+        encoder = load_clip_model(get_model_key(model_name, quantize))
+        results[f'{name}_latency_ms'] = encode_latency(encoder, sentence_pairs, repeat)
+        results[f'{name}_size_mb'] = serialized_size(encoder) / 1024 / 1024
+        similarity[name] = pair_similarity(encoder, sentence_pairs)
+        del encoder
+    drift = np.abs(similarity['fp32'] - similarity['int8'])
+    results['mean_similarity_drift'] = float(drift.mean())
+    results['max_similarity_drift'] = float(drift.max())
+    # whether the order of the pairs by similarity is kept, which matters for the thresholds
+    results['rank_correlation'] = float(np.corrcoef(
+        np.argsort(np.argsort(similarity['fp32'])), np.argsort(np.argsort(similarity['int8']))
+    )[0, 1])
+    return results
+
+
+if __name__ == "__main__":
+    model_name = sys.argv[1] if len(sys.argv) > 1 else EMBEDDING_MODEL
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    for name, value in bench_quantization(model_name, repeat).items():
+        print(f"{name:<24} {value:10.4f}")
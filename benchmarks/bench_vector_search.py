@@ -0,0 +1,66 @@
+"""
+Query latency and recall@k of the brute force and the IVF modes of VectorIndex over random clustered embeddings,
+the default size is the 100k chunks x 512 dim of the requirement, the target is under 10 ms per query on CPU.
+
+usage:
+    python benchmarks/bench_vector_search.py [size] [dim] [query_number]
+"""
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from constants import VECTOR_INDEX_NPROBE
+from vector_index import VectorIndex
+
+
+def clustered_embeddings(size: int, dim: int, cluster_number: int, seed: int = 0) -> np.ndarray:
+    """
+    the passages of one paper are close to each other, so the embeddings are sampled around cluster centers
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((cluster_number, dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, cluster_number, size)] + 0.5 * rng.standard_normal((size, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def query_latency(index: VectorIndex, queries: np.ndarray, top_k: int) -> tuple[float, list[set]]:
+    """
+    return:
+        the mean latency in ms of one query and the result ids of each query
+    """
+    index.search(queries[0], top_k)
+    result_ids = []
+    start = time.perf_counter()
+    for query in queries:
+        result_ids.append(set(index.search(query, top_k)[0][:, 0].tolist()))
+    return (time.perf_counter() - start) / len(queries) * 1000, result_ids
+
+
+def bench_vector_search(size: int = 100000, dim: int = 512, query_number: int = 200, top_k: int = 10, nprobe: int = VECTOR_INDEX_NPROBE) -> dict[str, float]:
+    embeddings = clustered_embeddings(size, dim, cluster_number=max(1, size // 50))
+    # the queries are near some of the passages, as a query usually paraphrases a passage
+    rng = np.random.default_rng(1)
+    queries = embeddings[rng.integers(0, size, query_number)] + 0.05 * rng.standard_normal((query_number, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    results = {}
+    brute_force = VectorIndex(dim, ivf_min_size=None)
+    brute_force.add(embeddings, np.arange(size))
+    results['brute_force_latency_ms'], exact_ids = query_latency(brute_force, queries, top_k)
+    del brute_force
+    start = time.perf_counter()
+    ivf = VectorIndex(dim, ivf_min_size=1, nprobe=nprobe)
+    ivf.add(embeddings, np.arange(size))
+    results['ivf_build_s'] = time.perf_counter() - start
+    results['ivf_latency_ms'], ivf_ids = query_latency(ivf, queries, top_k)
+    results[f'ivf_recall@{top_k}'] = float(np.mean([len(a & b) / top_k for a, b in zip(exact_ids, ivf_ids)]))
+    return results
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    query_number = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    for name, value in bench_vector_search(size, dim, query_number).items():
+        print(f"{name:<24} {value:10.4f}")
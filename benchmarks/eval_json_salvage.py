@@ -0,0 +1,129 @@
+"""
+Compare the salvaging JSON parser with the previous parser on a corpus of LLM responses to the problem prompts:
+the responses which are rejected or give fewer questions than requested make get_problems call the LLM again.
+The corpus is the record file of the record mode of the LLM backend (LLM_RECORD_FILE), or the responses of the stand-in
+backend with the given malformed rate when there is no record file.
+
+usage:
+    python benchmarks/eval_json_salvage.py [--record-file static/llm_record.jsonl] [--number 200] [--malformed-rate 0.2]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from collections import Counter, defaultdict
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from constants import LLM_RECORD_FILE, MAX_PROBLEM_GEN_TRIES
+from json_salvage import salvage_json
+from llm_backend import StandInBackend
+from utils import PROBLEM_PROMPT_FUNC, check_problem_data
+from synthetic import random_paragraph
+
+
+def legacy_process_json(problem: str):
+    """
+    the parser of check_problem_format before json_salvage.py
+    """
+    try:
+        return json.loads(problem.replace("'", '"').strip(), strict=False)
+    except:
+        problem = problem.replace("```json", '').replace("```", "").strip()
+        return json.loads(problem.replace("'", '"').strip(), strict=False)
+
+
+def salvage_process_json(problem: str):
+    return salvage_json(problem).value
+
+
+def load_record_corpus(record_file: str) -> list[tuple[str, str, int]]:
+    """
+    return:
+        list of (problem type, response, the number of the requested problems)
+    """
+    corpus = []
+    with open(record_file, "r", encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record['family'] in PROBLEM_PROMPT_FUNC:
+                corpus.append((record['family'], record['response'], StandInBackend.problem_number(record['prompt'])))
+    return corpus
+
+
+def stand_in_corpus(number_per_type: int, malformed_rate: float, seed: int) -> list[tuple[str, str, int]]:
+    """
+    the stand-in responses dressed like the live ones, a part of them malformed
+    """
+    rng = random.Random(seed)
+    backend = StandInBackend(latency_scale=0, malformed_rate=malformed_rate, seed=seed)
+    corpus = []
+    for problem_type, prompt_func in PROBLEM_PROMPT_FUNC.items():
+        for i in range(number_per_type):
+            num = 1 if problem_type in ("sum", "review") else 3
+            response = backend.chat(prompt_func(random_paragraph(rng, 400) + f" {i}", num))
+            if rng.random() < 0.3:
+                response = f"```json\n{response}\n```"
+            if rng.random() < 0.3:
+                response = f"好的，以下是根据论文内容给出的结果：\n{response}"
+            corpus.append((problem_type, response, num))
+    return corpus
+
+
+def evaluate(corpus: list[tuple[str, str, int]], process_json) -> dict:
+    """
+    return:
+        the statistics of the parser on the corpus
+    """
+    stats = Counter()
+    per_type = defaultdict(Counter)
+    for problem_type, response, num in corpus:
+        try:
+            problems = check_problem_data(process_json(response), problem_type)
+            item_number = len(problems) if isinstance(problems, list) else 1
+        except Exception:
+            item_number = 0
+        stats['responses'] += 1
+        stats['problems'] += min(item_number, num)
+        stats['requested'] += num
+        retry = item_number < num
+        stats['retries'] += retry
+        per_type[problem_type]['responses'] += 1
+        per_type[problem_type]['retries'] += retry
+    retry_rate = stats['retries'] / stats['responses']
+    return {
+        'retry_rate': retry_rate,
+        'problem_yield': stats['problems'] / stats['requested'],
+        # the expected calls of a prompt if the retries fail as often as the first call
+        'calls_per_prompt': sum(retry_rate ** i for i in range(MAX_PROBLEM_GEN_TRIES)),
+        'retry_rate_per_type': {problem_type: counter['retries'] / counter['responses'] for problem_type, counter in per_type.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the salvaging JSON parser on recorded LLM responses")
+    parser.add_argument("--record-file", default=LLM_RECORD_FILE)
+    parser.add_argument("--number", type=int, default=200, help="the stand-in responses per problem type")
+    parser.add_argument("--malformed-rate", type=float, default=0.2, help="the malformed rate of the stand-in responses")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.record_file):
+        corpus = load_record_corpus(args.record_file)
+        print(f"{len(corpus)} recorded responses from {args.record_file}")
+    else:
+        corpus = stand_in_corpus(args.number, args.malformed_rate, args.seed)
+        print(f"{len(corpus)} stand-in responses, malformed rate {args.malformed_rate}")
+    for name, process_json in [("legacy", legacy_process_json), ("salvage", salvage_process_json)]:
+        result = evaluate(corpus, process_json)
+        per_type = "  ".join(f"{problem_type}: {rate:.1%}" for problem_type, rate in sorted(result['retry_rate_per_type'].items()))
+        print(f"{name:<8} retry rate: {result['retry_rate']:6.1%}  problem yield: {result['problem_yield']:6.1%}  "
+              f"calls per prompt: {result['calls_per_prompt']:.2f}  ({per_type})")
+
+
+if __name__ == "__main__":
+    main()
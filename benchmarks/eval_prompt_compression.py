@@ -0,0 +1,179 @@
+"""
+Check that the compression of the chunks in the problem prompts keeps the questions answerable, on the recorded choice, tf,
+blank and fused prompts of the record mode of the LLM backend (LLM_RECORD_FILE):
+    support: the share of the content words of a recorded question and its answer found in the chunk sent to the LLM,
+        the questions the LLM asked from the full chunk should still be supported by the compressed chunk
+    input tokens: the estimated tokens of the full and the compressed prompts
+With --regenerate the compressed prompts are sent to the LLM backend (LLM_BACKEND, zhipu or stand_in) to compare the valid
+questions per prompt, their support in the full chunk and the latency with those of the full prompts.
+Without a record file the stand-in responses of synthetic chunks are used, the stand-in draws its questions uniformly from
+the sentences of the chunk instead of the salient ones, so its support is a lower bound.
+
+usage:
+    python benchmarks/eval_prompt_compression.py [--record-file static/llm_record.jsonl] [--number 50] [--regenerate]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from constants import LLM_RECORD_FILE
+from llm_backend import StandInBackend, get_backend, estimate_tokens
+from prompt_compression import PromptCompressor, TOKEN_PATTERN
+from utils import PROBLEM_PROMPT_FUNC, PROBLEM_FUSED_PROMPT, FUSED_PROBLEM_SECTIONS, check_problem_format, check_fused_problem_format
+from synthetic import WORDS, random_paragraph
+
+QUESTION_TYPES = ['choice', 'tf', 'blank']
+STOP_WORDS = set("the a an of and or to in on for with by is are was were be as at that this these those from it its we our".split())
+
+
+def parse_record(family: str, prompt: str, response: str) -> tuple[str, dict[str, int], list[dict]] | None:
+    """
+    return:
+        the chunk, problem type -> the number of the requested questions, the valid questions of the response
+    """
+    chunk = StandInBackend.article(prompt)
+    try:
+        if family == 'fused':
+            nums = {
+                problem_type: int(match.group(1)) for problem_type in QUESTION_TYPES
+                if (match := re.search(r"(\d+)道" + FUSED_PROBLEM_SECTIONS[problem_type][1][:3], prompt))
+            }
+            problems = check_fused_problem_format(response, list(nums))
+            return chunk, nums, [question for questions in problems.values() for question in questions]
+        return chunk, {family: StandInBackend.problem_number(prompt)}, check_problem_format(response, family)
+    except ValueError:
+        return None
+
+
+def build_prompt(chunk: str, nums: dict[str, int]) -> str:
+    if len(nums) == 1:
+        problem_type, num = next(iter(nums.items()))
+        return PROBLEM_PROMPT_FUNC[problem_type](chunk, num)
+    return PROBLEM_FUSED_PROMPT(chunk, nums)
+
+
+def load_record_corpus(record_file: str) -> list[tuple[str, dict[str, int], list[dict]]]:
+    corpus = []
+    with open(record_file, "r", encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record['family'] in QUESTION_TYPES + ['fused']:
+                item = parse_record(record['family'], record['prompt'], record['response'])
+                if item is not None:
+                    corpus.append(item)
+    return corpus
+
+
+def topic_paragraph(rng: random.Random, word_number: int) -> str:
+    """
+    a paragraph of the synthetic words and the terms of its own topic, so that the sections of a chunk differ in the words
+    """
+    terms = [f"{rng.choice(WORDS)}{rng.randint(0, 999)}" for _ in range(8)]
+    sentences = []
+    for sentence in random_paragraph(rng, word_number).split(". "):
+        words = sentence.split()
+        for _ in range(3):
+            words[rng.randrange(len(words))] = rng.choice(terms)
+        sentences.append(" ".join(words))
+    return ". ".join(sentences)
+
+
+def stand_in_corpus(number: int, seed: int) -> list[tuple[str, dict[str, int], list[dict]]]:
+    rng = random.Random(seed)
+    backend = StandInBackend(latency_scale=0, seed=seed)
+    corpus = []
+    for i in range(number):
+        chunk = "\n\n".join(f"{i} Section\n" + topic_paragraph(rng, 400) for _ in range(rng.randint(2, 10)))
+        nums = {problem_type: 1 for problem_type in QUESTION_TYPES}
+        prompt = build_prompt(chunk, nums)
+        corpus.append(parse_record('fused', prompt, backend.chat(prompt)))
+    return corpus
+
+
+def content_words(text: str) -> set[str]:
+    return {token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS}
+
+
+def support(question: dict, context_words: set[str]) -> float:
+    words = content_words(" ".join(str(value) for value in question.values()))
+    return len(words & context_words) / len(words) if words else 1.0
+
+
+def evaluate_support(corpus, compressor: PromptCompressor) -> dict:
+    full_supports, compressed_supports, full_tokens, compressed_tokens = [], [], 0, 0
+    for chunk, nums, questions in corpus:
+        compressed = compressor.compress(chunk, sum(nums.values()))
+        full_tokens += estimate_tokens(build_prompt(chunk, nums))
+        compressed_tokens += estimate_tokens(build_prompt(compressed, nums))
+        full_words, compressed_words = content_words(chunk), content_words(compressed)
+        for question in questions:
+            full_supports.append(support(question, full_words))
+            compressed_supports.append(support(question, compressed_words))
+    return {
+        'questions': len(full_supports),
+        'full_support': sum(full_supports) / max(len(full_supports), 1),
+        'compressed_support': sum(compressed_supports) / max(len(compressed_supports), 1),
+        # the questions which lose more than 20% of their support
+        'degraded': sum(full - compressed > 0.2 for full, compressed in zip(full_supports, compressed_supports)) / max(len(full_supports), 1),
+        'token_ratio': compressed_tokens / max(full_tokens, 1),
+    }
+
+
+def regenerate(corpus, compressor: PromptCompressor, compress: bool) -> dict:
+    backend = get_backend()
+    valid, requested, supports, seconds = 0, 0, [], 0.0
+    for chunk, nums, _ in corpus:
+        text = compressor.compress(chunk, sum(nums.values())) if compress else chunk
+        prompt = build_prompt(text, nums)
+        start = time.perf_counter()
+        response = backend.chat(prompt)
+        seconds += time.perf_counter() - start
+        item = parse_record('fused' if len(nums) > 1 else next(iter(nums)), prompt, response)
+        questions = item[2] if item else []
+        valid += min(len(questions), sum(nums.values()))
+        requested += sum(nums.values())
+        full_words = content_words(chunk)
+        supports.extend(support(question, full_words) for question in questions)
+    return {
+        'yield': valid / max(requested, 1),
+        'support': sum(supports) / max(len(supports), 1),
+        'seconds_per_call': seconds / max(len(corpus), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the compression of the chunks in the problem prompts")
+    parser.add_argument("--record-file", default=LLM_RECORD_FILE)
+    parser.add_argument("--number", type=int, default=50, help="the synthetic chunks without a record file")
+    parser.add_argument("--regenerate", action="store_true", help="send the full and the compressed prompts to the LLM backend")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.record_file):
+        corpus = load_record_corpus(args.record_file)
+        print(f"{len(corpus)} recorded problem prompts from {args.record_file}")
+    else:
+        corpus = stand_in_corpus(args.number, args.seed)
+        print(f"{len(corpus)} stand-in problem prompts of synthetic chunks")
+    compressor = PromptCompressor()
+    result = evaluate_support(corpus, compressor)
+    print(f"questions: {result['questions']}  support full: {result['full_support']:.1%}  compressed: {result['compressed_support']:.1%}  "
+          f"degraded: {result['degraded']:.1%}  input tokens: {result['token_ratio']:.1%} of the full prompts")
+    if args.regenerate:
+        for name, compress in [("full", False), ("compressed", True)]:
+            result = regenerate(corpus, compressor, compress)
+            print(f"{name:<10} question yield: {result['yield']:.1%}  support in the full chunk: {result['support']:.1%}  "
+                  f"latency: {result['seconds_per_call'] * 1000:.0f}ms per call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+End-to-end load test of the Flask app with scripted user journeys.
+The app is served in this process by a threaded werkzeug server on a fresh sqlite file, arXiv and llmsherpa are replaced by
+the HTTP stand-ins of stand_in_services.py and the LLM by the stand-in backend of llm_backend.py.
+
+A journey: register -> upload documents -> list documents -> wait until the documents are ingested -> generate an exam, get it and answer it for each document
+-> get the recommendations and the user profile.
+
+The report has the latency percentiles and histogram and the error rate of each endpoint, and the sqlite lock waits:
+the time of the write statements and of the commits, which is where sqlite waits for the database lock,
+and the number of "database is locked" errors.
+
+usage:
+    python benchmarks/load_test.py [--users 8] [--journeys 16] [--documents 2] [--llm-latency-scale 1] [--service-latency-scale 1] [--output report.json]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from threading import Lock, Thread, local
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor, Request
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from synthetic import synthetic_arxiv_id
+
+# the seconds between the polls of the status of an uploaded document
+DOCUMENT_STATUS_POLL_INTERVAL = 0.5
+
+# the upper bounds of the histogram buckets in ms
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, float('inf')]
+
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE")
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.lock = Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.error_messages: dict[str, dict[str, int]] = {}
+
+    def record(self, name: str, latency: float, error: str | None = None):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(latency)
+            self.errors.setdefault(name, 0)
+            if error is not None:
+                self.errors[name] += 1
+                messages = self.error_messages.setdefault(name, {})
+                messages[error] = messages.get(error, 0) + 1
+
+    def summary(self, wall_time: float) -> dict[str, dict]:
+        summary = {}
+        with self.lock:
+            for name, latencies in self.latencies.items():
+                latencies_ms = np.array(latencies) * 1000
+                histogram = [0] * len(HISTOGRAM_BUCKETS)
+                for latency in latencies_ms:
+                    histogram[bisect_left(HISTOGRAM_BUCKETS, latency)] += 1
+                summary[name] = {
+                    'count': len(latencies),
+                    'errors': self.errors[name],
+                    'error_rate': self.errors[name] / len(latencies),
+                    'rps': len(latencies) / wall_time,
+                    'p50_ms': float(np.percentile(latencies_ms, 50)),
+                    'p90_ms': float(np.percentile(latencies_ms, 90)),
+                    'p99_ms': float(np.percentile(latencies_ms, 99)),
+                    'max_ms': float(latencies_ms.max()),
+                    'histogram': {f"<={bucket}ms": count for bucket, count in zip(HISTOGRAM_BUCKETS, histogram) if count},
+                    'error_messages': self.error_messages.get(name, {}),
+                }
+        return summary
+
+
+class DBLockMonitor:
+    """
+    time the write statements and the commits of the app, sqlite takes the write lock at the first write statement
+    of a transaction and waits for the readers at the commit
+    """
+    def __init__(self, engine, recorder: LatencyRecorder):
+        from sqlalchemy import event
+        from sqlalchemy.orm import Session
+        self.recorder = recorder
+        self.local = local()
+        self.locked_number = 0
+        self.lock = Lock()
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(engine, 'handle_error', self.handle_error)
+        event.listen(engine, 'commit', self.before_commit)
+        event.listen(Session, 'after_commit', self.after_commit)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.statement_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(WRITE_STATEMENTS):
+            self.recorder.record("db write statement", time.perf_counter() - self.local.statement_start)
+
+    def handle_error(self, exception_context):
+        if "database is locked" in str(exception_context.original_exception):
+            with self.lock:
+                self.locked_number += 1
+
+    def before_commit(self, conn):
+        self.local.commit_start = time.perf_counter()
+
+    def after_commit(self, session):
+        commit_start = getattr(self.local, 'commit_start', None)
+        if commit_start is not None:
+            self.recorder.record("db commit", time.perf_counter() - commit_start)
+            self.local.commit_start = None
+
+
+class Client:
+    """
+    a user of the app with its own cookies, the app identifies the user by the myusername parameter when
+    USE_LOW_USER_AUTHORIZATION is set and by the login cookie otherwise
+    """
+    def __init__(self, base_url: str, username: str, recorder: LatencyRecorder, timeout: float):
+        self.base_url = base_url
+        self.username = username
+        self.recorder = recorder
+        self.timeout = timeout
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method: str, endpoint: str, **params) -> dict | None:
+        """
+        return:
+            the json of the response, None if the request failed
+        """
+        params = {'myusername': self.username, **params}
+        if method == "GET":
+            request = Request(f"{self.base_url}{endpoint}?{urlencode(params)}")
+        else:
+            request = Request(f"{self.base_url}{endpoint}", data=urlencode(params).encode(), method="POST")
+        start = time.perf_counter()
+        data, error = None, None
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                data = json.loads(response.read())
+            if isinstance(data, dict) and data.get('success') is False:
+                error = str(data.get('message'))
+        except HTTPError as e:
+            error = f"HTTP {e.code}"
+        except (URLError, TimeoutError, ConnectionError, json.JSONDecodeError) as e:
+            error = type(e).__name__
+        self.recorder.record(f"{method} {endpoint}", time.perf_counter() - start, error)
+        return data if error is None else None
+
+    def get(self, endpoint: str, **params) -> dict | None:
+        return self.request("GET", endpoint, **params)
+
+    def post(self, endpoint: str, **params) -> dict | None:
+        return self.request("POST", endpoint, **params)
+
+
+def fake_answer(question: dict, rng: random.Random) -> str:
+    if question['question_type'] == 0:
+        return rng.choice("ABCD")
+    if question['question_type'] == 1:
+        return rng.choice(["正确", "错误"])
+    if question['question_type'] == 2:
+        return rng.choice(["transformer", "attention", "retrieval", "embedding"])
+    return "The method is novel, but the evaluation is limited to a few benchmarks."
+
+
+def find_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_journey(client: Client, journey_index: int, document_number: int, shared_paper_ratio: float, rng: random.Random):
+    if client.post('/register', username=client.username, email=f"{client.username}@example.com", password="123456") is None:
+        return
+    document_id_list = []
+    for i in range(document_number):
+        if rng.random() < shared_paper_ratio:
+            # a popular paper uploaded by many users
+            arxiv_id = synthetic_arxiv_id(rng.randrange(5))
+        else:
+            arxiv_id = synthetic_arxiv_id(1000 + journey_index * document_number + i)
+        data = client.post('/upload_document', pdf_url=f"https://arxiv.org/abs/{arxiv_id}")
+        if data is not None:
+            document_id_list.append(data['document_id'])
+    client.get('/get_documents')
+    for document_id in document_id_list:
+        # the documents are ingested in the background
+        while (data := client.get('/get_document_status', document_id=document_id)) is not None \
+                and data['status'] not in ('ready', 'failed'):
+            time.sleep(DOCUMENT_STATUS_POLL_INTERVAL)
+        data = client.post('/generate_exam', document_id=document_id)
+        if data is None:
+            continue
+        exam = client.get('/get_exam', exam_id=data['exam_id'])
+        if exam is None:
+            continue
+        user_answers = {question['question_id']: fake_answer(question, rng) for question in exam['questions']}
+        client.post('/answer_exam', exam_id=data['exam_id'], user_answers=json.dumps(user_answers))
+    client.get('/get_recommendations')
+    client.get('/get_user_profile')
+
+
+def print_report(report: dict):
+    print(f"\n{report['journeys']} journeys of {report['users']} concurrent users in {report['wall_time_s']:.1f}s, "
+          f"{report['total_requests']} requests, {report['total_requests'] / report['wall_time_s']:.2f} requests/s")
+    print(f"{'endpoint':<28} {'count':>6} {'err%':>6} {'rps':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, summary in report['endpoints'].items():
+        print(f"{name:<28} {summary['count']:>6} {summary['error_rate'] * 100:>5.1f}% {summary['rps']:>7.2f} "
+              f"{summary['p50_ms']:>7.0f}ms {summary['p90_ms']:>7.0f}ms {summary['p99_ms']:>7.0f}ms {summary['max_ms']:>7.0f}ms")
+    print("\nhistograms (upper bound in ms: count)")
+    for name, summary in {**report['endpoints'], **report['db']}.items():
+        print(f"{name:<28} " + " ".join(f"{bucket}:{count}" for bucket, count in summary['histogram'].items()))
+    print(f"\n\"database is locked\" errors: {report['database_locked_errors']}")
+    for name, summary in report['endpoints'].items():
+        for message, count in summary['error_messages'].items():
+            print(f"error {name}: {message} x{count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app with scripted user journeys")
+    parser.add_argument("--users", type=int, default=8, help="the number of concurrent users")
+    parser.add_argument("--journeys", type=int, default=16, help="the total number of journeys")
+    parser.add_argument("--documents", type=int, default=2, help="the documents uploaded in a journey")
+    parser.add_argument("--shared-paper-ratio", type=float, default=0.2, help="the ratio of the uploads of a few popular papers")
+    parser.add_argument("--paragraphs", type=int, default=200, help="the paragraphs of each parsed pdf")
+    parser.add_argument("--llm-latency-scale", type=float, default=1.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0)
+    parser.add_argument("--service-latency-scale", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=300, help="the timeout of a request in seconds")
+    parser.add_argument("--work-dir", default=None, help="the directory of the database and the documents, a temporary one by default")
+    parser.add_argument("--output", default=None, help="save the report as json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="read-hub-load-test-")
+    os.makedirs(work_dir, exist_ok=True)
+    output = os.path.abspath(args.output) if args.output else None
+    # the data directories of the app are relative to the working directory
+    os.chdir(work_dir)
+    # the stand-ins are configured by the environment variables read by constants.py, so they are set before any import of the app
+    service_port = find_free_port()
+    os.environ["ARXIV_API_URL"] = f"http://127.0.0.1:{service_port}/api/query"
+    os.environ["LLMSERPA_API_URL"] = f"http://127.0.0.1:{service_port}/parse"
+    os.environ["LLM_BACKEND"] = "stand_in"
+    os.environ["STAND_IN_LATENCY_SCALE"] = str(args.llm_latency_scale)
+    os.environ["STAND_IN_ERROR_RATE"] = str(args.llm_error_rate)
+    os.environ["STAND_IN_MALFORMED_RATE"] = str(args.llm_malformed_rate)
+    os.environ["STAND_IN_SEED"] = str(args.seed)
+
+    from stand_in_services import StandInServices
+    from werkzeug.serving import make_server
+    from app import app, db, add_default_user
+    services = StandInServices(port=service_port, latency_scale=args.service_latency_scale, paragraph_number=args.paragraphs, seed=args.seed).start()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.abspath('load_test.db')}"
+    db.init_app(app)
+    recorder = LatencyRecorder()
+    with app.app_context():
+        db.create_all()
+        add_default_user()
+        monitor = DBLockMonitor(db.engine, recorder)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    print(f"app at {base_url}, work dir {work_dir}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [
+            pool.submit(
+                run_journey, Client(base_url, f"user{i}", recorder, args.timeout), i, args.documents,
+                args.shared_paper_ratio, random.Random(args.seed * 100003 + i),
+            )
+            for i in range(args.journeys)
+        ]
+        for future in futures:
+            future.result()
+    wall_time = time.perf_counter() - start
+    server.shutdown()
+    services.stop()
+
+    summary = recorder.summary(wall_time)
+    report = {
+        'users': args.users,
+        'journeys': args.journeys,
+        'wall_time_s': wall_time,
+        'endpoints': {name: value for name, value in summary.items() if not name.startswith("db ")},
+        'db': {name: value for name, value in summary.items() if name.startswith("db ")},
+        'database_locked_errors': monitor.locked_number,
+        'stand_in_requests': services.request_number,
+    }
+    report['total_requests'] = sum(value['count'] for value in report['endpoints'].values())
+    print_report(report)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
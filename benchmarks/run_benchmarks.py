@@ -0,0 +1,157 @@
+"""
+Run the microbenchmark cases and compare them with the previous run.
+A case is a function case_<name> in benchmarks/bench_*.py which prepares the inputs and returns the function to time.
+The results are saved to benchmarks/results/<git revision>.json, the comparison is against the latest saved run of
+another revision, or of the --baseline revision.
+
+usage:
+    python benchmarks/run_benchmarks.py [pattern] [--rounds 5] [--baseline <revision>] [--threshold 1.2] [--strict] [--no-save]
+"""
+import argparse
+import glob
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from typing import Callable
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_DIR = os.path.join(BENCHMARK_DIR, "results")
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+
+def discover_cases(pattern: str | None = None) -> dict[str, Callable[[], Callable]]:
+    """
+    return:
+        "<module>.<case>" -> the setup function of the case, the module name is without the bench_ prefix
+    """
+    cases = {}
+    for path in sorted(glob.glob(os.path.join(BENCHMARK_DIR, "bench_*.py"))):
+        module_name = os.path.basename(path)[:-3]
+        module = importlib.import_module(module_name)
+        for name in dir(module):
+            if not name.startswith("case_"):
+                continue
+            case_name = f"{module_name[len('bench_'):]}.{name[len('case_'):]}"
+            if pattern is None or pattern in case_name:
+                cases[case_name] = getattr(module, name)
+    return cases
+
+
+def time_case(setup: Callable[[], Callable], rounds: int) -> dict[str, float]:
+    """
+    return:
+        the statistics of the seconds per call over the rounds, each round runs the case enough times to last 0.2 seconds
+    """
+    func = setup()
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    times = [total / loops for total in timer.repeat(repeat=rounds, number=loops)]
+    return {
+        'loops': loops,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+
+def git_revision() -> str:
+    """
+    the short sha of HEAD, with a -dirty suffix if the tracked files are modified
+    """
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCHMARK_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if dirty else revision
+
+
+def save_results(revision: str, results: dict[str, dict]) -> str:
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    path = os.path.join(RESULT_DIR, f"{revision}.json")
+    # the cases which are not run this time are kept
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            results = {**json.load(f)['results'], **results}
+    with open(path, "w") as f:
+        json.dump({
+            'revision': revision,
+            'time': time.time(),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'results': results,
+        }, f, indent=2)
+    return path
+
+
+def load_previous_results(revision: str, baseline: str | None = None) -> dict | None:
+    """
+    return:
+        the saved run of the baseline revision, or the latest saved run of another revision
+    """
+    runs = []
+    for path in glob.glob(os.path.join(RESULT_DIR, "*.json")):
+        with open(path, "r") as f:
+            runs.append(json.load(f))
+    if baseline is not None:
+        runs = [run for run in runs if run['revision'] == baseline]
+    else:
+        runs = [run for run in runs if run['revision'] != revision]
+    return max(runs, key=lambda run: run['time'], default=None)
+
+
+def compare(results: dict[str, dict], previous: dict | None, threshold: float) -> list[str]:
+    """
+    print the results and the ratio to the previous run
+    return:
+        the cases whose median is more than threshold times the previous one
+    """
+    previous_results = previous['results'] if previous else {}
+    regressions = []
+    header = f"{'case':<40} {'median':>12} {'stdev':>10}"
+    if previous:
+        header += f" {previous['revision']:>14} {'ratio':>7}"
+    print(header)
+    for name, result in results.items():
+        line = f"{name:<40} {result['median'] * 1000:10.3f}ms {result['stdev'] * 1000:8.3f}ms"
+        if name in previous_results:
+            ratio = result['median'] / previous_results[name]['median']
+            line += f" {previous_results[name]['median'] * 1000:12.3f}ms {ratio:6.2f}x"
+            if ratio > threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the microbenchmark cases in benchmarks/bench_*.py")
+    parser.add_argument("pattern", nargs="?", default=None, help="only run the cases whose name contains the pattern")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--baseline", default=None, help="compare with the saved run of this revision")
+    parser.add_argument("--threshold", type=float, default=1.2, help="the median ratio reported as a regression")
+    parser.add_argument("--strict", action="store_true", help="exit with 1 if there is a regression")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    revision = git_revision()
+    results = {}
+    for name, setup in discover_cases(args.pattern).items():
+        results[name] = time_case(setup, args.rounds)
+    regressions = compare(results, load_previous_results(revision, args.baseline), args.threshold)
+    if not args.no_save:
+        print(f"saved to {save_results(revision, results)}")
+    if regressions and args.strict:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Local HTTP stand-ins of the external services used by the app, for the load tests:
+    GET  /api/query?id_list=<ids> or ?search_query=...&start=&max_results=   the arXiv Atom API
+    GET  /pdf/<arxiv id>                                                     the pdf download
+    POST /parse                                                              the llmsherpa parser
+Each route answers after a latency sampled from its distribution, see llm_backend.LatencyDistribution.
+
+usage:
+    python benchmarks/stand_in_services.py [port]
+then export ARXIV_API_URL=http://127.0.0.1:<port>/api/query LLMSERPA_API_URL=http://127.0.0.1:<port>/parse
+"""
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import urlparse, parse_qs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_backend import LatencyDistribution
+from synthetic import synthetic_atom_feed, synthetic_arxiv_id, synthetic_layout_blocks
+
+DEFAULT_LATENCY = {
+    'arxiv': "lognormal:400,0.5",
+    'pdf': "lognormal:800,0.5",
+    'parse': "lognormal:3000,0.4",
+}
+
+
+class StandInServices:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: dict[str, str] = DEFAULT_LATENCY,
+                 latency_scale: float = 1.0, paragraph_number: int = 200, seed: int = 0):
+        """
+        args:
+            port: 0 to pick a free port
+            latency: route (arxiv, pdf, parse) -> latency distribution
+            latency_scale: multiply the sampled latencies, 0 to answer at once
+            paragraph_number: the number of paragraphs of each parsed pdf
+        """
+        self.latency = {route: LatencyDistribution(spec) for route, spec in latency.items()}
+        self.latency_scale = latency_scale
+        self.paragraph_number = paragraph_number
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.request_number: dict[str, int] = {route: 0 for route in latency}
+        self.server = ThreadingHTTPServer((host, port), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread: Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def arxiv_api_url(self) -> str:
+        return f"{self.base_url}/api/query"
+
+    @property
+    def llmsherpa_api_url(self) -> str:
+        return f"{self.base_url}/parse"
+
+    def wait(self, route: str):
+        with self.lock:
+            self.request_number[route] += 1
+            latency = self.latency[route].sample(self.rng) * self.latency_scale
+        time.sleep(latency)
+
+    def arxiv_response(self, query: dict[str, list[str]]) -> bytes:
+        if 'id_list' in query:
+            arxiv_id_list = [arxiv_id for arxiv_id in query['id_list'][0].split(',') if arxiv_id]
+            # the same paper always has the same title and abstract
+            seed = zlib.crc32(",".join(arxiv_id_list).encode())
+        else:
+            start = int(query.get('start', ['0'])[0])
+            max_results = int(query.get('max_results', ['10'])[0])
+            seed = zlib.crc32(query.get('search_query', [''])[0].encode()) + start
+            # the search results are different papers from the uploaded ones
+            arxiv_id_list = [synthetic_arxiv_id(90000 + (seed + i) % 10000) for i in range(max_results)]
+        return synthetic_atom_feed(arxiv_id_list, seed=seed, pdf_base_url=f"{self.base_url}/pdf").encode()
+
+    def parse_response(self, body: bytes) -> bytes:
+        blocks = synthetic_layout_blocks(self.paragraph_number, seed=zlib.crc32(body[:4096]))
+        return json.dumps({'return_dict': {'result': {'blocks': blocks}}}).encode()
+
+    def create_handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send(self, body: bytes, content_type: str, status: int = 200):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/api/query":
+                    services.wait('arxiv')
+                    self.send(services.arxiv_response(parse_qs(url.query)), "application/atom+xml")
+                elif url.path.startswith("/pdf/"):
+                    services.wait('pdf')
+                    self.send(b"%PDF-1.4\n" + url.path.encode() + b"\n%%EOF\n", "application/pdf")
+                else:
+                    self.send(b"not found", "text/plain", 404)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if urlparse(self.path).path == "/parse":
+                    services.wait('parse')
+                    self.send(services.parse_response(body), "application/json")
+                else:
+                    self.send(b"not found", "text/plain", 404)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StandInServices":
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    services = StandInServices(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8001)
+    print(f"ARXIV_API_URL={services.arxiv_api_url}")
+    print(f"LLMSERPA_API_URL={services.llmsherpa_api_url}")
+    services.server.serve_forever()
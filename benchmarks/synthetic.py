@@ -0,0 +1,155 @@
+"""
+Synthetic inputs of realistic shape for the benchmarks and the load tests: pdf layouts, LLM outputs, libraries and arXiv feeds.
+"""
+import json
+import os
+import random
+import sys
+from xml.sax.saxutils import escape
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = (
+    "transformer attention retrieval embedding graph diffusion policy gradient convolution benchmark dataset "
+    "representation contrastive language vision reinforcement optimization sparse dense latent variational "
+    "generalization robustness efficient scalable neural model training inference evaluation baseline ablation"
+).split()
+
+SECTION_TITLES = ["Abstract", "1 Introduction", "2 Related Work", "3 Method", "4 Experiments", "5 Analysis", "6 Conclusion"]
+
+
+def random_sentence(rng: random.Random, word_number: int = 16) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(word_number)).capitalize() + "."
+
+
+def random_paragraph(rng: random.Random, word_number: int = 80) -> str:
+    return " ".join(random_sentence(rng) for _ in range(max(1, word_number // 16)))
+
+
+class LayoutChunk:
+    """
+    the part of llmsherpa.readers.layout_reader.Block used by save_pdf_text_chunks
+    """
+    def __init__(self, section_title: str, text: str):
+        self.section_title = section_title
+        self.text = text
+
+    def to_context_text(self) -> str:
+        return f"{self.section_title}\n{self.text}"
+
+
+class LayoutDocument:
+    """
+    the part of llmsherpa.readers.Document used by save_pdf_text_chunks
+    """
+    def __init__(self, layout_chunks: list[LayoutChunk]):
+        self.layout_chunks = layout_chunks
+
+    def chunks(self) -> list[LayoutChunk]:
+        return self.layout_chunks
+
+
+def synthetic_layout(paragraph_number: int = 2000, paragraph_words: int = 80, seed: int = 0) -> LayoutDocument:
+    """
+    a decoded pdf with the paragraphs spread over the sections, followed by the references
+    """
+    rng = random.Random(seed)
+    layout_chunks = []
+    for i in range(paragraph_number):
+        section_title = SECTION_TITLES[min(i * len(SECTION_TITLES) // paragraph_number, len(SECTION_TITLES) - 1)]
+        layout_chunks.append(LayoutChunk(section_title, random_paragraph(rng, paragraph_words)))
+    layout_chunks += [LayoutChunk("References", f"[{i}] A. Author. A paper. 2024.") for i in range(50)]
+    return LayoutDocument(layout_chunks)
+
+
+def synthetic_llm_outputs(number_per_type: int = 20, seed: int = 0) -> list[tuple[str, str]]:
+    """
+    return:
+        list of (response, problem_type), the stand-in responses dressed like the live ones:
+        a leading sentence, a markdown code fence, indentation and python style single quotes
+    """
+    from llm_backend import StandInBackend
+    from utils import PROBLEM_PROMPT_FUNC
+    rng = random.Random(seed)
+    backend = StandInBackend(latency_scale=0, seed=seed)
+    outputs = []
+    for problem_type, prompt_func in PROBLEM_PROMPT_FUNC.items():
+        for i in range(number_per_type):
+            response = backend.chat(prompt_func(random_paragraph(rng, 400) + f" {i}", 3))
+            data = json.loads(response)
+            response = json.dumps(data, ensure_ascii=False, indent=rng.choice([None, 2, 4]))
+            if rng.random() < 0.5:
+                response = response.replace('"', "'")
+            if rng.random() < 0.5:
+                response = f"```json\n{response}\n```"
+            if rng.random() < 0.5:
+                response = f"好的，以下是根据论文内容给出的结果：\n{response}\n希望对你有帮助。"
+            outputs.append((response, problem_type))
+    return outputs
+
+
+def synthetic_library(document_number: int = 1000, abstract_words: int = 200, seed: int = 0) -> list[tuple[str, str]]:
+    """
+    return:
+        list of (title, abstract) like User.get_summary_of_documents
+    """
+    rng = random.Random(seed)
+    return [(random_sentence(rng, 10), random_paragraph(rng, abstract_words)) for _ in range(document_number)]
+
+
+def synthetic_labels(label_number: int = 20, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))) for _ in range(label_number)]
+
+
+def synthetic_arxiv_id(i: int) -> str:
+    return f"24{i // 100000 % 12 + 1:02d}.{i % 100000:05d}"
+
+
+def synthetic_layout_blocks(paragraph_number: int = 200, paragraph_words: int = 80, seed: int = 0) -> list[dict]:
+    """
+    the blocks of a llmsherpa parse response, headers of level 0 followed by their paragraphs
+    """
+    rng = random.Random(seed)
+    blocks = []
+    section_index = -1
+    for i in range(paragraph_number):
+        if i * len(SECTION_TITLES) // paragraph_number != section_index:
+            section_index = i * len(SECTION_TITLES) // paragraph_number
+            blocks.append({'tag': 'header', 'level': 0, 'sentences': [SECTION_TITLES[section_index]], 'page_idx': i // 10, 'block_idx': len(blocks)})
+        sentences = [random_sentence(rng) for _ in range(max(1, paragraph_words // 16))]
+        blocks.append({'tag': 'para', 'level': 1, 'sentences': sentences, 'page_idx': i // 10, 'block_idx': len(blocks)})
+    blocks.append({'tag': 'header', 'level': 0, 'sentences': ["References"], 'page_idx': paragraph_number // 10, 'block_idx': len(blocks)})
+    blocks.append({'tag': 'list_item', 'level': 1, 'sentences': ["[1] A. Author. A paper. 2024."], 'page_idx': paragraph_number // 10, 'block_idx': len(blocks)})
+    return blocks
+
+
+def synthetic_atom_entry(arxiv_id: str, rng: random.Random, pdf_base_url: str = "http://arxiv.org/pdf") -> str:
+    authors = "".join(f"<author><name>{escape(random_sentence(rng, 2)[:-1])}</name></author>" for _ in range(rng.randint(1, 8)))
+    return f"""<entry>
+<id>http://arxiv.org/abs/{arxiv_id}v1</id>
+<updated>2024-01-01T00:00:00Z</updated>
+<published>2024-01-01T00:00:00Z</published>
+<title>{escape(random_sentence(rng, 10))}</title>
+<summary>{escape(random_paragraph(rng, 200))}</summary>
+{authors}
+<link href="http://arxiv.org/abs/{arxiv_id}v1" rel="alternate" type="text/html"/>
+<link title="pdf" href="{pdf_base_url}/{arxiv_id}v1" rel="related" type="application/pdf"/>
+<arxiv:primary_category xmlns:arxiv="http://arxiv.org/schemas/atom" term="cs.CL" scheme="http://arxiv.org/schemas/atom"/>
+</entry>
+"""
+
+
+def synthetic_atom_feed(arxiv_id_list: list[str], seed: int = 0, pdf_base_url: str = "http://arxiv.org/pdf") -> str:
+    """
+    an arXiv API response with one entry per id
+    """
+    rng = random.Random(seed)
+    entries = "".join(synthetic_atom_entry(arxiv_id, rng, pdf_base_url) for arxiv_id in arxiv_id_list)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<title type="html">ArXiv Query</title>
+<id>http://arxiv.org/api/query</id>
+<updated>2024-01-01T00:00:00-05:00</updated>
+<opensearch:totalResults xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">{len(arxiv_id_list)}</opensearch:totalResults>
+{entries}</feed>
+"""
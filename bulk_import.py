@@ -0,0 +1,101 @@
+"""
+The bulk import of a library of papers. The arXiv ids are read from a list of ids or urls and from a BibTeX file,
+the metadata of all the papers is fetched by id_list queries (get_base_info_with_paper_id_list) and the documents are
+created with the metadata stage completed, in commits of IMPORT_COMMIT_BATCH_SIZE documents. The ingestion pipeline
+then downloads, parses, chunks and indexes them with the parallelism of its stages, see ingestion.py, and the app
+refreshes the profile of the user once at the end of the import instead of after each document. The import is a
+DocumentImport row, so an import interrupted by a restart still ends with one refresh.
+"""
+import os
+import re
+import uuid
+from constants import DOCUMENT_DIR_PREFIX, IMPORT_COMMIT_BATCH_SIZE
+from ingestion import save_paper_info
+from models import db, Document, DocumentImport, User, INGESTION_STAGE_LIST
+
+# the new style ids like 2309.10305 and the old style ids like hep-th/9901001, the version is not a part of the id
+ARXIV_ID = r"(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?"
+ARXIV_ID_PATTERN = re.compile(ARXIV_ID)
+# the fields of a BibTeX entry which give the arXiv id, in the order they are tried
+BIBTEX_ARXIV_PATTERNS = [
+    re.compile(r"\beprint\s*=\s*[{\"]?\s*(?:arxiv:)?" + ARXIV_ID, re.I),
+    re.compile(r"arxiv\.org/(?:abs|pdf)/" + ARXIV_ID, re.I),
+    re.compile(r"10\.48550/arxiv\." + ARXIV_ID, re.I),
+    re.compile(r"\barxiv[:\s]\s*" + ARXIV_ID, re.I),
+]
+BIBTEX_ENTRY_PATTERN = re.compile(r"@(\w+)\s*[{(]\s*([^,\s]*)\s*,")
+BIBTEX_NON_ENTRY_TYPES = {'comment', 'string', 'preamble'}
+
+
+def unique(items: list[str]) -> list[str]:
+    return list(dict.fromkeys(items))
+
+
+def read_arxiv_id_list(text: str) -> tuple[list[str], list[str]]:
+    """
+    args:
+        text: the arXiv ids or urls separated by whitespaces or commas
+    return:
+        the arXiv ids without duplicates, the items which are not arXiv ids or urls
+    """
+    arxiv_id_list, unrecognized_list = [], []
+    for item in re.split(r"[\s,;]+", text):
+        if not item:
+            continue
+        match = ARXIV_ID_PATTERN.search(item)
+        if match is None:
+            unrecognized_list.append(item)
+        else:
+            arxiv_id_list.append(match.group(1))
+    return unique(arxiv_id_list), unrecognized_list
+
+
+def read_bibtex_arxiv_id_list(bibtex: str) -> tuple[list[str], list[str]]:
+    """
+    the arXiv id of an entry is taken from its eprint, url, doi or journal (arXiv preprint arXiv:...) field
+    return:
+        the arXiv ids without duplicates, the keys of the entries without an arXiv id
+    """
+    matches = list(BIBTEX_ENTRY_PATTERN.finditer(bibtex))
+    arxiv_id_list, unrecognized_list = [], []
+    for i, match in enumerate(matches):
+        if match.group(1).lower() in BIBTEX_NON_ENTRY_TYPES:
+            continue
+        entry = bibtex[match.end(): matches[i + 1].start() if i + 1 < len(matches) else len(bibtex)]
+        for pattern in BIBTEX_ARXIV_PATTERNS:
+            arxiv_match = pattern.search(entry)
+            if arxiv_match is not None:
+                arxiv_id_list.append(arxiv_match.group(1))
+                break
+        else:
+            unrecognized_list.append(match.group(2))
+    return unique(arxiv_id_list), unrecognized_list
+
+
+def create_import_documents(user: User, paper_info_dict: dict[str, dict], batch_size: int = IMPORT_COMMIT_BATCH_SIZE) -> tuple[int | None, list[int]]:
+    """
+    create the import and the documents of the papers with the metadata stage completed
+    args:
+        paper_info_dict: arXiv id -> the base info of the paper, by get_base_info_with_paper_id_list
+    return:
+        the id of the import, None if there is no paper, and the ids of the documents, in the order of paper_info_dict
+    """
+    if not paper_info_dict:
+        return None, []
+    document_import = DocumentImport(user_id=user.id)
+    db.session.add(document_import)
+    paper_info_items = list(paper_info_dict.items())
+    document_id_list = []
+    for begin in range(0, len(paper_info_items), batch_size):
+        documents = []
+        for arxiv_id, paper_info in paper_info_items[begin: begin + batch_size]:
+            document = Document(
+                user=user, base_dir=os.path.join(DOCUMENT_DIR_PREFIX, str(uuid.uuid4())),
+                arxiv_id=arxiv_id, status=INGESTION_STAGE_LIST[0], document_import=document_import
+            )
+            save_paper_info(document, paper_info)
+            documents.append(document)
+        db.session.add_all(documents)
+        db.session.commit()
+        document_id_list += [document.id for document in documents]
+    return document_import.id, document_id_list
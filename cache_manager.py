@@ -0,0 +1,287 @@
+"""
+The manager of the files under DOCUMENT_DIR_PREFIX:
+    the parse caches: <arxiv id>.pkl (the paper info and the parsed pdf, see arxiv.load_document_data) and <arxiv id>.pdf,
+        they only save the download and the parse of a paper uploaded again, so they are evicted by LRU when they take
+        more than max_bytes, except those of the papers whose documents are still ingesting
+    the chunk dirs: <uuid>/ with the chunk files of a document, never removed while a Document or a Chunk refers to them
+    the temporary files of atomic_write left by a crash
+The access times of the parse caches are kept in an index file, the modification time is used for the files not in it.
+compact() removes the pdfs of the parsed papers, the chunk dirs without a document and the temporary files.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from threading import Lock
+from constants import DOCUMENT_DIR_PREFIX, DOCUMENT_CACHE_MAX_BYTES, DOCUMENT_CACHE_INDEX_FILE, \
+    DOCUMENT_CACHE_INDEX_SAVE_INTERVAL, DOCUMENT_CACHE_GRACE_SECONDS
+from metrics import REGISTRY
+from models import db, Document, Chunk, DocumentStatus
+from utils import atomic_write
+
+DOCUMENT_CACHE_REMOVED_FILES = REGISTRY.counter(
+    "readhub_document_cache_removed_files_total", "The files and dirs removed from the document dir", ("reason",))
+DOCUMENT_CACHE_REMOVED_BYTES = REGISTRY.counter(
+    "readhub_document_cache_removed_bytes_total", "The bytes removed from the document dir", ("reason",))
+
+PARSE_CACHE_KINDS = ('pkl', 'pdf')
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    def __init__(self, path: str, arxiv_id: str, kind: str, size: int, access_time: float):
+        """
+        args:
+            kind: pkl or pdf
+        """
+        self.path = path
+        self.arxiv_id = arxiv_id
+        self.kind = kind
+        self.size = size
+        self.access_time = access_time
+
+
+class CacheScan:
+    def __init__(self):
+        self.entries: list[CacheEntry] = []
+        self.chunk_dirs: list[str] = []
+        self.temp_files: list[str] = []
+
+
+def is_chunk_dir(name: str) -> bool:
+    try:
+        uuid.UUID(name)
+        return True
+    except ValueError:
+        return False
+
+
+def dir_size(path: str) -> int:
+    size = 0
+    for root, _, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                size += os.stat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+class DocumentCache:
+    def __init__(
+        self,
+        cache_dir: str = DOCUMENT_DIR_PREFIX,
+        index_path: str = DOCUMENT_CACHE_INDEX_FILE,
+        max_bytes: int = DOCUMENT_CACHE_MAX_BYTES,
+        grace_seconds: float = DOCUMENT_CACHE_GRACE_SECONDS,
+        save_interval: float = DOCUMENT_CACHE_INDEX_SAVE_INTERVAL,
+    ):
+        """
+        args:
+            max_bytes: the max bytes of the parse caches
+            grace_seconds: the chunk dirs without a document and the temporary files younger than it are kept
+        """
+        self.cache_dir = cache_dir
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.save_interval = save_interval
+        # the path relative to cache_dir -> the last access time
+        self.access_times: dict[str, float] | None = None
+        self.last_save_time = 0.0
+        self.index_lock = Lock()
+        # one eviction or compaction at a time
+        self.lock = Lock()
+
+    def key(self, path: str) -> str:
+        return os.path.relpath(path, self.cache_dir).replace(os.sep, "/")
+
+    def load_index(self) -> dict[str, float]:
+        """
+        call it with the index_lock
+        """
+        if self.access_times is None:
+            self.access_times = {}
+            if os.path.exists(self.index_path):
+                try:
+                    with open(self.index_path, "r", encoding='utf-8') as f:
+                        self.access_times = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Failed to load the document cache index: {e}")
+        return self.access_times
+
+    def save_index(self, force: bool = False):
+        with self.index_lock:
+            access_times = self.load_index()
+            now = time.time()
+            if not force and now - self.last_save_time < self.save_interval:
+                return
+            self.last_save_time = now
+            content = dict(access_times)
+        atomic_write(self.index_path, lambda f: json.dump(content, f))
+
+    def touch(self, path: str):
+        """
+        record an access of a parse cache
+        """
+        with self.index_lock:
+            self.load_index()[self.key(path)] = time.time()
+        self.save_index()
+
+    def scan(self) -> CacheScan:
+        scan = CacheScan()
+        with self.index_lock:
+            access_times = dict(self.load_index())
+        for root, dir_names, file_names in os.walk(self.cache_dir):
+            for name in list(dir_names):
+                if is_chunk_dir(name):
+                    dir_names.remove(name)
+                    scan.chunk_dirs.append(os.path.join(root, name))
+            for name in file_names:
+                path = os.path.join(root, name)
+                if name.startswith(".") and name.endswith(".tmp"):
+                    scan.temp_files.append(path)
+                    continue
+                stem, extension = os.path.splitext(self.key(path))
+                if extension[1:] not in PARSE_CACHE_KINDS:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                scan.entries.append(CacheEntry(path, stem, extension[1:], stat.st_size, access_times.get(self.key(path), stat.st_mtime)))
+        return scan
+
+    @staticmethod
+    def references() -> tuple[set[str], set[str]]:
+        """
+        call it in the app context
+        return:
+            the absolute paths of the chunk dirs of the documents and the chunks,
+            the arxiv ids of the documents still ingesting, whose parse caches are used by the next stages
+        """
+        referenced_dirs = {os.path.abspath(base_dir) for base_dir, in db.session.query(Document.base_dir)}
+        referenced_dirs |= {os.path.abspath(os.path.dirname(file_path)) for file_path, in db.session.query(Chunk.file_path)}
+        protected_arxiv_ids = {
+            arxiv_id for arxiv_id, in db.session.query(Document.arxiv_id).filter(
+                Document.status.notin_([DocumentStatus.READY, DocumentStatus.FAILED])
+            )
+        }
+        return referenced_dirs, protected_arxiv_ids
+
+    def remove(self, path: str, size: int, reason: str):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return
+        DOCUMENT_CACHE_REMOVED_FILES.inc(reason=reason)
+        DOCUMENT_CACHE_REMOVED_BYTES.inc(size, reason=reason)
+        with self.index_lock:
+            self.load_index().pop(self.key(path), None)
+
+    def evict(self, max_bytes: int | None = None) -> list[str]:
+        """
+        remove the least recently used parse caches until they take at most max_bytes, call it in the app context
+        return:
+            the removed paths
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self.lock:
+            scan = self.scan()
+            total = sum(entry.size for entry in scan.entries)
+            if total <= max_bytes:
+                return []
+            _, protected_arxiv_ids = self.references()
+            removed = []
+            for entry in sorted(scan.entries, key=lambda entry: entry.access_time):
+                if total <= max_bytes:
+                    break
+                if entry.arxiv_id in protected_arxiv_ids:
+                    continue
+                self.remove(entry.path, entry.size, "lru")
+                total -= entry.size
+                removed.append(entry.path)
+        self.save_index(force=True)
+        return removed
+
+    def compact(self) -> list[str]:
+        """
+        remove the pdfs of the parsed papers, the chunk dirs without a document and the temporary files,
+        and the missing files from the index, call it in the app context
+        return:
+            the removed paths
+        """
+        with self.lock:
+            scan = self.scan()
+            referenced_dirs, protected_arxiv_ids = self.references()
+            now = time.time()
+            removed = []
+            parsed_arxiv_ids = {entry.arxiv_id for entry in scan.entries if entry.kind == 'pkl'}
+            for entry in scan.entries:
+                if entry.kind == 'pdf' and entry.arxiv_id in parsed_arxiv_ids and entry.arxiv_id not in protected_arxiv_ids:
+                    self.remove(entry.path, entry.size, "parsed_pdf")
+                    removed.append(entry.path)
+            for path in scan.chunk_dirs:
+                if os.path.abspath(path) not in referenced_dirs and now - os.path.getmtime(path) > self.grace_seconds:
+                    self.remove(path, dir_size(path), "orphan_dir")
+                    removed.append(path)
+            for path in scan.temp_files:
+                if now - os.path.getmtime(path) > self.grace_seconds:
+                    self.remove(path, os.path.getsize(path), "temp_file")
+                    removed.append(path)
+            with self.index_lock:
+                access_times = self.load_index()
+                for key in [key for key in access_times if not os.path.exists(os.path.join(self.cache_dir, key))]:
+                    del access_times[key]
+        self.save_index(force=True)
+        return removed
+
+    def clear(self) -> list[str]:
+        """
+        remove all the parse caches which are not used by an ingestion, and compact, call it in the app context
+        """
+        return self.evict(0) + self.compact()
+
+    def stats(self) -> dict:
+        """
+        call it in the app context
+        """
+        scan = self.scan()
+        referenced_dirs, protected_arxiv_ids = self.references()
+        stats = {
+            'max_bytes': self.max_bytes,
+            'parse_cache_bytes': sum(entry.size for entry in scan.entries),
+            'protected_files': sum(entry.arxiv_id in protected_arxiv_ids for entry in scan.entries),
+            'temp_files': len(scan.temp_files),
+        }
+        for kind in PARSE_CACHE_KINDS:
+            entries = [entry for entry in scan.entries if entry.kind == kind]
+            stats[f'{kind}_files'] = len(entries)
+            stats[f'{kind}_bytes'] = sum(entry.size for entry in entries)
+        referenced = [path for path in scan.chunk_dirs if os.path.abspath(path) in referenced_dirs]
+        orphans = [path for path in scan.chunk_dirs if os.path.abspath(path) not in referenced_dirs]
+        stats['chunk_dirs'] = len(referenced)
+        stats['chunk_dir_bytes'] = sum(map(dir_size, referenced))
+        stats['orphan_dirs'] = len(orphans)
+        stats['orphan_dir_bytes'] = sum(map(dir_size, orphans))
+        access_time_list = sorted(entry.access_time for entry in scan.entries)
+        stats['oldest_access_time'] = access_time_list[0] if access_time_list else None
+        stats['newest_access_time'] = access_time_list[-1] if access_time_list else None
+        return stats
+
+
+DOCUMENT_CACHE = DocumentCache()
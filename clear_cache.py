@@ -1,15 +1,61 @@
-import os
-from constants import DOCUMENT_DIR_PREFIX
+"""
+Inspect and shrink the document dir (DOCUMENT_DIR_PREFIX), see cache_manager.py. The chunk dirs of the documents in
+the database and the parse caches of the documents still ingesting are never removed.
 
+usage:
+    python clear_cache.py stats               the files and bytes of the parse caches and the chunk dirs
+    python clear_cache.py evict [--max-bytes]  remove the least recently used parse caches above the budget
+    python clear_cache.py compact             remove the pdfs of the parsed papers, the orphan chunk dirs and the temporary files
+    python clear_cache.py clear               remove all the parse caches and compact
+"""
+import argparse
+import json
+from datetime import datetime
+from app import app, db
+from cache_manager import DOCUMENT_CACHE, format_bytes
+from models import add_missing_columns
 
-def clear_document_cache():
-    """
-    Clear the document cache
-    """
-    for file in os.listdir(DOCUMENT_DIR_PREFIX):
-        os.remove(os.path.join(DOCUMENT_DIR_PREFIX, file))
-    print("Document cache cleared")    
+
+def print_stats(stats: dict):
+    print(f"parse caches: {format_bytes(stats['parse_cache_bytes'])} of {format_bytes(stats['max_bytes'])}, "
+          f"{stats['protected_files']} files used by the ingestions")
+    print(f"    pkl: {stats['pkl_files']} files, {format_bytes(stats['pkl_bytes'])}")
+    print(f"    pdf: {stats['pdf_files']} files, {format_bytes(stats['pdf_bytes'])}")
+    print(f"chunk dirs: {stats['chunk_dirs']} dirs, {format_bytes(stats['chunk_dir_bytes'])}")
+    print(f"orphan chunk dirs: {stats['orphan_dirs']} dirs, {format_bytes(stats['orphan_dir_bytes'])}")
+    print(f"temporary files: {stats['temp_files']}")
+    for name in ('oldest_access_time', 'newest_access_time'):
+        if stats[name] is not None:
+            print(f"{name.replace('_', ' ')}: {datetime.fromtimestamp(stats[name]):%Y-%m-%d %H:%M:%S}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and shrink the document cache")
+    parser.add_argument("command", choices=["stats", "evict", "compact", "clear"])
+    parser.add_argument("--max-bytes", type=int, default=None, help="the budget of evict, DOCUMENT_CACHE_MAX_BYTES by default")
+    parser.add_argument("--json", action="store_true", help="print the stats as json")
+    args = parser.parse_args()
+
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        add_missing_columns()
+        if args.command == "evict":
+            removed = DOCUMENT_CACHE.evict(args.max_bytes)
+        elif args.command == "compact":
+            removed = DOCUMENT_CACHE.compact()
+        elif args.command == "clear":
+            removed = DOCUMENT_CACHE.clear()
+        else:
+            removed = None
+        if removed is not None:
+            print(f"{len(removed)} files and dirs removed")
+        stats = DOCUMENT_CACHE.stats()
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print_stats(stats)
 
 
 if __name__ == "__main__":
-    clear_document_cache()
\ No newline at end of file
+    main()
@@ -4,9 +4,22 @@ import torch
 from multilingual_clip import pt_multilingual_clip
 import transformers
 import clip
+import logging
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
+logger = logging.getLogger(__name__)
+
+def quantize_model(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    dynamic int8 quantization of the linear layers, the weights are stored in int8 and the activations are quantized
+    on the fly, only available for the CPU inference
+    """
+    if device != "cpu":
+        logger.warning("The int8 quantization is only used for the CPU inference")
+        return model
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
 def calculate_similarity(text_features: torch.Tensor) -> float:
     text_features /= text_features.norm(dim=-1, keepdim=True)
     similarity = torch.matmul(text_features, text_features.T)
@@ -15,50 +28,65 @@ def calculate_similarity(text_features: torch.Tensor) -> float:
 
 class Chinese_Clip:
     model_name = 'YeungNLP/clip-vit-bert-chinese-1M'
-    def __init__(self) -> None:
+    def __init__(self, quantize: bool = False) -> None:
         self.model = BertCLIPTextModel.from_pretrained(self.model_name).to(device)
         self.tokenizer = BertTokenizerFast.from_pretrained(self.model_name)
         self.model.eval()
+        if quantize:
+            self.model = quantize_model(self.model)
 
     @torch.no_grad()
-    def calculate_similarity(self, text1: str, text2: str) -> float:
-        inputs = self.tokenizer([text1, text2], return_tensors='pt', padding=True).to(device)
+    def encode(self, texts: list[str]) -> torch.Tensor:
+        inputs = self.tokenizer(texts, return_tensors='pt', padding=True, truncation=True).to(device)
         inputs.pop('token_type_ids')
         outputs = self.model(**inputs)
-        text_embeds = outputs.pooler_output
+        return outputs.pooler_output
+
+    def calculate_similarity(self, text1: str, text2: str) -> float:
+        text_embeds = self.encode([text1, text2])
         return calculate_similarity(text_embeds)
 
 class Multi_Clip:
     model_name = 'M-CLIP/XLM-Roberta-Large-Vit-L-14'
-    def __init__(self) -> None:
+    def __init__(self, quantize: bool = False) -> None:
         self.model = pt_multilingual_clip.MultilingualCLIP.from_pretrained(self.model_name)
         self.tokenizer = transformers.AutoTokenizer.from_pretrained(self.model_name)
         self.model.to(device)
         self.model.eval()
+        if quantize:
+            self.model = quantize_model(self.model)
         
     @torch.no_grad()
     def forward(self, texts: list[str]):
-        txt_tok = self.tokenizer(texts, padding=True, return_tensors='pt')
+        txt_tok = self.tokenizer(texts, padding=True, truncation=True, return_tensors='pt')
         txt_tok.to(device)
         embs: torch.Tensor = self.model.transformer(**txt_tok)[0]
         att: torch.Tensor = txt_tok['attention_mask']
         embs = (embs * att.unsqueeze(2)).sum(dim=1) / att.sum(dim=1)[:, None]
         return self.model.LinearTransformation(embs)
+
+    def encode(self, texts: list[str]) -> torch.Tensor:
+        return self.forward(texts)
     
     def calculate_similarity(self, text1: str, text2: str) -> float:
-        text_features: torch.Tensor = self.forward([text1, text2])
+        text_features: torch.Tensor = self.encode([text1, text2])
         return calculate_similarity(text_features)
 
 class Clip:
     model_name = "ViT-B/32"
-    def __init__(self):
+    def __init__(self, quantize: bool = False):
         self.model, _ = clip.load(self.model_name, device=device)
         self.model.eval()
+        if quantize:
+            self.model = quantize_model(self.model)
     
     @torch.no_grad()
+    def encode(self, texts: list[str]) -> torch.Tensor:
+        text_tokens = clip.tokenize(texts, truncate=True).to(device)
+        return self.model.encode_text(text_tokens)
+
     def calculate_similarity(self, text1: str, text2: str) -> float:
-        text_features = clip.tokenize([text1, text2], truncate=True).to(device)
-        text_features = self.model.encode_text(text_features)
+        text_features = self.encode([text1, text2])
         return calculate_similarity(text_features)
     
 if __name__ == "__main__":
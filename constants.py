@@ -4,12 +4,187 @@ PASSED_SCORE = 85
 
 SIMILARITY_THRESHOLD = 0.8
 
+# the encoder class in clip_model.py used for the similarity based features
+EMBEDDING_MODEL = 'Chinese_Clip'
+
+# use the dynamic int8 quantized encoder for the CPU inference, the similarity thresholds are tuned with the fp32 encoder,
+# so check the similarity drift with benchmarks/bench_quantization.py before turning it on
+EMBEDDING_QUANTIZE = False
+
+# the concurrent encode requests are collected into micro batches of at most EMBEDDING_MAX_BATCH_SIZE texts,
+# a batch is run when it is full or its first request has waited EMBEDDING_MAX_WAIT_MS
+EMBEDDING_MAX_BATCH_SIZE = 64
+
+EMBEDDING_MAX_WAIT_MS = 5
+
+# the number of threads used by torch for the CPU inference, None means the default of torch
+EMBEDDING_TORCH_THREADS = os.cpu_count()
+
+# the least recently used embeddings are evicted when the embedding store has more rows
+EMBEDDING_STORE_MAX_ROWS = 1000000
+
+# the store is compacted when the evicted rows are more than this ratio of the rows in the file
+EMBEDDING_STORE_COMPACT_RATIO = 0.5
+
+# the chunks are split into passages of at most SEARCH_PASSAGE_WORDS words for the semantic search,
+# since the encoders only look at the beginning of a long text
+SEARCH_PASSAGE_WORDS = 64
+
+SEARCH_TOP_K = 10
+
+# the vector index of a user is searched by brute force until it has VECTOR_INDEX_IVF_MIN_SIZE passages,
+# then it is partitioned into about sqrt(size) clusters and a query only scans the VECTOR_INDEX_NPROBE nearest ones
+VECTOR_INDEX_IVF_MIN_SIZE = 50000
+
+VECTOR_INDEX_NPROBE = 16
+
+# the max number of the results of a keyword search
+KEYWORD_SEARCH_LIMIT = 20
+
+# the number of documents read and committed at a time when the full-text index is rebuilt
+FTS_REBUILD_BATCH_SIZE = 100
+
+# the models in clip_model.py are loaded lazily once per process, the idle models are unloaded
+# when the memory of the loaded models exceeds MODEL_MEMORY_BUDGET_MB or they are unused for MODEL_IDLE_UNLOAD_SECONDS
+MODEL_MEMORY_BUDGET_MB = 4096
+
+MODEL_IDLE_UNLOAD_SECONDS = 30 * 60
+
+# a model which fails to load (e.g. out of memory, a failed download) is not loaded again for MODEL_LOAD_RETRY_SECONDS,
+# the wait doubles after each failure up to MODEL_LOAD_RETRY_MAX_SECONDS
+MODEL_LOAD_RETRY_SECONDS = 30
+MODEL_LOAD_RETRY_MAX_SECONDS = 30 * 60
+
+# the models loaded when the app starts, e.g. ['Chinese_Clip']
+PRELOAD_MODELS = []
+
+# the fill-in-the-blank answers are graded locally: normalized exact match -> lexical similarity -> embedding similarity,
+# only the answers between the pass and fail thresholds of every tier are judged by the LLM
+BLANK_LEXICAL_PASS_THRESHOLD = 0.85
+
+# answers with the same meaning may share no character (e.g. a translated term), so the lexical tier never fails an answer by default
+BLANK_LEXICAL_FAIL_THRESHOLD = 0.0
+
+# the encoder of the embedding tier is preloaded when the app starts
+USE_EMBEDDING_GRADING = True
+
+BLANK_EMBEDDING_PASS_THRESHOLD = 0.92
+
+BLANK_EMBEDDING_FAIL_THRESHOLD = 0.5
+
+# reuse the LLM judgement of a previous answer to the same standard answer if the two answers are close enough
+USE_JUDGE_CACHE = True
+
+JUDGE_CACHE_SIMILARITY_THRESHOLD = 0.97
+
+JUDGE_CACHE_MAX_STANDARD_ANSWERS = 10000
+
+JUDGE_CACHE_MAX_ANSWERS_PER_STANDARD_ANSWER = 256
+
+# the LLM backend, see llm_backend.py: zhipu, stand_in, record or replay
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "zhipu")
+
+LLM_MODEL = "glm-4"
+
+# sleep the recorded latency of each response in the replay mode
+LLM_REPLAY_LATENCY = os.environ.get("LLM_REPLAY_LATENCY", "1") == "1"
+
+# the latency distributions of the stand-in backend in ms, "lognormal:<median>,<sigma>", "normal:<mean>,<std>",
+# "uniform:<low>,<high>", "constant:<value>" or "0", the prompts generating problems are much slower than the judging ones
+STAND_IN_LATENCY = os.environ.get("STAND_IN_LATENCY", "lognormal:2000,0.5")
+
+STAND_IN_FAMILY_LATENCY = {
+    'choice': "lognormal:9000,0.4",
+    'tf': "lognormal:6000,0.4",
+    'blank': "lognormal:6000,0.4",
+    'fused': "lognormal:15000,0.4",
+    'sum': "lognormal:12000,0.3",
+    'review': "lognormal:8000,0.3",
+    'recommendation': "lognormal:10000,0.4",
+}
+
+# multiply the latencies of the stand-in backend, 0 to answer at once
+STAND_IN_LATENCY_SCALE = float(os.environ.get("STAND_IN_LATENCY_SCALE", 1.0))
+
+STAND_IN_ERROR_RATE = float(os.environ.get("STAND_IN_ERROR_RATE", 0.0))
+
+STAND_IN_MALFORMED_RATE = float(os.environ.get("STAND_IN_MALFORMED_RATE", 0.0))
+
+STAND_IN_SEED = int(os.environ.get("STAND_IN_SEED", 0))
+
 MAX_ARTICLE_WORDS = int(6000 * 0.75 - 500)
 
 MAX_PROBLEM_GEN_TRIES = 3
 
 PROBLEM_NUM_PER_TYPE = 3
 
+# ask for the choice, tf and blank problems of a chunk in one prompt, the chunk text is sent once instead of three times,
+# off until the valid questions of each type and their quality are checked against the live LLM, see README
+USE_FUSED_PROBLEM_PROMPT = os.environ.get("USE_FUSED_PROBLEM_PROMPT", "0") == "1"
+
+# the seconds generate_exam waits for the questions, the exam is saved with the questions ready by then and marked incomplete,
+# the late questions are appended when they are generated, 0 to wait for all of them
+EXAM_GENERATION_DEADLINE = float(os.environ.get("EXAM_GENERATION_DEADLINE", 60))
+
+# the chunks in the choice, tf and blank prompts are compressed to their salient sentences, see prompt_compression.py,
+# a prompt keeps PROMPT_COMPRESSION_BASE_WORDS + PROMPT_COMPRESSION_WORDS_PER_QUESTION * the number of the questions words,
+# off until benchmarks/eval_prompt_compression.py shows the support and the yield of the questions hold on recorded prompts
+USE_PROMPT_COMPRESSION = os.environ.get("USE_PROMPT_COMPRESSION", "0") == "1"
+
+PROMPT_COMPRESSION_BASE_WORDS = 400
+
+PROMPT_COMPRESSION_WORDS_PER_QUESTION = 200
+
+# the weight of the redundancy against the salience when the sentences are picked
+PROMPT_COMPRESSION_DIVERSITY = 0.3
+
+PROMPT_COMPRESSION_CACHE_SIZE = 1024
+
+# the LLM calls are scheduled by llm_scheduler.py, at most LLM_MAX_CONCURRENCY calls run at the same time and the waiting ones
+# are served by priority class: the interactive grading > the exam generation > the background refresh of the profiles and recommendations
+LLM_MAX_CONCURRENCY = 16
+
+# the max running calls of each class, so that the exam generation and the background refresh never take all the slots of the grading
+LLM_CLASS_CONCURRENCY = {'interactive': 16, 'generation': 12, 'background': 4}
+
+# a call is rejected at once when this many calls of its class are waiting
+LLM_CLASS_QUEUE_LIMIT = {'interactive': 64, 'generation': 256, 'background': 32}
+
+# a call is rejected when it has waited this many seconds for a slot or for the token quota of its user
+LLM_CLASS_MAX_WAIT = {'interactive': 30, 'generation': 300, 'background': 120}
+
+# the estimated prompt tokens a user can send per minute and at once, the interactive grading is not limited
+LLM_USER_TOKENS_PER_MINUTE = 200000
+
+LLM_USER_TOKEN_BURST = 400000
+
+# hedge the slow LLM calls: when a call takes longer than the HEDGE_PERCENTILE of the latencies of the recent calls
+# of its prompt type, a duplicate call is sent in the slot of the scheduler and the first response is used,
+# no call is hedged while other calls wait for a slot
+USE_HEDGING = os.environ.get("USE_HEDGING", "1") == "1"
+
+HEDGE_PERCENTILE = 0.95
+
+# the latencies of the last HEDGE_WINDOW calls of each prompt type are kept, no call is hedged before HEDGE_MIN_SAMPLES calls
+HEDGE_WINDOW = 200
+
+HEDGE_MIN_SAMPLES = 20
+
+# the hedged calls are at most this ratio of the calls, i.e. the extra load of the LLM
+HEDGE_BUDGET_RATIO = 0.05
+
+# the max number of the running LLM calls and hedged calls started by the hedging, at least twice LLM_MAX_CONCURRENCY
+# so that the admitted calls and their hedges never wait for a worker
+HEDGE_MAX_WORKERS = 64
+
+# the max number of LLM judgements running at the same time when an exam is submitted
+MAX_JUDGE_WORKERS = 8
+
+# pack several fill-in-the-blank answers into one judging prompt when an exam is submitted
+PACK_BLANK_JUDGE = True
+
+MAX_BLANK_JUDGE_PACK_SIZE = 5
+
 # TODO set the secret key to a random string which is hard to guess
 SECRET_KEY = 'mysecretkey'
 
@@ -25,6 +200,65 @@ DOCUMENT_DIR_PREFIX = os.path.join(STATIC_PREFIX, "documents")
 
 RESPONSE_CACHE_FILE = os.path.join(STATIC_PREFIX, "response_cache.json")
 
+# the parse caches of the papers (<arxiv id>.pkl and .pdf in DOCUMENT_DIR_PREFIX) are evicted by LRU when they take more
+# bytes, the chunk dirs of the documents are never evicted, see cache_manager.py
+DOCUMENT_CACHE_MAX_BYTES = int(os.environ.get("DOCUMENT_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+
+# the last access time of each parse cache
+DOCUMENT_CACHE_INDEX_FILE = os.path.join(STATIC_PREFIX, "document_cache_index.json")
+
+# the access index is saved at most once per interval in seconds
+DOCUMENT_CACHE_INDEX_SAVE_INTERVAL = 60
+
+# the dirs without a document and the temporary files are removed by the compaction only when they are older, since
+# the dir of a document being imported is written before its row is committed
+DOCUMENT_CACHE_GRACE_SECONDS = 3600
+
+# the embeddings of the chunks, abstracts and standard answers are persisted in an append only float16 memmap per model
+EMBEDDING_STORE_DIR = os.path.join(STATIC_PREFIX, "embeddings")
+
+# the prompts and responses recorded by the record mode of the LLM backend and answered by the replay mode
+LLM_RECORD_FILE = os.environ.get("LLM_RECORD_FILE", os.path.join(STATIC_PREFIX, "llm_record.jsonl"))
+
+# the background LLM calls (the profile and recommendation refresh) are sent through the batch API of the provider, see llm_batch.py
+USE_LLM_BATCH = os.environ.get("USE_LLM_BATCH", "0") == "1"
+
+# the batch endpoint: zhipu or stand_in
+LLM_BATCH_ENDPOINT = os.environ.get("LLM_BATCH_ENDPOINT", "stand_in" if LLM_BACKEND == "stand_in" else "zhipu")
+
+# the job files of the batches
+LLM_BATCH_DIR = os.path.join(STATIC_PREFIX, "llm_batches")
+
+# a batch job is submitted when it has LLM_BATCH_MAX_SIZE prompts or its first prompt has waited LLM_BATCH_MAX_DELAY seconds
+LLM_BATCH_MAX_SIZE = 500
+
+LLM_BATCH_MAX_DELAY = float(os.environ.get("LLM_BATCH_MAX_DELAY", 30))
+
+LLM_BATCH_POLL_INTERVAL = float(os.environ.get("LLM_BATCH_POLL_INTERVAL", 30))
+
+# the seconds a caller waits for the result of its prompt, the completion window of the provider is 24 hours
+LLM_BATCH_MAX_WAIT = 6 * 3600
+
+# the time of a job of the stand-in batch endpoint in ms, multiplied by STAND_IN_LATENCY_SCALE
+STAND_IN_BATCH_LATENCY = os.environ.get("STAND_IN_BATCH_LATENCY", "lognormal:60000,0.3")
+
+# the worker threads of each stage of the ingestion pipeline of the uploaded documents, see ingestion.py,
+# the metadata and download stages wait for arXiv, the parse stage for llmsherpa, the index stage encodes the passages
+INGESTION_STAGE_WORKERS = {
+    'metadata': int(os.environ.get("INGESTION_METADATA_WORKERS", 4)),
+    'download': int(os.environ.get("INGESTION_DOWNLOAD_WORKERS", 4)),
+    'parse': int(os.environ.get("INGESTION_PARSE_WORKERS", 4)),
+    'chunk': int(os.environ.get("INGESTION_CHUNK_WORKERS", 2)),
+    'index': int(os.environ.get("INGESTION_INDEX_WORKERS", 1)),
+    'derive': int(os.environ.get("INGESTION_DERIVE_WORKERS", 1)),
+}
+
+# the documents waiting before each stage, a full queue blocks the stage before it
+INGESTION_QUEUE_SIZE = 64
+
+# the timeout of the pdf downloads in seconds
+PDF_DOWNLOAD_TIMEOUT = 120
+
 CACHE_FILE_DICT = {
     'choice': os.path.join(STATIC_PREFIX, "choice_cache.json"),
     'tf': os.path.join(STATIC_PREFIX, "tf_cache.json"),
@@ -32,6 +266,7 @@ CACHE_FILE_DICT = {
     'sum': os.path.join(STATIC_PREFIX, "summary_cache.json"),
     'review': os.path.join(STATIC_PREFIX, "review_cache.json"),
     'judge': os.path.join(STATIC_PREFIX, "judge_cache.json"),
+    'fused': os.path.join(STATIC_PREFIX, "fused_cache.json"),
 }
 
 # TODO In the production environment, set USE_CACHE to False
@@ -52,8 +287,22 @@ BAD_REVIEWS = ["你的回答不正确", "你的回答不够好", "你的回答
 os.makedirs(DOCUMENT_DIR_PREFIX, exist_ok=True)
 
 
+# the external services, overridden by the environment variables to point at local stand-ins in the load tests
+ARXIV_API_URL = os.environ.get("ARXIV_API_URL", "http://export.arxiv.org/api/query")
+
+LLMSERPA_API_URL = os.environ.get("LLMSERPA_API_URL", "https://readers.llmsherpa.com/api/document/developer/parseDocument?renderFormat=all")
+
 SEARCH_PAPER_NUM = 20
 
 CHOSE_PAPER_NUM = 10
 
 ARXIV_LIMIT_TIME_PER_REQUEST = 2
+
+# the ids in an id_list query of the arXiv API
+ARXIV_ID_LIST_BATCH_SIZE = 50
+
+# the max number of the papers of a bulk import
+MAX_IMPORT_DOCUMENT_NUMBER = 500
+
+# the documents of a bulk import created per commit
+IMPORT_COMMIT_BATCH_SIZE = 50
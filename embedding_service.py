@@ -0,0 +1,172 @@
+"""
+In-process embedding service around the encoders in clip_model.py.
+The concurrent encode requests are collected into dynamic micro batches, so that one padded forward pass
+serves many callers instead of one forward pass per text pair.
+"""
+from concurrent.futures import Future
+from queue import Queue, Empty
+from threading import Lock, Thread
+import time
+import numpy as np
+from constants import EMBEDDING_MODEL, EMBEDDING_QUANTIZE, EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_MAX_WAIT_MS, EMBEDDING_TORCH_THREADS
+from model_registry import MODEL_REGISTRY, ModelRegistry, get_model_key
+from embedding_store import get_embedding_store
+
+
+def to_numpy(embeddings) -> np.ndarray:
+    if hasattr(embeddings, 'detach'):
+        embeddings = embeddings.detach().float().cpu().numpy()
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norm, 1e-12)
+
+
+class EmbeddingService:
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL,
+        registry: ModelRegistry = MODEL_REGISTRY,
+        max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+        max_wait_ms: float = EMBEDDING_MAX_WAIT_MS,
+        torch_threads: int | None = EMBEDDING_TORCH_THREADS,
+    ):
+        """
+        args:
+            model_name: the name of the encoder in the registry, it should have encode(list[str]) -> embeddings
+            registry: the encoder is borrowed from the registry for each batch, so it can be unloaded when idle
+            max_batch_size: the max number of texts in one forward pass
+            max_wait_ms: the max time the first request of a batch waits for the others
+            torch_threads: the number of threads used by torch for the CPU inference
+        """
+        self.model_name = model_name
+        self.registry = registry
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.torch_threads = torch_threads
+        self.lock = Lock()
+        self.queue: Queue[tuple[list[str], Future]] = Queue()
+        self.worker: Thread | None = None
+        self.batch_number = 0
+        self.text_number = 0
+
+    @property
+    def available(self) -> bool:
+        return self.registry.is_available(self.model_name)
+
+    def _start(self):
+        with self.lock:
+            if self.worker is not None:
+                return
+            if self.torch_threads:
+                try:
+                    import torch
+                    torch.set_num_threads(self.torch_threads)
+                except ImportError:
+                    pass
+            self.worker = Thread(target=self._run, daemon=True)
+            self.worker.start()
+
+    def _collect_batch(self) -> list[tuple[list[str], Future]]:
+        requests = [self.queue.get()]
+        text_number = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while text_number < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except Empty:
+                break
+            requests.append(request)
+            text_number += len(request[0])
+        return requests
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        """
+        encode the unique texts sorted by length, so that the texts in one forward pass need little padding
+        """
+        unique_texts = sorted(set(texts), key=len)
+        embeddings = []
+        with self.registry.use(self.model_name) as encoder:
+            for begin in range(0, len(unique_texts), self.max_batch_size):
+                embeddings.append(to_numpy(encoder.encode(unique_texts[begin: begin + self.max_batch_size])))
+        embeddings = normalize(np.concatenate(embeddings, axis=0))
+        text_to_index = {text: i for i, text in enumerate(unique_texts)}
+        self.batch_number += 1
+        self.text_number += len(unique_texts)
+        return embeddings[[text_to_index[text] for text in texts]]
+
+    def _run(self):
+        while True:
+            requests = self._collect_batch()
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                embeddings = self._encode_batch(texts)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            begin = 0
+            for request_texts, future in requests:
+                future.set_result(embeddings[begin: begin + len(request_texts)])
+                begin += len(request_texts)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """
+        return:
+            the l2 normalized float32 embeddings with shape (len(texts), dim)
+        """
+        if not texts:
+            raise ValueError("Nothing to encode")
+        if not self.available:
+            raise RuntimeError(f"The encoder {self.model_name} is not available")
+        self._start()
+        future = Future()
+        self.queue.put((list(texts), future))
+        return future.result()
+
+    def encode_cached(self, texts: list[str]) -> np.ndarray:
+        """
+        encode the texts which are not in the persistent embedding store of the model, used for the texts which
+        are encoded again and again, e.g. the chunks, abstracts and standard answers
+        """
+        return get_embedding_store(self.model_name).get_or_compute(list(texts), self.encode)
+
+    def similarity(self, text1: str, text2: str) -> float:
+        embeddings = self.encode([text1, text2])
+        return float(embeddings[0] @ embeddings[1])
+
+    def pairwise_similarity(self, text_pairs: list[tuple[str, str]]) -> np.ndarray:
+        """
+        return:
+            the cosine similarity of each pair with shape (len(text_pairs),)
+        """
+        embeddings = self.encode([text for text_pair in text_pairs for text in text_pair])
+        return np.einsum('ij,ij->i', embeddings[0::2], embeddings[1::2])
+
+    def similarity_matrix(self, texts1: list[str], texts2: list[str]) -> np.ndarray:
+        """
+        return:
+            the cosine similarity of each text in texts1 to each text in texts2 with shape (len(texts1), len(texts2))
+        """
+        embeddings = self.encode(list(texts1) + list(texts2))
+        return embeddings[:len(texts1)] @ embeddings[len(texts1):].T
+
+
+_SERVICES: dict[str, EmbeddingService] = {}
+_SERVICES_LOCK = Lock()
+
+
+def get_embedding_service(model_name: str = EMBEDDING_MODEL, quantize: bool = EMBEDDING_QUANTIZE) -> EmbeddingService:
+    """
+    return the shared embedding service of the encoder class model_name in clip_model.py
+    """
+    model_key = get_model_key(model_name, quantize)
+    with _SERVICES_LOCK:
+        if model_key not in _SERVICES:
+            _SERVICES[model_key] = EmbeddingService(model_key)
+        return _SERVICES[model_key]
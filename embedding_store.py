@@ -0,0 +1,245 @@
+"""
+Persistent store of the text embeddings keyed by (model, content hash), so the same chunk, abstract or standard answer
+is only encoded once across requests and restarts.
+
+The store of a model is a directory with:
+    embeddings.f16: the float16 embeddings, one row per text, new rows are only appended
+    index.tsv: lines of "<content hash>\t<row>", appended when a row is added, row -1 means the hash is evicted
+    meta.json: the dim of the embeddings
+the embeddings are read through a memory map, so reading a row does not copy it.
+The store is written by one process, the evicted rows are reclaimed by compact().
+"""
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Callable
+import numpy as np
+from constants import EMBEDDING_STORE_DIR, EMBEDDING_STORE_MAX_ROWS, EMBEDDING_STORE_COMPACT_RATIO
+
+DTYPE = np.float16
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self, store_dir: str, max_rows: int = EMBEDDING_STORE_MAX_ROWS, compact_ratio: float = EMBEDDING_STORE_COMPACT_RATIO):
+        """
+        args:
+            store_dir: the directory of the store, one directory per model
+            max_rows: the least recently used rows are evicted when there are more live rows
+            compact_ratio: compact the files when the evicted rows are more than this ratio of the rows in the file
+        """
+        self.store_dir = store_dir
+        self.max_rows = max_rows
+        self.compact_ratio = compact_ratio
+        self.embeddings_path = os.path.join(store_dir, "embeddings.f16")
+        self.index_path = os.path.join(store_dir, "index.tsv")
+        self.meta_path = os.path.join(store_dir, "meta.json")
+        self.lock = Lock()
+        self.dim: int | None = None
+        self.hash_to_row: dict[str, int] = {}
+        # the last access tick of each hash, used for the lru eviction
+        self.hash_to_tick: dict[str, int] = {}
+        self.tick = 0
+        self.row_number = 0
+        self.memmap: np.memmap | None = None
+        os.makedirs(store_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                self.dim = json.load(f)['dim']
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 2:
+                        # a partially written line of a crash
+                        continue
+                    hash_value, row = parts[0], int(parts[1])
+                    if row < 0:
+                        self.hash_to_row.pop(hash_value, None)
+                        self.hash_to_tick.pop(hash_value, None)
+                    else:
+                        self.hash_to_row[hash_value] = row
+                        self.hash_to_tick[hash_value] = row
+        self.tick = max(self.hash_to_tick.values(), default=-1) + 1
+        if self.dim is not None and os.path.exists(self.embeddings_path):
+            self.row_number = os.path.getsize(self.embeddings_path) // (self.dim * np.dtype(DTYPE).itemsize)
+        # drop the rows of the index which are not in the embeddings file
+        self.hash_to_row = {hash_value: row for hash_value, row in self.hash_to_row.items() if row < self.row_number}
+        self.hash_to_tick = {hash_value: self.hash_to_tick[hash_value] for hash_value in self.hash_to_row}
+
+    def _get_memmap(self) -> np.memmap:
+        """
+        remap the embeddings file when it has grown
+        """
+        if self.memmap is None or self.memmap.shape[0] < self.row_number:
+            self.memmap = np.memmap(self.embeddings_path, dtype=DTYPE, mode='r', shape=(self.row_number, self.dim))
+        return self.memmap
+
+    def __len__(self) -> int:
+        return len(self.hash_to_row)
+
+    def _touch(self, hash_value: str):
+        self.hash_to_tick[hash_value] = self.tick
+        self.tick += 1
+
+    def get(self, text: str) -> np.ndarray | None:
+        """
+        return:
+            the float16 embedding of the text as a read only view of the memory map, None if it is not stored
+        """
+        hash_value = content_hash(text)
+        with self.lock:
+            row = self.hash_to_row.get(hash_value)
+            if row is None:
+                return None
+            self._touch(hash_value)
+            return self._get_memmap()[row]
+
+    def get_many(self, texts: list[str]) -> tuple[np.ndarray | None, list[int]]:
+        """
+        return:
+            the float32 embeddings with shape (len(texts), dim), the rows of the missing texts are zeros,
+            None if the store is empty
+            the indices of the missing texts
+        """
+        hash_values = [content_hash(text) for text in texts]
+        with self.lock:
+            if self.dim is None:
+                return None, list(range(len(texts)))
+            embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+            found_index_list, found_row_list, missing_index_list = [], [], []
+            for i, hash_value in enumerate(hash_values):
+                row = self.hash_to_row.get(hash_value)
+                if row is None:
+                    missing_index_list.append(i)
+                else:
+                    found_index_list.append(i)
+                    found_row_list.append(row)
+                    self._touch(hash_value)
+            if found_row_list:
+                embeddings[found_index_list] = self._get_memmap()[found_row_list]
+            return embeddings, missing_index_list
+
+    def put_many(self, texts: list[str], embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=DTYPE)
+        with self.lock:
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                with open(self.meta_path, "w") as f:
+                    json.dump({'dim': self.dim}, f)
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"The dim of the embeddings should be {self.dim}")
+            new_hash_values, new_rows = {}, []
+            for text, embedding in zip(texts, embeddings):
+                hash_value = content_hash(text)
+                if hash_value in self.hash_to_row or hash_value in new_hash_values:
+                    continue
+                new_hash_values[hash_value] = None
+                new_rows.append(embedding)
+            if not new_rows:
+                return
+            # the embeddings are written before the index, so an index line always points to a complete row
+            with open(self.embeddings_path, "ab") as f:
+                f.write(np.stack(new_rows).tobytes())
+            with open(self.index_path, "a") as f:
+                f.write("".join(f"{hash_value}\t{self.row_number + i}\n" for i, hash_value in enumerate(new_hash_values)))
+            for i, hash_value in enumerate(new_hash_values):
+                self.hash_to_row[hash_value] = self.row_number + i
+                self._touch(hash_value)
+            self.row_number += len(new_rows)
+            if len(self.hash_to_row) > self.max_rows:
+                self._evict(len(self.hash_to_row) - self.max_rows)
+
+    def get_or_compute(self, texts: list[str], compute: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """
+        args:
+            compute: compute the embeddings of the texts which are not stored, in one batch
+        return:
+            the float32 embeddings with shape (len(texts), dim)
+        """
+        embeddings, missing_index_list = self.get_many(texts)
+        if not missing_index_list:
+            return embeddings
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing_index_list))
+        missing_embeddings = np.asarray(compute(missing_texts), dtype=np.float32)
+        self.put_many(missing_texts, missing_embeddings)
+        if embeddings is None:
+            embeddings = np.zeros((len(texts), missing_embeddings.shape[1]), dtype=np.float32)
+        text_to_index = {text: i for i, text in enumerate(missing_texts)}
+        embeddings[missing_index_list] = missing_embeddings[[text_to_index[texts[i]] for i in missing_index_list]]
+        return embeddings
+
+    def _evict(self, number: int):
+        """
+        evict the least recently used rows, the lock must be held
+        """
+        hash_values = sorted(self.hash_to_row, key=self.hash_to_tick.__getitem__)[:number]
+        with open(self.index_path, "a") as f:
+            f.write("".join(f"{hash_value}\t-1\n" for hash_value in hash_values))
+        for hash_value in hash_values:
+            self.hash_to_row.pop(hash_value)
+            self.hash_to_tick.pop(hash_value)
+        if self.row_number - len(self.hash_to_row) > self.compact_ratio * self.row_number:
+            self._compact()
+
+    def evict(self, texts: list[str]):
+        hash_values = [content_hash(text) for text in texts]
+        with self.lock:
+            hash_values = [hash_value for hash_value in hash_values if hash_value in self.hash_to_row]
+            if not hash_values:
+                return
+            with open(self.index_path, "a") as f:
+                f.write("".join(f"{hash_value}\t-1\n" for hash_value in hash_values))
+            for hash_value in hash_values:
+                self.hash_to_row.pop(hash_value)
+                self.hash_to_tick.pop(hash_value)
+
+    def _compact(self):
+        """
+        rewrite the live rows into new files and replace the old ones, the lock must be held
+        """
+        if self.dim is None:
+            return
+        hash_values = sorted(self.hash_to_row, key=self.hash_to_tick.__getitem__)
+        rows = [self.hash_to_row[hash_value] for hash_value in hash_values]
+        live_embeddings = np.array(self._get_memmap()[rows]) if rows else np.zeros((0, self.dim), dtype=DTYPE)
+        with open(self.embeddings_path + ".tmp", "wb") as f:
+            f.write(live_embeddings.tobytes())
+        with open(self.index_path + ".tmp", "w") as f:
+            f.write("".join(f"{hash_value}\t{row}\n" for row, hash_value in enumerate(hash_values)))
+        self.memmap = None
+        os.replace(self.embeddings_path + ".tmp", self.embeddings_path)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        self.hash_to_row = {hash_value: row for row, hash_value in enumerate(hash_values)}
+        self.row_number = len(hash_values)
+
+    def compact(self):
+        with self.lock:
+            self._compact()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'dim': self.dim,
+                'live_rows': len(self.hash_to_row),
+                'file_rows': self.row_number,
+                'file_bytes': os.path.getsize(self.embeddings_path) if os.path.exists(self.embeddings_path) else 0,
+            }
+
+
+_STORES: dict[str, EmbeddingStore] = {}
+_STORES_LOCK = Lock()
+
+
+def get_embedding_store(model_key: str) -> EmbeddingStore:
+    with _STORES_LOCK:
+        if model_key not in _STORES:
+            _STORES[model_key] = EmbeddingStore(os.path.join(EMBEDDING_STORE_DIR, model_key.replace(':', '_').replace('/', '_')))
+        return _STORES[model_key]
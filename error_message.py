@@ -4,4 +4,6 @@ FORM_NOT_COMPLETE = "Please fill in all fields"
 USERNAME_EXISTS = "Username already exists"
 DOCUMENT_NOT_FOUND = "Document not found"
 QUESTION_NOT_FOUND = "Question not found"
-EXAM_NOT_FOUND = "Exam not found"
\ No newline at end of file
+EXAM_NOT_FOUND = "Exam not found"
+DOCUMENT_NOT_READY = "Document is not ready"
+TOO_MANY_DOCUMENTS = "Too many documents to import at once"
\ No newline at end of file
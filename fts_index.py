@@ -0,0 +1,152 @@
+"""
+SQLite FTS5 full-text index over the titles, abstracts and chunk texts of the documents.
+A document has one row for its title and abstract and one row per chunk for the chunk text.
+The owner column holds the token u<user_id>, so the per-user filter is a part of the MATCH query and is answered by the index.
+The table is created and dropped with db.create_all() / db.drop_all(), the rows are written in the transaction of the
+upload and removed when the document is deleted.
+
+usage:
+    python fts_index.py rebuild [batch_size]
+"""
+import re
+import sys
+from sqlalchemy import DDL, event, text
+from constants import FTS_REBUILD_BATCH_SIZE, KEYWORD_SEARCH_LIMIT
+from models import db, Document, Chunk, INDEXED_DOCUMENT_STATUS_LIST
+
+FTS_TABLE = "document_fts"
+
+# the weight of each column in the bm25 ranking: owner, title, abstract, body
+BM25_WEIGHTS = (0.0, 10.0, 5.0, 1.0)
+
+event.listen(db.metadata, 'after_create', DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "owner, title, abstract, body, document_id UNINDEXED, chunk_id UNINDEXED, tokenize='unicode61')"
+))
+event.listen(db.metadata, 'before_drop', DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+
+INSERT_STATEMENT = text(
+    f"INSERT INTO {FTS_TABLE} (owner, title, abstract, body, document_id, chunk_id) "
+    "VALUES (:owner, :title, :abstract, :body, :document_id, :chunk_id)"
+)
+
+SEARCH_STATEMENT = text(
+    f"SELECT {FTS_TABLE}.document_id, {FTS_TABLE}.chunk_id, document.title, "
+    f"snippet({FTS_TABLE}, -1, '<b>', '</b>', '...', 32) AS snippet, "
+    f"bm25({FTS_TABLE}, {', '.join(map(str, BM25_WEIGHTS))}) AS rank "
+    f"FROM {FTS_TABLE} JOIN document ON document.id = {FTS_TABLE}.document_id "
+    f"WHERE {FTS_TABLE} MATCH :query ORDER BY rank LIMIT :limit OFFSET :offset"
+)
+
+
+def owner_token(user_id: int) -> str:
+    return f"u{user_id}"
+
+
+def to_fts_query(keywords: str, user_id: int) -> str | None:
+    """
+    turn the keywords typed by the user into a FTS5 query, every keyword is quoted so the FTS5 syntax characters
+    in the keywords are matched literally
+    return:
+        None if there is no keyword
+    """
+    words = re.findall(r'\w+', keywords)
+    if not words:
+        return None
+    phrases = " ".join(f'"{word}"' for word in words)
+    return f"owner:{owner_token(user_id)} AND {{title abstract body}}: ({phrases})"
+
+
+def document_rows(document: Document, chunk_id_list: list[int], chunk_text_list: list[str]) -> list[dict]:
+    owner = owner_token(document.user_id)
+    rows = [{
+        'owner': owner, 'title': document.title, 'abstract': document.abstract or "", 'body': "",
+        'document_id': document.id, 'chunk_id': None,
+    }]
+    rows += [
+        {'owner': owner, 'title': "", 'abstract': "", 'body': chunk_text, 'document_id': document.id, 'chunk_id': chunk_id}
+        for chunk_id, chunk_text in zip(chunk_id_list, chunk_text_list)
+    ]
+    return rows
+
+
+def index_document(document: Document, chunk_id_list: list[int], chunk_text_list: list[str]):
+    """
+    add a document to the index in the current transaction, the document must be flushed before
+    """
+    db.session.execute(INSERT_STATEMENT, document_rows(document, chunk_id_list, chunk_text_list))
+
+
+@event.listens_for(Document, 'after_delete')
+def remove_document(mapper, connection, document: Document):
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE document_id = :document_id"), {'document_id': document.id})
+
+
+def search_keywords(user_id: int, keywords: str, limit: int = KEYWORD_SEARCH_LIMIT, offset: int = 0) -> list[dict]:
+    """
+    return:
+        the matched titles, abstracts and chunks of the user's documents ranked by bm25,
+        chunk_id is None if the title or the abstract is matched
+    """
+    query = to_fts_query(keywords, user_id)
+    if query is None:
+        return []
+    rows = db.session.execute(SEARCH_STATEMENT, {'query': query, 'limit': limit, 'offset': offset})
+    return [
+        {'document_id': row.document_id, 'chunk_id': row.chunk_id, 'title': row.title, 'snippet': row.snippet, 'rank': row.rank}
+        for row in rows
+    ]
+
+
+def rebuild(batch_size: int = FTS_REBUILD_BATCH_SIZE) -> int:
+    """
+    rebuild the index from the documents and the chunk files, batch_size documents are read and committed at a time
+    the documents being ingested are indexed later by the index stage, the failed documents are left out
+    return:
+        the number of the indexed documents
+    """
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    db.session.commit()
+    document_number = 0
+    last_id = 0
+    while True:
+        documents: list[Document] = Document.query.filter(
+            Document.id > last_id, Document.status.in_(INDEXED_DOCUMENT_STATUS_LIST)
+        ).order_by(Document.id).limit(batch_size).all()
+        if not documents:
+            break
+        chunks: list[Chunk] = Chunk.query.filter(Chunk.document_id.in_([document.id for document in documents])).order_by(Chunk.id).all()
+        document_id_to_chunks: dict[int, list[Chunk]] = {}
+        for chunk in chunks:
+            document_id_to_chunks.setdefault(chunk.document_id, []).append(chunk)
+        rows = []
+        for document in documents:
+            document_chunks = document_id_to_chunks.get(document.id, [])
+            chunk_text_list = []
+            for chunk in document_chunks:
+                try:
+                    chunk_text_list.append(chunk.chunk_text)
+                except FileNotFoundError:
+                    chunk_text_list.append("")
+            rows += document_rows(document, [chunk.id for chunk in document_chunks], chunk_text_list)
+        last_id = documents[-1].id
+        document_number += len(documents)
+        db.session.execute(INSERT_STATEMENT, rows)
+        db.session.commit()
+        # the loaded documents and chunks are not needed anymore
+        db.session.expunge_all()
+        print(f"indexed {document_number} documents")
+    db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    return document_number
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print(__doc__)
+        sys.exit(1)
+    from app import app
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        rebuild(int(sys.argv[2]) if len(sys.argv) > 2 else FTS_REBUILD_BATCH_SIZE)
@@ -0,0 +1,156 @@
+"""
+Local grading of the fill-in-the-blank answers, the tiers are tried from the cheapest one:
+    1. normalized exact match, the numbers are compared by value
+    2. the numbers of the answers, an answer with other numbers than the standard answer is never passed locally
+    3. lexical similarity (character bigram dice and edit distance)
+    4. embedding similarity with the shared embedding service
+an answer is only sent to the LLM judge when no tier is confident about it
+"""
+from collections import Counter
+from decimal import Decimal
+import random
+import re
+import string
+import unicodedata
+import numpy as np
+from constants import BAD_REVIEWS, GOOD_REVIEWS, PASSED_SCORE, BLANK_LEXICAL_PASS_THRESHOLD, BLANK_LEXICAL_FAIL_THRESHOLD, \
+    USE_EMBEDDING_GRADING, BLANK_EMBEDDING_PASS_THRESHOLD, BLANK_EMBEDDING_FAIL_THRESHOLD
+from embedding_service import get_embedding_service
+
+# chinese punctuations are not in string.punctuation
+PUNCTUATIONS = set(string.punctuation) | set("，。、；：？！“”‘’（）《》【】—…·")
+# the sign is kept unless the number follows a latin letter or a digit, e.g. the - of gpt-3 is a hyphen
+NUMBER_PATTERN = re.compile(r"(?:(?<![a-z0-9])[-+])?\d+(?:\.\d+)?")
+THOUSANDS_SEPARATOR_PATTERN = re.compile(r"(?<=\d),(?=\d{3}(?!\d))")
+
+
+def normalize_answer(text: str) -> str:
+    """
+    full-width to half-width, lower case, remove the punctuations and whitespaces,
+    except the decimal points and the signs of the numbers
+    """
+    text = THOUSANDS_SEPARATOR_PATTERN.sub("", unicodedata.normalize('NFKC', text).lower())
+    parts = []
+    start = 0
+    for match in NUMBER_PATTERN.finditer(text):
+        parts.append("".join(c for c in text[start:match.start()] if c not in PUNCTUATIONS and not c.isspace()))
+        parts.append(match.group())
+        start = match.end()
+    parts.append("".join(c for c in text[start:] if c not in PUNCTUATIONS and not c.isspace()))
+    return "".join(parts)
+
+
+def extract_numbers(text: str) -> list[Decimal]:
+    """
+    args:
+        text: str the normalized answer
+    return:
+        the numbers in the text, 0.10 and 0.1 are equal
+    """
+    return [Decimal(number) for number in NUMBER_PATTERN.findall(text)]
+
+
+def char_ngrams(text: str, n: int = 2) -> Counter:
+    if len(text) < n:
+        return Counter([text]) if text else Counter()
+    return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+def ngram_similarity(text1: str, text2: str, n: int = 2) -> float:
+    """
+    dice coefficient of the character n-gram multisets
+    """
+    ngrams1, ngrams2 = char_ngrams(text1, n), char_ngrams(text2, n)
+    total = sum(ngrams1.values()) + sum(ngrams2.values())
+    if total == 0:
+        return 1.0
+    return 2 * sum((ngrams1 & ngrams2).values()) / total
+
+
+def edit_similarity(text1: str, text2: str) -> float:
+    """
+    1 - levenshtein distance / max length
+    """
+    if not text1 and not text2:
+        return 1.0
+    previous_row = list(range(len(text2) + 1))
+    for i, c1 in enumerate(text1, 1):
+        current_row = [i]
+        for j, c2 in enumerate(text2, 1):
+            current_row.append(min(previous_row[j] + 1, current_row[j - 1] + 1, previous_row[j - 1] + (c1 != c2)))
+        previous_row = current_row
+    return 1 - previous_row[-1] / max(len(text1), len(text2))
+
+
+def lexical_similarity(text1: str, text2: str) -> float:
+    return max(ngram_similarity(text1, text2), edit_similarity(text1, text2))
+
+
+def embed_texts(texts: list[str]) -> np.ndarray | None:
+    """
+    return:
+        the l2 normalized float32 embeddings with shape (len(texts), dim), or None if the encoder is not available
+    """
+    service = get_embedding_service()
+    if not service.available:
+        return None
+    try:
+        return service.encode(texts)
+    except RuntimeError:
+        # the encoder failed to load, it is not loaded again before the retry time
+        return None
+
+
+def embedding_similarity(user_answer: str, standard_answer: str) -> float | None:
+    service = get_embedding_service()
+    if not USE_EMBEDDING_GRADING or not service.available:
+        return None
+    # the standard answer is graded many times, so its embedding is read from the persistent store
+    try:
+        return float(service.encode([user_answer])[0] @ service.encode_cached([standard_answer])[0])
+    except RuntimeError:
+        return None
+
+
+def make_judgement(similarity: float, passed: bool) -> tuple[int, str]:
+    if passed:
+        score = max(PASSED_SCORE + 1, min(100, int(similarity * 100)))
+    else:
+        score = min(PASSED_SCORE, max(0, int(similarity * 100)))
+    return score, random.choice(GOOD_REVIEWS if passed else BAD_REVIEWS)
+
+
+def local_grade_blank_answer(user_answer: str, standard_answer: str) -> tuple[int, str] | None:
+    """
+    args:
+        user_answer: str the user's answer
+        standard_answer: str the standard answer
+    return:
+        (score, review), or None if the answer is ambiguous and should be judged by the LLM
+    """
+    user_answer, standard_answer = normalize_answer(user_answer), normalize_answer(standard_answer)
+    if not user_answer:
+        return make_judgement(0.0, False) if standard_answer else make_judgement(1.0, True)
+    user_numbers, standard_numbers = extract_numbers(user_answer), extract_numbers(standard_answer)
+    if user_numbers == standard_numbers and NUMBER_PATTERN.sub("#", user_answer) == NUMBER_PATTERN.sub("#", standard_answer):
+        # the same text and the same numbers, e.g. 1.50 and 1.5
+        return make_judgement(1.0, True)
+    if user_numbers != standard_numbers:
+        # e.g. 0.001 and 0.0001 are similar texts but different answers, an answer with as many numbers is wrong,
+        # otherwise the numbers may be written in words (三 and 3), so the LLM judges it
+        if user_numbers and len(user_numbers) == len(standard_numbers):
+            return make_judgement(lexical_similarity(user_answer, standard_answer), False)
+        return None
+    similarity = lexical_similarity(user_answer, standard_answer)
+    if similarity >= BLANK_LEXICAL_PASS_THRESHOLD:
+        return make_judgement(similarity, True)
+    if similarity < BLANK_LEXICAL_FAIL_THRESHOLD:
+        return make_judgement(similarity, False)
+    similarity = embedding_similarity(user_answer, standard_answer)
+    if similarity is None:
+        return None
+    if similarity >= BLANK_EMBEDDING_PASS_THRESHOLD:
+        return make_judgement(similarity, True)
+    if similarity < BLANK_EMBEDDING_FAIL_THRESHOLD:
+        return make_judgement(similarity, False)
+    return None
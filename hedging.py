@@ -0,0 +1,135 @@
+"""
+Hedged calls: the call runs in a pool thread, if it has not finished after the HEDGE_PERCENTILE of the latencies
+of the recent calls of the same key, a duplicate call is started and the first successful result is used.
+The other call is cancelled if it has not started yet, otherwise its result is ignored.
+Each call earns HEDGE_BUDGET_RATIO of a hedge, so the hedged calls stay under that ratio of the calls.
+The LLM calls are hedged inside the slot of the scheduler (see utils._call_llm), so only the admitted calls run in the
+pool, the latencies do not include the time in the queue of the scheduler, and no call is hedged while other calls wait.
+"""
+import math
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from threading import Lock
+import time
+from typing import Callable, TypeVar
+from llm_scheduler import LLM_SCHEDULER, submit_in_context
+from metrics import REGISTRY
+from constants import HEDGE_PERCENTILE, HEDGE_WINDOW, HEDGE_MIN_SAMPLES, HEDGE_BUDGET_RATIO, HEDGE_MAX_WORKERS
+
+T = TypeVar('T')
+
+HEDGES = REGISTRY.counter(
+    "readhub_llm_hedges_total", "The hedged LLM calls: started, won by the hedge, skipped by the budget or while the scheduler is saturated", ("prompt_type", "outcome"))
+
+# the max number of hedges saved up by the budget
+MAX_SAVED_HEDGES = 10
+
+
+class LatencyTracker:
+    def __init__(self, window: int = HEDGE_WINDOW, min_samples: int = HEDGE_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self.latencies: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+        self.lock = Lock()
+
+    def record(self, key: str, latency: float):
+        with self.lock:
+            self.latencies[key].append(latency)
+
+    def percentile(self, key: str, q: float) -> float | None:
+        """
+        return:
+            the q quantile of the recent latencies of the key, None if there are not enough samples
+        """
+        with self.lock:
+            latencies = sorted(self.latencies[key])
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(q * len(latencies)) - 1)]
+
+
+class HedgeBudget:
+    def __init__(self, ratio: float = HEDGE_BUDGET_RATIO, max_saved: float = MAX_SAVED_HEDGES):
+        self.ratio = ratio
+        self.max_saved = max_saved
+        self.saved = 0.0
+        self.lock = Lock()
+
+    def earn(self):
+        with self.lock:
+            self.saved = min(self.max_saved, self.saved + self.ratio)
+
+    def spend(self) -> bool:
+        with self.lock:
+            if self.saved < 1:
+                return False
+            self.saved -= 1
+            return True
+
+
+class Hedger:
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        tracker: LatencyTracker | None = None,
+        budget: HedgeBudget | None = None,
+        max_workers: int = HEDGE_MAX_WORKERS,
+        is_saturated: Callable[[], bool] = lambda: False,
+    ):
+        """
+        args:
+            is_saturated: no call is hedged while it returns True, e.g. other calls are waiting for a slot
+        """
+        self.percentile = percentile
+        self.is_saturated = is_saturated
+        self.tracker = tracker or LatencyTracker()
+        self.budget = budget or HedgeBudget()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def _timed(self, key: str, func: Callable[[], T]) -> T:
+        start = time.perf_counter()
+        result = func()
+        self.tracker.record(key, time.perf_counter() - start)
+        return result
+
+    def call(self, key: str, func: Callable[[], T], hedge_func: Callable[[], T] | None = None) -> T:
+        """
+        args:
+            key: the calls of the same key share the latency percentile, e.g. the prompt type
+            func: the call, it should raise if the result is invalid
+            hedge_func: the duplicate call, func by default
+        return:
+            the first result of func and hedge_func which does not raise
+        """
+        self.budget.earn()
+        delay = self.tracker.percentile(key, self.percentile)
+        if delay is None:
+            return self._timed(key, func)
+        primary = submit_in_context(self.pool, self._timed, key, func)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if self.is_saturated():
+            HEDGES.inc(prompt_type=key, outcome="saturated")
+            return primary.result()
+        if not self.budget.spend():
+            HEDGES.inc(prompt_type=key, outcome="skipped")
+            return primary.result()
+        HEDGES.inc(prompt_type=key, outcome="started")
+        hedge = submit_in_context(self.pool, self._timed, key, hedge_func or func)
+        pending: set[Future] = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        HEDGES.inc(prompt_type=key, outcome="won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+HEDGER = Hedger(is_saturated=lambda: LLM_SCHEDULER.waiting_calls() > 0)
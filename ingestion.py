@@ -0,0 +1,322 @@
+"""
+The ingestion pipeline of the uploaded documents. An upload only creates a pending Document, the document then goes
+through the stages in INGESTION_STAGE_LIST:
+    metadata: fetch the title, abstract and pdf link from arXiv, saved in paper_info.json of the document dir
+    download: download the pdf to DOCUMENT_DIR_PREFIX/<arxiv id>.pdf
+    parse: decode the pdf by llmsherpa to the pkl cache of the paper, see arxiv.write_document_data, and evict the
+        least recently used caches when they take more than DOCUMENT_CACHE_MAX_BYTES, see cache_manager.py
+    chunk: write the text chunks to the document dir and insert the Chunk rows
+    index: add the chunks to the keyword and semantic indexes
+    derive: the work derived from the new document given by the app, committed with the ready status, the slow work
+        (e.g. the refresh of the user profile) is started by on_ready after the commit, so it never fails the document
+Each stage has its own worker threads and a bounded queue of the document ids waiting for it, a worker blocks when the
+queue of the next stage is full, so a slow stage holds back the stages before it instead of piling up documents.
+The status of a document is committed with the work of each stage, so it is pending, the last completed stage, ready
+or failed, and resume() continues the documents left in the middle by a crash from the stage after their status.
+The stages keep their outputs in files and rows, so a stage never depends on the memory of an earlier one and running
+a stage again is harmless. The status is advanced by a conditional update from the status before the stage, so when
+two processes run the same stage of a document (e.g. both resumed it), only the first commit wins and the rows of the
+other one, e.g. its Chunk rows and keyword index entries, are rolled back.
+"""
+import json
+import logging
+import os
+import time
+from queue import Queue
+from threading import Condition, Lock, Thread
+from typing import Callable
+from sqlalchemy import update
+from urllib.request import Request, urlopen
+from arxiv import get_base_info_with_paper_id, document_cache_path, load_document_data, write_document_data
+from constants import DOCUMENT_DIR_PREFIX, INGESTION_STAGE_WORKERS, INGESTION_QUEUE_SIZE, PDF_DOWNLOAD_TIMEOUT
+from cache_manager import DOCUMENT_CACHE
+from fts_index import index_document
+from metrics import REGISTRY, timed
+from models import db, Document, Chunk, DocumentStatus
+from semantic_search import LIBRARY_INDEX
+from singleflight import SingleFlight
+from utils import atomic_write, decode_pdf, save_pdf_text_chunks
+
+INGESTION_STAGE_SECONDS = REGISTRY.histogram(
+    "readhub_ingestion_stage_seconds", "The time of the stages of the document ingestion", ("stage",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+INGESTION_DOCUMENTS = REGISTRY.counter(
+    "readhub_ingestion_documents_total", "The ingested documents by the outcome", ("outcome",))
+INGESTION_STAGE_FAILURES = REGISTRY.counter(
+    "readhub_ingestion_stage_failures_total", "The documents failed at each stage of the ingestion", ("stage",))
+
+PAPER_INFO_FILE = "paper_info.json"
+
+logger = logging.getLogger(__name__)
+
+# the documents of the same paper uploaded at the same time download and decode it once
+PDF_DOWNLOAD_FLIGHT = SingleFlight("pdf_download")
+PDF_PARSE_FLIGHT = SingleFlight("pdf_parse")
+
+PDF_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0.3865.90 Safari/537.36"
+
+
+def pdf_path(arxiv_id: str) -> str:
+    return os.path.join(DOCUMENT_DIR_PREFIX, f"{arxiv_id}.pdf")
+
+
+def paper_info_path(document: Document) -> str:
+    return os.path.join(document.base_dir, PAPER_INFO_FILE)
+
+
+def load_paper_info(document: Document) -> dict:
+    with open(paper_info_path(document), "r", encoding='utf-8') as f:
+        return json.load(f)
+
+
+@timed("pdf_download")
+def download(url: str, path: str):
+    with urlopen(Request(url, headers={"User-Agent": PDF_USER_AGENT}), timeout=PDF_DOWNLOAD_TIMEOUT) as response:
+        content = response.read()
+    atomic_write(path, lambda f: f.write(content), binary=True)
+    DOCUMENT_CACHE.touch(path)
+
+
+def parse(paper_info: dict, path: str, cache_path: str):
+    # the leader of an earlier flight may have written the cache after the check of the caller
+    if os.path.exists(cache_path):
+        return
+    write_document_data(cache_path, paper_info, decode_pdf(path))
+    DOCUMENT_CACHE.touch(cache_path)
+    # the caches of the papers still ingesting, including this one, are not evicted
+    DOCUMENT_CACHE.evict()
+
+
+def save_paper_info(document: Document, paper_info: dict):
+    """
+    the output of the metadata stage, paper_info is given by get_base_info_with_paper_id
+    """
+    document.title = paper_info['title']
+    document.abstract = paper_info['abstract']
+    atomic_write(paper_info_path(document), lambda f: json.dump(paper_info, f, ensure_ascii=False))
+
+
+def fetch_metadata(document: Document):
+    if os.path.exists(document_cache_path(document.arxiv_id)):
+        paper_info = load_document_data(document.arxiv_id, with_doc=False)
+    else:
+        paper_info = get_base_info_with_paper_id(document.arxiv_id)
+        # the feed itself is returned if there is no entry of the id
+        if not isinstance(paper_info, dict):
+            raise ValueError(f"Paper {document.arxiv_id} is not found on arXiv")
+    save_paper_info(document, paper_info)
+
+
+def download_pdf(document: Document):
+    arxiv_id = document.arxiv_id
+    if os.path.exists(document_cache_path(arxiv_id)) or os.path.exists(pdf_path(arxiv_id)):
+        return
+    PDF_DOWNLOAD_FLIGHT.do(arxiv_id, download, load_paper_info(document)['link'], pdf_path(arxiv_id))
+
+
+def parse_pdf(document: Document):
+    arxiv_id = document.arxiv_id
+    if os.path.exists(document_cache_path(arxiv_id)):
+        return
+    PDF_PARSE_FLIGHT.do(arxiv_id, parse, load_paper_info(document), pdf_path(arxiv_id), document_cache_path(arxiv_id))
+
+
+def save_chunks(document: Document):
+    # the chunk files of an interrupted run are overwritten, its rows are rolled back with its status
+    chunk_path_list = save_pdf_text_chunks(load_document_data(document.arxiv_id)['doc'], document.base_dir)
+    Chunk.bulk_create(document.id, chunk_path_list)
+
+
+def index_chunks(document: Document):
+    chunks: list[Chunk] = sorted(document.chunks, key=lambda chunk: chunk.id)
+    chunk_id_list = [chunk.id for chunk in chunks]
+    chunk_text_list = [chunk.chunk_text for chunk in chunks]
+    index_document(document, chunk_id_list, chunk_text_list)
+    # the user index built before the status is committed leaves out the document, so the chunks are not added twice
+    LIBRARY_INDEX.index_chunks(document.user_id, chunk_id_list, [document.id] * len(chunk_id_list), chunk_text_list)
+
+
+# the stages before derive, in the order of INGESTION_STAGE_LIST
+DOCUMENT_STAGES: list[tuple[str, Callable[[Document], None]]] = [
+    ('metadata', fetch_metadata),
+    ('download', download_pdf),
+    ('parse', parse_pdf),
+    ('chunk', save_chunks),
+    ('index', index_chunks),
+]
+
+
+class IngestionPipeline:
+    def __init__(
+        self,
+        app,
+        stages: list[tuple[str, Callable[[Document], None]]],
+        stage_workers: dict[str, int] = INGESTION_STAGE_WORKERS,
+        queue_size: int = INGESTION_QUEUE_SIZE,
+        on_ready: Callable[[int], None] | None = None,
+    ):
+        """
+        args:
+            app: the flask app, the stages run in its app context
+            stages: list of (name, the work of the stage on the document), the work is committed with the status
+            stage_workers: the name of a stage -> the number of its worker threads, 1 if it is not given
+            queue_size: the max number of the documents waiting for a stage
+            on_ready: called with the document id after the ready status is committed, its failures are only logged
+        """
+        self.app = app
+        self.stages = stages
+        self.on_ready = on_ready
+        self.stage_names = [name for name, _ in stages]
+        self.stage_workers = stage_workers
+        self.queues: list[Queue] = [Queue(maxsize=queue_size) for _ in stages]
+        self.lock = Lock()
+        self.idle = Condition(self.lock)
+        # the ids of the documents in the queues or the stages
+        self.in_flight: set[int] = set()
+        self.threads: list[Thread] = []
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for stage_index, name in enumerate(self.stage_names):
+                for i in range(self.stage_workers.get(name, 1)):
+                    thread = Thread(target=self.work, args=(stage_index,), name=f"ingestion-{name}-{i}", daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+
+    def next_stage_index(self, status: str) -> int | None:
+        """
+        return:
+            the index of the stage after the status, None if the document is ready or failed
+        """
+        if status == DocumentStatus.PENDING:
+            return 0
+        if status in self.stage_names:
+            # the status is never the last stage, which commits ready, but the last stage is run again if it is
+            return min(self.stage_names.index(status) + 1, len(self.stages) - 1)
+        return None
+
+    def expected_status_list(self, stage_index: int) -> list[str]:
+        """
+        return:
+            the status of a document before the stage, the last stage may be run again after it commits its name
+        """
+        status_list = [DocumentStatus.PENDING if stage_index == 0 else self.stage_names[stage_index - 1]]
+        if stage_index == len(self.stages) - 1:
+            status_list.append(self.stage_names[stage_index])
+        return status_list
+
+    def set_status(self, document_id: int, stage_index: int, **values) -> bool:
+        """
+        update the document if it is still before the stage, in the transaction of the stage
+        return:
+            whether the document is updated, it is not if another worker has passed or failed the stage
+        """
+        result = db.session.execute(
+            update(Document)
+            .where(Document.id == document_id, Document.status.in_(self.expected_status_list(stage_index)))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def submit(self, document_id: int, status: str = DocumentStatus.PENDING) -> bool:
+        """
+        queue a document for the stage after its status, blocking while the queue of that stage is full
+        return:
+            whether the document is queued, it is not if it is ready, failed or already in the pipeline
+        """
+        stage_index = self.next_stage_index(status)
+        if stage_index is None:
+            return False
+        with self.lock:
+            if document_id in self.in_flight:
+                return False
+            self.in_flight.add(document_id)
+        self.start()
+        self.queues[stage_index].put(document_id)
+        return True
+
+    def resume(self) -> int:
+        """
+        queue the documents whose ingestion is interrupted, call it in the app context at the start of the app
+        return:
+            the number of the queued documents
+        """
+        documents = Document.query.filter(Document.status.notin_([DocumentStatus.READY, DocumentStatus.FAILED])).all()
+        # the documents are read before queuing them, a full queue blocks until the workers commit
+        document_status_list = [(document.id, document.status) for document in documents]
+        db.session.commit()
+        return sum(self.submit(document_id, status) for document_id, status in document_status_list)
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """
+        return:
+            whether all the submitted documents are ready or failed before the timeout
+        """
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.in_flight, timeout)
+
+    def wait_documents(self, document_id_list: list[int], timeout: float | None = None) -> bool:
+        """
+        return:
+            whether the documents are ready or failed before the timeout
+        """
+        with self.idle:
+            return self.idle.wait_for(lambda: self.in_flight.isdisjoint(document_id_list), timeout)
+
+    def work(self, stage_index: int):
+        while True:
+            document_id = self.queues[stage_index].get()
+            try:
+                passed = self.run_stage(stage_index, document_id)
+            except Exception as e:
+                # e.g. the database is locked when the failure is committed, the document is resumed at the next start
+                logger.exception(f"The ingestion of the document {document_id} is interrupted: {e}")
+                passed = False
+            if passed and stage_index + 1 < len(self.stages):
+                self.queues[stage_index + 1].put(document_id)
+            else:
+                if passed and self.on_ready is not None:
+                    try:
+                        self.on_ready(document_id)
+                    except Exception:
+                        logger.exception(f"The work after the ingestion of the document {document_id} failed")
+                with self.idle:
+                    self.in_flight.discard(document_id)
+                    self.idle.notify_all()
+
+    def run_stage(self, stage_index: int, document_id: int) -> bool:
+        """
+        return:
+            whether the document passed the stage and goes to the next one
+        """
+        name, func = self.stages[stage_index]
+        last = stage_index == len(self.stages) - 1
+        start = time.perf_counter()
+        with self.app.app_context():
+            document = db.session.get(Document, document_id)
+            # the document is deleted during the ingestion, or another process has run the stage
+            if document is None or document.status not in self.expected_status_list(stage_index):
+                db.session.rollback()
+                return False
+            try:
+                func(document)
+                if not self.set_status(document_id, stage_index, status=DocumentStatus.READY if last else name):
+                    db.session.rollback()
+                    return False
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(f"Failed to ingest the document {document_id} at the {name} stage: {e}")
+                if self.set_status(document_id, stage_index, status=DocumentStatus.FAILED, ingestion_error=f"{name}: {e}"):
+                    INGESTION_STAGE_FAILURES.inc(stage=name)
+                    INGESTION_DOCUMENTS.inc(outcome=DocumentStatus.FAILED)
+                db.session.commit()
+                return False
+            finally:
+                INGESTION_STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+        if last:
+            INGESTION_DOCUMENTS.inc(outcome=DocumentStatus.READY)
+        return True
@@ -0,0 +1,333 @@
+"""
+A tolerant parser of the JSON in the LLM responses, which repairs the common defects instead of failing the whole response:
+    prose: the text and the markdown code fence around the JSON
+    single_quotes: python style 'strings'
+    unescaped_quote: a quote inside a string, e.g. the model's, a quote is closing only if , : } ] the end or another string follows it
+    trailing_comma, extra_comma, missing_comma: the commas between the items
+    python_literal: True, False and None
+    comment: // comments and ... in place of the omitted items
+    unquoted_key, fullwidth_colon: {问题： "..."}
+    truncated: the response is cut off, the complete items of the arrays are kept and the incomplete item is dropped
+    dropped_item: an object item of an array which can not be parsed is skipped
+The well-formed responses are parsed by json.loads.
+"""
+import json
+import re
+from collections import Counter
+from typing import Any
+from metrics import REGISTRY
+
+JSON_REPAIRS = REGISTRY.counter(
+    "readhub_llm_json_repairs_total", "The LLM responses whose JSON needed the repair", ("repair",))
+JSON_DROPPED_ITEMS = REGISTRY.counter(
+    "readhub_llm_json_dropped_items_total", "The incomplete or broken items dropped from the LLM responses")
+
+# the max number of the [ and { tried as the beginning of the JSON, e.g. a citation [1] in the leading text
+MAX_START_CANDIDATES = 8
+
+NUMBER_PATTERN = re.compile(r"-?\d+(\.\d+)?([eE][+-]?\d+)?")
+UNQUOTED_KEY_PATTERN = re.compile(r"\w+")
+LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+# the next quote or backslash in a string of each quote
+STRING_SPECIAL_PATTERNS = {'"': re.compile(r'["\\]'), "'": re.compile(r"['\\]")}
+ESCAPES = {'"': '"', "'": "'", '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class Truncated(Exception):
+    pass
+
+
+class SalvageResult:
+    def __init__(self, value: Any, repairs: Counter, dropped_items: int, end: int):
+        """
+        args:
+            repairs: the repair -> the number of times it is applied
+            dropped_items: the number of the array items dropped
+            end: the end index of the parsed JSON in the text
+        """
+        self.value = value
+        self.repairs = repairs
+        self.dropped_items = dropped_items
+        self.end = end
+
+
+class SalvageParser:
+    def __init__(self, text: str, pos: int = 0):
+        self.text = text
+        self.pos = pos
+        self.repairs: Counter = Counter()
+        self.dropped_items = 0
+        self.depth = 0
+        self.truncated = False
+
+    def at_end(self) -> bool:
+        return self.pos >= len(self.text)
+
+    def skip(self):
+        text = self.text
+        while self.pos < len(text):
+            c = text[self.pos]
+            if c.isspace():
+                self.pos += 1
+            elif text.startswith('//', self.pos):
+                self.repairs['comment'] += 1
+                end = text.find('\n', self.pos)
+                self.pos = len(text) if end == -1 else end
+            elif text.startswith('...', self.pos) or c == '…':
+                self.repairs['comment'] += 1
+                self.pos += 3 if c == '.' else 1
+            else:
+                break
+
+    def parse_value(self) -> Any:
+        self.skip()
+        if self.at_end():
+            raise Truncated()
+        c = self.text[self.pos]
+        if c == '{':
+            return self.parse_object()
+        if c == '[':
+            return self.parse_array()
+        if c in '"\'':
+            return self.parse_string()
+        if c == '-' or c.isdigit():
+            return self.parse_number()
+        return self.parse_literal()
+
+    def parse_string(self) -> str:
+        text = self.text
+        quote = text[self.pos]
+        if quote == "'":
+            self.repairs['single_quotes'] += 1
+        self.pos += 1
+        chars = []
+        pattern = STRING_SPECIAL_PATTERNS[quote]
+        while True:
+            match = pattern.search(text, self.pos)
+            if match is None:
+                raise Truncated()
+            chars.append(text[self.pos:match.start()])
+            self.pos = match.start()
+            if text[self.pos] == '\\':
+                if self.pos + 1 >= len(text):
+                    raise Truncated()
+                escape = text[self.pos + 1]
+                if escape == 'u' and re.fullmatch(r"[0-9a-fA-F]{4}", text[self.pos + 2: self.pos + 6]):
+                    chars.append(chr(int(text[self.pos + 2: self.pos + 6], 16)))
+                    self.pos += 6
+                    continue
+                chars.append(ESCAPES.get(escape, '\\' + escape))
+                self.pos += 2
+                continue
+            end = self.pos + 1
+            while end < len(text) and text[end].isspace():
+                end += 1
+            # the quote is closing if , : } ] or the end follows it,
+            # or a comma is missing: whitespace and the next string, or a new line and the next value
+            if end >= len(text) or text[end] in ',:：}]' \
+                    or (text[end] in '"\'' and end > self.pos + 1) \
+                    or (text[end] in '{[' and '\n' in text[self.pos + 1: end]):
+                self.pos += 1
+                return ''.join(chars)
+            self.repairs['unescaped_quote'] += 1
+            chars.append(quote)
+            self.pos += 1
+
+    def parse_number(self) -> int | float:
+        match = NUMBER_PATTERN.match(self.text, self.pos)
+        if match is None:
+            raise ValueError(f"Invalid number at {self.pos}")
+        if match.end() >= len(self.text):
+            # more digits may be cut off
+            raise Truncated()
+        self.pos = match.end()
+        return float(match.group()) if match.group(1) or match.group(2) else int(match.group())
+
+    def parse_literal(self) -> Any:
+        for word, value in LITERALS.items():
+            if self.text.startswith(word, self.pos):
+                if word[0].isupper():
+                    self.repairs['python_literal'] += 1
+                self.pos += len(word)
+                return value
+            if word.startswith(self.text[self.pos:]):
+                raise Truncated()
+        raise ValueError(f"Unexpected {self.text[self.pos]!r} at {self.pos}")
+
+    def parse_key(self) -> str:
+        c = self.text[self.pos]
+        if c in '"\'':
+            return self.parse_string()
+        match = UNQUOTED_KEY_PATTERN.match(self.text, self.pos)
+        if match is None:
+            raise ValueError(f"Unexpected {c!r} at {self.pos}")
+        self.repairs['unquoted_key'] += 1
+        self.pos = match.end()
+        return match.group()
+
+    def parse_comma(self, has_items: bool, last_comma: bool):
+        if last_comma or not has_items:
+            self.repairs['extra_comma'] += 1
+        self.pos += 1
+
+    def parse_array(self) -> list:
+        self.pos += 1
+        self.depth += 1
+        items = []
+        last_comma = False
+        try:
+            while True:
+                self.skip()
+                if self.at_end():
+                    self.truncated = True
+                    self.repairs['truncated'] += 1
+                    return items
+                c = self.text[self.pos]
+                if c == ']':
+                    if last_comma:
+                        self.repairs['trailing_comma'] += 1
+                    self.pos += 1
+                    return items
+                if c == ',':
+                    self.parse_comma(bool(items), last_comma)
+                    last_comma = True
+                    continue
+                if items and not last_comma:
+                    self.repairs['missing_comma'] += 1
+                start = self.pos
+                try:
+                    items.append(self.parse_value())
+                except Truncated:
+                    self.truncated = True
+                    self.repairs['truncated'] += 1
+                    self.dropped_items += 1
+                    return items
+                except ValueError:
+                    # skip a broken object to the beginning of the next one
+                    next_start = self.text.find('{', max(self.pos, start + 1))
+                    if self.text[start] != '{' or next_start == -1:
+                        raise
+                    self.repairs['dropped_item'] += 1
+                    self.dropped_items += 1
+                    self.pos = next_start
+                    last_comma = True
+                    continue
+                last_comma = False
+                if self.truncated:
+                    return items
+        finally:
+            self.depth -= 1
+
+    def parse_object(self) -> dict:
+        self.pos += 1
+        self.depth += 1
+        result = {}
+        last_comma = False
+        try:
+            while True:
+                self.skip()
+                if self.at_end():
+                    raise Truncated()
+                c = self.text[self.pos]
+                if c == '}':
+                    if last_comma:
+                        self.repairs['trailing_comma'] += 1
+                    self.pos += 1
+                    return result
+                if c == ',':
+                    self.parse_comma(bool(result), last_comma)
+                    last_comma = True
+                    continue
+                if result and not last_comma:
+                    self.repairs['missing_comma'] += 1
+                key = self.parse_key()
+                self.skip()
+                if self.at_end():
+                    raise Truncated()
+                if self.text[self.pos] == '：':
+                    self.repairs['fullwidth_colon'] += 1
+                elif self.text[self.pos] != ':':
+                    raise ValueError(f"Expect ':' at {self.pos}")
+                self.pos += 1
+                result[key] = self.parse_value()
+                last_comma = False
+                if self.truncated:
+                    raise Truncated()
+        except Truncated:
+            # the complete pairs of the outermost object are kept, e.g. an array of questions cut off in the middle
+            if self.depth == 1:
+                self.truncated = True
+                self.repairs['truncated'] += 1
+                return result
+            raise
+        finally:
+            self.depth -= 1
+
+
+def start_candidates(text: str) -> list[int]:
+    """
+    the indexes of the [ and { which may begin the JSON, those in a code fence first
+    """
+    fence = text.find("```")
+    candidates = [i for i, c in enumerate(text) if c in '[{'][:MAX_START_CANDIDATES * 4]
+    if fence != -1:
+        candidates = [i for i in candidates if i > fence] + [i for i in candidates if i < fence]
+    return candidates[:MAX_START_CANDIDATES]
+
+
+def salvage_json(text: str) -> SalvageResult:
+    """
+    parse the JSON in the text, repairing the defects
+    raise:
+        ValueError if there is no JSON value which can be salvaged
+    """
+    begin_list = [i for i in (text.find('['), text.find('{')) if i != -1]
+    if not begin_list:
+        raise ValueError("No JSON in the response")
+    begin = min(begin_list)
+    end = max(text.rfind(']'), text.rfind('}')) + 1
+    if end > begin:
+        repairs = Counter({'prose': 1}) if text[:begin].strip() or text[end:].strip() else Counter()
+        candidate = text[begin:end]
+        try:
+            return SalvageResult(json.loads(candidate, strict=False), repairs, 0, end)
+        except json.JSONDecodeError:
+            pass
+        # the python style JSON without any apostrophe in the strings
+        if '"' not in candidate:
+            try:
+                value = json.loads(candidate.replace("'", '"'), strict=False)
+                repairs['single_quotes'] += 1
+                return SalvageResult(value, repairs, 0, end)
+            except json.JSONDecodeError:
+                pass
+    # the longest JSON value is taken, e.g. not a citation [1] in the leading text
+    best: tuple[int, SalvageParser, Any] | None = None
+    for start in start_candidates(text):
+        parser = SalvageParser(text, start)
+        try:
+            value = parser.parse_value()
+        except (Truncated, ValueError, RecursionError):
+            continue
+        if parser.truncated and not value:
+            continue
+        if best is None or parser.pos - start > best[1].pos - best[0]:
+            best = (start, parser, value)
+    if best is None:
+        raise ValueError("Invalid json format")
+    start, parser, value = best
+    if text[:start].strip() or text[parser.pos:].strip():
+        parser.repairs['prose'] += 1
+    return SalvageResult(value, parser.repairs, parser.dropped_items, parser.pos)
+
+
+def parse_llm_json(text: str) -> Any:
+    """
+    salvage_json and record the repairs in the metrics
+    """
+    result = salvage_json(text)
+    for repair in result.repairs:
+        JSON_REPAIRS.inc(repair=repair)
+    if result.dropped_items:
+        JSON_DROPPED_ITEMS.inc(result.dropped_items)
+    return result.value
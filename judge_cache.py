@@ -0,0 +1,110 @@
+"""
+Semantic cache of the LLM judgements. Users answering the same question often write nearly the same answer,
+so the judgement of a previous answer is reused when the new answer is within the similarity radius of it.
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable
+import numpy as np
+from constants import USE_JUDGE_CACHE, JUDGE_CACHE_SIMILARITY_THRESHOLD, JUDGE_CACHE_MAX_STANDARD_ANSWERS, \
+    JUDGE_CACHE_MAX_ANSWERS_PER_STANDARD_ANSWER
+from grading import embed_texts
+
+
+class JudgedAnswers:
+    """
+    the judged answers of one standard answer, the embeddings are stored in a preallocated matrix
+    and the oldest answer is overwritten when the matrix is full
+    """
+    def __init__(self, dim: int, capacity: int):
+        self.embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        self.judgements: list[tuple[int, str]] = []
+        self.next_index = 0
+
+    def nearest(self, embedding: np.ndarray) -> tuple[float, tuple[int, str] | None]:
+        if not self.judgements:
+            return -1.0, None
+        similarity = self.embeddings[:len(self.judgements)] @ embedding
+        index = int(np.argmax(similarity))
+        return float(similarity[index]), self.judgements[index]
+
+    def add(self, embedding: np.ndarray, judgement: tuple[int, str]):
+        capacity = self.embeddings.shape[0]
+        self.embeddings[self.next_index] = embedding
+        if len(self.judgements) < capacity:
+            self.judgements.append(judgement)
+        else:
+            self.judgements[self.next_index] = judgement
+        self.next_index = (self.next_index + 1) % capacity
+
+
+class JudgementCache:
+    def __init__(
+        self,
+        embed: Callable[[list[str]], np.ndarray | None] = embed_texts,
+        similarity_threshold: float = JUDGE_CACHE_SIMILARITY_THRESHOLD,
+        max_standard_answers: int = JUDGE_CACHE_MAX_STANDARD_ANSWERS,
+        max_answers_per_standard_answer: int = JUDGE_CACHE_MAX_ANSWERS_PER_STANDARD_ANSWER,
+        enabled: bool = USE_JUDGE_CACHE,
+    ):
+        """
+        args:
+            embed: return the l2 normalized embeddings of the texts, or None if no encoder is available
+            similarity_threshold: the min cosine similarity to reuse a judgement
+        """
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.max_standard_answers = max_standard_answers
+        self.max_answers_per_standard_answer = max_answers_per_standard_answer
+        self.enabled = enabled
+        self.standard_answer_to_judged: OrderedDict[str, JudgedAnswers] = OrderedDict()
+        self.lock = Lock()
+        self.hit_number = 0
+        self.miss_number = 0
+
+    def _embed(self, text: str) -> np.ndarray | None:
+        if not self.enabled:
+            return None
+        embeddings = self.embed([text])
+        return None if embeddings is None else embeddings[0]
+
+    def lookup(self, user_answer: str, standard_answer: str) -> tuple[int, str] | None:
+        """
+        return:
+            the (score, review) of the nearest judged answer within the similarity radius, or None
+        """
+        if not self.enabled or standard_answer not in self.standard_answer_to_judged:
+            return None
+        embedding = self._embed(user_answer)
+        if embedding is None:
+            return None
+        with self.lock:
+            judged = self.standard_answer_to_judged.get(standard_answer)
+            if judged is None:
+                return None
+            self.standard_answer_to_judged.move_to_end(standard_answer)
+            similarity, judgement = judged.nearest(embedding)
+            if judgement is not None and similarity >= self.similarity_threshold:
+                self.hit_number += 1
+                return judgement
+            self.miss_number += 1
+            return None
+
+    def add(self, user_answer: str, standard_answer: str, judgement: tuple[int, str]):
+        if judgement[0] is None:
+            return
+        embedding = self._embed(user_answer)
+        if embedding is None:
+            return
+        with self.lock:
+            judged = self.standard_answer_to_judged.get(standard_answer)
+            if judged is None:
+                judged = JudgedAnswers(embedding.shape[0], self.max_answers_per_standard_answer)
+                self.standard_answer_to_judged[standard_answer] = judged
+                if len(self.standard_answer_to_judged) > self.max_standard_answers:
+                    self.standard_answer_to_judged.popitem(last=False)
+            self.standard_answer_to_judged.move_to_end(standard_answer)
+            judged.add(embedding, judgement)
+
+
+JUDGEMENT_CACHE = JudgementCache()
@@ -0,0 +1,413 @@
+"""
+The LLM backends behind utils._get_response, selected by the LLM_BACKEND environment variable:
+    zhipu: the live ZhipuAI API, the client is created on the first call
+    stand_in: a local stand-in which answers every prompt family with a schema valid response after a sampled latency,
+        with injected errors and malformed JSON, used to load test and benchmark the pipeline offline
+    record: call the live API and append every prompt and response to LLM_RECORD_FILE
+    replay: answer the prompts from LLM_RECORD_FILE, so a recorded session can be measured again reproducibly
+"""
+import abc
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+from metrics import record_llm_tokens
+from constants import LLM_BACKEND, LLM_MODEL, LLM_RECORD_FILE, LLM_REPLAY_LATENCY, STAND_IN_LATENCY, STAND_IN_FAMILY_LATENCY, \
+    STAND_IN_LATENCY_SCALE, STAND_IN_ERROR_RATE, STAND_IN_MALFORMED_RATE, STAND_IN_SEED
+
+
+class LLMBackend(abc.ABC):
+    """
+    the interface of the LLM backends
+    """
+    @abc.abstractmethod
+    def chat(self, prompt: str) -> str:
+        """
+        return:
+            the content of the reply to a single user message
+        """
+
+
+class ZhipuBackend(LLMBackend):
+    def __init__(self, api_key: str | None = None, model: str = LLM_MODEL):
+        self.api_key = api_key
+        self.model = model
+        self.client = None
+        self.lock = Lock()
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                from zhipuai import ZhipuAI
+                api_key = self.api_key or os.environ.get("API_KEY")
+                if api_key is None:
+                    raise RuntimeError("You must export the variable API_KEY in your os environment")
+                self.client = ZhipuAI(api_key=api_key)
+            return self.client
+
+    def chat(self, prompt: str) -> str:
+        response = self.get_client().chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "user", "content": prompt},
+            ],
+        )
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            record_llm_tokens(detect_prompt_family(prompt), usage.prompt_tokens, usage.completion_tokens)
+        return response.choices[0].message.content
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    about one token per chinese character and 4/3 tokens per english word, for the backends which do not report the usage
+    """
+    cjk_number = len(re.findall(r"[\u4e00-\u9fff]", text))
+    word_number = len(re.findall(r"[A-Za-z0-9]+", text))
+    return cjk_number + math.ceil(word_number * 4 / 3)
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+
+# the markers of each prompt family, checked in order, e.g. the packed blank judging prompt also contains 填空题
+PROMPT_FAMILY_MARKERS = [
+    ('judge_blank', "逐题给出"),
+    ('judge', "'评分': **"),
+    ('fused', "按题型分组"),
+    ('choice', "四选一选择题"),
+    ('tf', "道判断题"),
+    ('blank', "道填空题"),
+    ('sum', "'总结': **"),
+    ('review', "审稿人"),
+    ('profile', "用户画像"),
+    ('recommendation', '"paper_id"'),
+]
+
+
+def detect_prompt_family(prompt: str) -> str:
+    """
+    return:
+        one of choice/tf/blank/sum/review/judge/judge_blank/profile/recommendation, unknown if no marker is found
+    """
+    for family, marker in PROMPT_FAMILY_MARKERS:
+        if marker in prompt:
+            return family
+    return 'unknown'
+
+
+class LatencyDistribution:
+    def __init__(self, spec: str):
+        """
+        args:
+            spec: "<kind>:<params>" in ms, one of constant:100, uniform:100,500, normal:300,50, lognormal:<median>,<sigma>,
+                or "0" for no latency
+        """
+        kind, _, params = spec.partition(':')
+        self.kind = kind.strip()
+        self.params = [float(param) for param in params.split(',')] if params else []
+        if self.kind not in ['0', 'constant', 'uniform', 'normal', 'lognormal']:
+            raise ValueError(f"Unknown latency distribution {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        """
+        return:
+            the latency in seconds
+        """
+        if self.kind == '0':
+            latency = 0
+        elif self.kind == 'constant':
+            latency = self.params[0]
+        elif self.kind == 'uniform':
+            latency = rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            latency = rng.gauss(*self.params)
+        else:
+            latency = rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        return max(latency, 0) / 1000
+
+
+class StandInError(RuntimeError):
+    """
+    an injected failure of the stand-in backend, like a rate limit or a timeout of the live API
+    """
+
+
+def clean_text(text: str, max_length: int = 200) -> str:
+    """
+    remove the quotes and the line breaks, since the responses are parsed after replacing ' with "
+    """
+    return re.sub(r"\s+", " ", re.sub(r"['\"\\]", "", text)).strip()[:max_length]
+
+
+def get_sentences(text: str) -> list[str]:
+    sentences = [clean_text(sentence) for sentence in re.split(r'(?<=[.!?。！？])\s+|\n+', text)]
+    sentences = [sentence for sentence in sentences if len(sentence.split()) >= 5 or len(sentence) >= 20]
+    return sentences or ["The paper proposes a method and evaluates it on several benchmarks."]
+
+
+def get_keywords(text: str, number: int) -> list[str]:
+    words = [word.lower() for word in re.findall(r"[A-Za-z][A-Za-z\-]{5,}", text)]
+    keywords = [word for word, _ in Counter(words).most_common(number)]
+    return keywords or ["machine learning"]
+
+
+def char_overlap(text1: str, text2: str) -> float:
+    set1, set2 = set(text1.lower().split()) | set(text1), set(text2.lower().split()) | set(text2)
+    if not set1 or not set2:
+        return 0.0
+    return 2 * len(set1 & set2) / (len(set1) + len(set2))
+
+
+class StandInBackend(LLMBackend):
+    def __init__(
+        self,
+        latency: str = STAND_IN_LATENCY,
+        family_latency: dict[str, str] = STAND_IN_FAMILY_LATENCY,
+        latency_scale: float = STAND_IN_LATENCY_SCALE,
+        error_rate: float = STAND_IN_ERROR_RATE,
+        malformed_rate: float = STAND_IN_MALFORMED_RATE,
+        seed: int = STAND_IN_SEED,
+    ):
+        """
+        args:
+            latency: the latency distribution of the prompt families not in family_latency
+            family_latency: prompt family -> latency distribution
+            latency_scale: multiply the sampled latencies, 0 to answer at once
+            error_rate: the probability of raising StandInError
+            malformed_rate: the probability of corrupting the JSON of the response
+            seed: the latencies and failures are sampled from one seeded generator, the contents only depend on the prompt and the seed
+        """
+        self.latency = LatencyDistribution(latency)
+        self.family_latency = {family: LatencyDistribution(spec) for family, spec in family_latency.items()}
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.call_number: dict[str, int] = defaultdict(int)
+        self.generators = {
+            'fused': self.fused_response,
+            'choice': self.choice_response,
+            'tf': self.tf_response,
+            'blank': self.blank_response,
+            'sum': self.sum_response,
+            'review': self.review_response,
+            'judge': self.judge_response,
+            'judge_blank': self.judge_blank_response,
+            'profile': self.profile_response,
+            'recommendation': self.recommendation_response,
+        }
+
+    def chat(self, prompt: str) -> str:
+        family = detect_prompt_family(prompt)
+        with self.lock:
+            self.call_number[family] += 1
+            latency = self.family_latency.get(family, self.latency).sample(self.rng) * self.latency_scale
+            failed = self.rng.random() < self.error_rate
+            malformed = self.rng.random() < self.malformed_rate
+            corruption = self.rng.choice(['truncate', 'trailing_comma', 'apostrophe'])
+        time.sleep(latency)
+        if failed:
+            raise StandInError(f"Injected failure of a {family} prompt")
+        content_rng = random.Random(f"{self.seed}:{prompt_hash(prompt)}")
+        generator = self.generators.get(family)
+        response = json.dumps(generator(prompt, content_rng) if generator else {}, ensure_ascii=False)
+        record_llm_tokens(family, estimate_tokens(prompt), estimate_tokens(response))
+        return self.corrupt(response, corruption) if malformed else response
+
+    @staticmethod
+    def corrupt(response: str, corruption: str) -> str:
+        """
+        the mistakes seen in the live responses: cut off in the middle, a trailing comma, an apostrophe in a value
+        """
+        if corruption == 'truncate':
+            return response[:len(response) * 2 // 3]
+        if corruption == 'trailing_comma':
+            return response[:-1] + ", " + response[-1]
+        index = response.find('": "')
+        if index == -1:
+            return response[:len(response) * 2 // 3]
+        return response[:index + 4] + "the model's " + response[index + 4:]
+
+    @staticmethod
+    def article(prompt: str) -> str:
+        return prompt.split("\n\n以上是", 1)[0]
+
+    @staticmethod
+    def problem_number(prompt: str) -> int:
+        match = re.search(r"提出(\d+)道", prompt)
+        return int(match.group(1)) if match else 3
+
+    def choice_response(self, prompt: str, rng: random.Random) -> list[dict]:
+        sentences = get_sentences(self.article(prompt))
+        problems = []
+        for keyword in (get_keywords(self.article(prompt), self.problem_number(prompt)) * 3)[:self.problem_number(prompt)]:
+            options = [rng.choice(sentences) for _ in range(4)]
+            problems.append({
+                '问题': f"Which statement about {keyword} is supported by the paper?",
+                'A': options[0], 'B': options[1], 'C': options[2], 'D': options[3],
+                '正确答案': rng.choice("ABCD"),
+            })
+        return problems
+
+    def tf_response(self, prompt: str, rng: random.Random) -> list[dict]:
+        sentences = get_sentences(self.article(prompt))
+        return [
+            {'问题': rng.choice(sentences), '答案': rng.choice(["正确", "错误"])}
+            for _ in range(self.problem_number(prompt))
+        ]
+
+    def blank_response(self, prompt: str, rng: random.Random) -> list[dict]:
+        sentences = get_sentences(self.article(prompt))
+        problems = []
+        for _ in range(self.problem_number(prompt)):
+            sentence = rng.choice(sentences)
+            words = [word for word in re.findall(r"[A-Za-z][A-Za-z\-]{3,19}", sentence)] or ["method"]
+            answer = rng.choice(words)
+            problems.append({'问题': sentence.replace(answer, "____", 1) if answer in sentence else f"{sentence} ____", '答案': answer})
+        return problems
+
+    def fused_response(self, prompt: str, rng: random.Random) -> dict:
+        article = self.article(prompt)
+        response = {}
+        for section, pattern, generator in [
+            ("选择题", r"(\d+)道四选一选择题", self.choice_response),
+            ("判断题", r"(\d+)道判断题", self.tf_response),
+            ("填空题", r"(\d+)道填空题", self.blank_response),
+        ]:
+            match = re.search(pattern, prompt)
+            if match:
+                response[section] = generator(f"{article}\n\n以上是提出{match.group(1)}道", rng)
+        return response
+
+    def sum_response(self, prompt: str, rng: random.Random) -> dict:
+        return {'总结': " ".join(get_sentences(self.article(prompt))[:5])}
+
+    def review_response(self, prompt: str, rng: random.Random) -> dict:
+        keywords = get_keywords(self.article(prompt), 4)
+        return {
+            '优点': [f"The treatment of {keyword} is clear and well motivated." for keyword in keywords[:2]],
+            '缺点': [f"The evaluation of {keyword} could be more thorough." for keyword in keywords[2:] or keywords[:1]],
+        }
+
+    def judge_response(self, prompt: str, rng: random.Random) -> dict:
+        match = re.search(r"你的学生的回答如下: (.*)\n一个标准的回答是：(.*)\n请你", prompt, re.S)
+        score = int(100 * char_overlap(match.group(1), match.group(2))) if match else rng.randint(0, 100)
+        return {'评分': score, '评价': "The answer covers the main points." if score >= 60 else "The answer misses the key points."}
+
+    def judge_blank_response(self, prompt: str, rng: random.Random) -> list[dict]:
+        items = [json.loads(line) for line in prompt.splitlines() if line.startswith('{"编号"')]
+        return [
+            {'编号': item['编号'], '评分': int(100 * char_overlap(item['学生的回答'], item['标准答案'])), '评价': "Checked against the paper."}
+            for item in items
+        ]
+
+    def profile_response(self, prompt: str, rng: random.Random) -> dict:
+        documents = prompt.split("信息如下:", 1)[-1].split("请你按照", 1)[0]
+        keywords = get_keywords(documents, 3)
+        return {'领域': keywords, '描述': f"The user reads papers about {', '.join(keywords)}."}
+
+    def recommendation_response(self, prompt: str, rng: random.Random) -> list[dict]:
+        paper_ids = [paper_id for paper_id in re.findall(r'"paper_id": "(.*?)"', prompt) if paper_id != "论文的id"]
+        match = re.search(r"最相关的(\d+)篇", prompt)
+        number = min(int(match.group(1)) if match else 3, len(paper_ids))
+        return [{'paper_id': paper_id, 'reason': "Related to the research interests."} for paper_id in rng.sample(paper_ids, number)]
+
+
+class RecordReplayBackend(LLMBackend):
+    def __init__(self, record_file: str = LLM_RECORD_FILE, backend: LLMBackend | None = None, replay_latency: bool = LLM_REPLAY_LATENCY):
+        """
+        args:
+            record_file: a JSONL file of {key, family, prompt, response, latency_ms}
+            backend: the responses of the backend are recorded, None to replay the record file
+            replay_latency: sleep the recorded latency when replaying
+        """
+        self.record_file = record_file
+        self.backend = backend
+        self.replay_latency = replay_latency
+        self.lock = Lock()
+        # the responses of the same prompt are replayed in the recorded order, e.g. the retries of a malformed response
+        self.records: dict[str, list[dict]] = defaultdict(list)
+        self.replay_index: dict[str, int] = defaultdict(int)
+        if backend is None:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.record_file):
+            return
+        with open(self.record_file, "r", encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a partially written line of a crash
+                    continue
+                self.records[record['key']].append(record)
+
+    def chat(self, prompt: str) -> str:
+        key = prompt_hash(prompt)
+        if self.backend is None:
+            with self.lock:
+                records = self.records.get(key)
+                if not records:
+                    raise LookupError(f"The prompt {key} is not recorded in {self.record_file}")
+                record = records[self.replay_index[key] % len(records)]
+                self.replay_index[key] += 1
+            if self.replay_latency:
+                time.sleep(record['latency_ms'] / 1000)
+            return record['response']
+        start = time.perf_counter()
+        response = self.backend.chat(prompt)
+        record = {
+            'key': key,
+            'family': detect_prompt_family(prompt),
+            'prompt': prompt,
+            'response': response,
+            'latency_ms': (time.perf_counter() - start) * 1000,
+        }
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.record_file)), exist_ok=True)
+            with open(self.record_file, "a", encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return response
+
+
+def create_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    if name == 'zhipu':
+        return ZhipuBackend()
+    if name == 'stand_in':
+        return StandInBackend()
+    if name == 'record':
+        return RecordReplayBackend(backend=ZhipuBackend())
+    if name == 'replay':
+        return RecordReplayBackend()
+    raise ValueError(f"Unknown LLM backend {name}")
+
+
+_BACKEND: LLMBackend | None = None
+_BACKEND_LOCK = Lock()
+
+
+def get_backend() -> LLMBackend:
+    global _BACKEND
+    with _BACKEND_LOCK:
+        if _BACKEND is None:
+            _BACKEND = create_backend()
+        return _BACKEND
+
+
+def set_backend(backend: LLMBackend):
+    """
+    replace the backend of the process, e.g. a stand-in with a fixed seed in a benchmark
+    """
+    global _BACKEND
+    with _BACKEND_LOCK:
+        _BACKEND = backend
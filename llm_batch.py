@@ -0,0 +1,331 @@
+"""
+The batch mode of the background LLM calls, used by utils._call_llm when USE_LLM_BATCH is set and the call is in the
+BACKGROUND priority class of llm_scheduler.py, e.g. the refresh of the user profiles and the recommendations.
+The prompts are accumulated until LLM_BATCH_MAX_SIZE prompts or LLM_BATCH_MAX_DELAY seconds, written to a JSONL job file
+    {"custom_id": "request-<n>", "method": "POST", "url": "/v4/chat/completions", "body": {"model": ..., "messages": [...]}}
+and submitted to the batch endpoint, which is polled every LLM_BATCH_POLL_INTERVAL seconds until the job is done,
+then the responses are fanned out to the callers blocked in BatchExecutor.chat.
+The batch calls don't take the slots of the scheduler, so they never delay the interactive calls, and are billed at
+the batch price of the provider.
+The batch endpoints:
+    zhipu: the batch API of ZhipuAI, the job file is uploaded by files.create and run by batches.create
+    stand_in: answer the job file in a local thread with StandInBackend after a sampled job latency, for the tests
+"""
+import abc
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+from llm_backend import ZhipuBackend, StandInBackend, StandInError, LatencyDistribution, detect_prompt_family
+from llm_scheduler import LLM_PRIORITY, BACKGROUND
+from metrics import REGISTRY, record_llm_tokens
+from constants import USE_LLM_BATCH, LLM_BATCH_ENDPOINT, LLM_BATCH_DIR, LLM_BATCH_MAX_SIZE, LLM_BATCH_MAX_DELAY, \
+    LLM_BATCH_POLL_INTERVAL, LLM_BATCH_MAX_WAIT, LLM_MODEL, STAND_IN_BATCH_LATENCY, STAND_IN_LATENCY_SCALE, STAND_IN_SEED
+
+LLM_BATCH_JOBS = REGISTRY.counter(
+    "readhub_llm_batch_jobs_total", "The batch jobs of the background LLM calls by outcome", ("outcome",))
+LLM_BATCH_PROMPTS = REGISTRY.counter(
+    "readhub_llm_batch_prompts_total", "The prompts sent in the batch jobs by outcome", ("outcome",))
+LLM_BATCH_JOB_SECONDS = REGISTRY.histogram(
+    "readhub_llm_batch_job_seconds", "The time from the submission of a batch job to its results",
+    buckets=(1, 10, 30, 60, 300, 900, 1800, 3600, 4 * 3600, 24 * 3600))
+
+CHAT_COMPLETIONS_URL = "/v4/chat/completions"
+
+# the states of a batch job returned by BatchEndpoint.poll
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class BatchItemError(RuntimeError):
+    """
+    the batch job did not answer the prompt
+    """
+
+
+def use_batch() -> bool:
+    """
+    whether the LLM calls of the current context are sent in batches
+    """
+    return USE_LLM_BATCH and LLM_PRIORITY.get() == BACKGROUND
+
+
+class BatchEndpoint(abc.ABC):
+    """
+    the interface of the batch endpoints
+    """
+    @abc.abstractmethod
+    def submit(self, input_file: str) -> str:
+        """
+        return:
+            the id of the job running the requests of the JSONL input file
+        """
+
+    @abc.abstractmethod
+    def poll(self, job_id: str) -> str:
+        """
+        return:
+            RUNNING, COMPLETED or FAILED
+        """
+
+    @abc.abstractmethod
+    def download(self, job_id: str, output_file: str):
+        """
+        write the results of the completed job to the JSONL output file, one line per answered or failed request
+        """
+
+
+class ZhipuBatchEndpoint(BatchEndpoint):
+    def __init__(self, backend: ZhipuBackend | None = None):
+        self.backend = backend or ZhipuBackend()
+
+    def submit(self, input_file: str) -> str:
+        client = self.backend.get_client()
+        with open(input_file, "rb") as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window="24h",
+            auto_delete_input_file=True,
+        )
+        return batch.id
+
+    def poll(self, job_id: str) -> str:
+        status = self.backend.get_client().batches.retrieve(job_id).status
+        if status == 'completed':
+            return COMPLETED
+        if status in ['failed', 'expired', 'cancelling', 'cancelled']:
+            return FAILED
+        return RUNNING
+
+    def download(self, job_id: str, output_file: str):
+        client = self.backend.get_client()
+        batch = client.batches.retrieve(job_id)
+        with open(output_file, "wb") as f:
+            # the failed requests are in the error file
+            for file_id in [batch.output_file_id, batch.error_file_id]:
+                if file_id:
+                    content = client.files.content(file_id).content
+                    f.write(content if content.endswith(b"\n") else content + b"\n")
+
+
+class StandInBatchEndpoint(BatchEndpoint):
+    def __init__(
+        self,
+        backend: StandInBackend | None = None,
+        latency: str = STAND_IN_BATCH_LATENCY,
+        latency_scale: float = STAND_IN_LATENCY_SCALE,
+        seed: int = STAND_IN_SEED,
+    ):
+        """
+        args:
+            backend: answer the requests of the jobs, without its own latency by default
+            latency: the latency distribution of a job
+        """
+        self.backend = backend or StandInBackend(latency_scale=0, seed=seed)
+        self.latency = LatencyDistribution(latency)
+        self.latency_scale = latency_scale
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.job_ids = itertools.count()
+        # job id -> the status and the output lines
+        self.jobs: dict[str, dict] = {}
+
+    def submit(self, input_file: str) -> str:
+        with open(input_file, "r", encoding='utf-8') as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        with self.lock:
+            job_id = f"batch-{next(self.job_ids)}"
+            self.jobs[job_id] = {'status': RUNNING, 'output': []}
+            latency = self.latency.sample(self.rng) * self.latency_scale
+        Thread(target=self.run, args=(job_id, requests, latency), daemon=True).start()
+        return job_id
+
+    def run(self, job_id: str, requests: list[dict], latency: float):
+        time.sleep(latency)
+        output = []
+        for request in requests:
+            try:
+                content = self.backend.chat(request['body']['messages'][-1]['content'])
+                response = {'status_code': 200, 'body': {'choices': [{'message': {'role': 'assistant', 'content': content}}]}}
+                output.append({'custom_id': request['custom_id'], 'response': response, 'error': None})
+            except StandInError as e:
+                output.append({'custom_id': request['custom_id'], 'response': {'status_code': 500, 'body': {}}, 'error': {'message': str(e)}})
+        with self.lock:
+            self.jobs[job_id] = {'status': COMPLETED, 'output': output}
+
+    def poll(self, job_id: str) -> str:
+        with self.lock:
+            return self.jobs[job_id]['status']
+
+    def download(self, job_id: str, output_file: str):
+        with self.lock:
+            output = self.jobs.pop(job_id)['output']
+        with open(output_file, "w", encoding='utf-8') as f:
+            for record in output:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def create_batch_endpoint(name: str = LLM_BATCH_ENDPOINT) -> BatchEndpoint:
+    if name == 'zhipu':
+        return ZhipuBatchEndpoint()
+    if name == 'stand_in':
+        return StandInBatchEndpoint()
+    raise ValueError(f"Unknown LLM batch endpoint {name}")
+
+
+class BatchRequest:
+    def __init__(self, custom_id: str, prompt: str):
+        self.custom_id = custom_id
+        self.prompt = prompt
+        self.submit_time = time.monotonic()
+        self.future: Future = Future()
+
+
+def parse_batch_output(output_file: str) -> tuple[dict[str, str | BatchItemError], dict[str, dict]]:
+    """
+    return:
+        custom id -> the content of the response or the error of the request,
+        custom id -> the token usage of the response if it is reported
+    """
+    results = {}
+    usages = {}
+    with open(output_file, "r", encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            body = response.get('body') or {}
+            if response.get('status_code') == 200 and body.get('choices'):
+                results[record['custom_id']] = body['choices'][0]['message']['content']
+                if body.get('usage'):
+                    usages[record['custom_id']] = body['usage']
+            else:
+                error = record.get('error') or body.get('error') or f"status code {response.get('status_code')}"
+                results[record['custom_id']] = BatchItemError(f"The batch request {record['custom_id']} failed: {error}")
+    return results, usages
+
+
+class BatchExecutor:
+    def __init__(
+        self,
+        endpoint: BatchEndpoint | None = None,
+        batch_dir: str = LLM_BATCH_DIR,
+        max_size: int = LLM_BATCH_MAX_SIZE,
+        max_delay: float = LLM_BATCH_MAX_DELAY,
+        poll_interval: float = LLM_BATCH_POLL_INTERVAL,
+        max_wait: float = LLM_BATCH_MAX_WAIT,
+        model: str = LLM_MODEL,
+    ):
+        """
+        args:
+            endpoint: created by create_batch_endpoint on the first job if None
+            batch_dir: the job files, removed when the job is done
+        """
+        self.endpoint = endpoint
+        self.batch_dir = batch_dir
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.model = model
+        self.condition = Condition()
+        self.pending: list[BatchRequest] = []
+        self.request_ids = itertools.count()
+        self.thread: Thread | None = None
+
+    def get_endpoint(self) -> BatchEndpoint:
+        with self.condition:
+            if self.endpoint is None:
+                self.endpoint = create_batch_endpoint()
+            return self.endpoint
+
+    def submit(self, prompt: str) -> Future:
+        """
+        return:
+            the future of the content of the response
+        """
+        with self.condition:
+            request = BatchRequest(f"request-{next(self.request_ids)}", prompt)
+            self.pending.append(request)
+            if self.thread is None:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        return request.future
+
+    def chat(self, prompt: str) -> str:
+        """
+        the same as LLMBackend.chat, blocks until the job of the prompt is done
+        raise:
+            BatchItemError if the job did not answer the prompt, TimeoutError after max_wait seconds
+        """
+        return self.submit(prompt).result(timeout=self.max_wait)
+
+    def run(self):
+        # 收集请求，达到数量或等待时间后提交一个batch任务，每个任务在自己的线程中轮询
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = self.pending[0].submit_time + self.max_delay
+                while len(self.pending) < self.max_size and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+                requests, self.pending = self.pending[:self.max_size], self.pending[self.max_size:]
+            Thread(target=self.run_job, args=(requests,), daemon=True).start()
+
+    def run_job(self, requests: list[BatchRequest]):
+        input_file = output_file = None
+        try:
+            endpoint = self.get_endpoint()
+            os.makedirs(self.batch_dir, exist_ok=True)
+            input_file = os.path.join(self.batch_dir, f"{requests[0].custom_id}-{os.getpid()}.input.jsonl")
+            with open(input_file, "w", encoding='utf-8') as f:
+                for request in requests:
+                    f.write(json.dumps({
+                        'custom_id': request.custom_id,
+                        'method': "POST",
+                        'url': CHAT_COMPLETIONS_URL,
+                        'body': {'model': self.model, 'messages': [{'role': "user", 'content': request.prompt}]},
+                    }, ensure_ascii=False) + "\n")
+            start = time.perf_counter()
+            job_id = endpoint.submit(input_file)
+            while (status := endpoint.poll(job_id)) == RUNNING:
+                time.sleep(self.poll_interval)
+            if status == FAILED:
+                raise RuntimeError(f"The batch job {job_id} failed")
+            output_file = input_file.replace(".input.jsonl", ".output.jsonl")
+            endpoint.download(job_id, output_file)
+            results, usages = parse_batch_output(output_file)
+            LLM_BATCH_JOB_SECONDS.observe(time.perf_counter() - start)
+            LLM_BATCH_JOBS.inc(outcome="completed")
+        except Exception as e:
+            LLM_BATCH_JOBS.inc(outcome="failed")
+            LLM_BATCH_PROMPTS.inc(len(requests), outcome="failed")
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        finally:
+            for path in [input_file, output_file]:
+                if path and os.path.exists(path):
+                    os.remove(path)
+        for request in requests:
+            result = results.get(request.custom_id, BatchItemError(f"The batch request {request.custom_id} is not answered"))
+            if isinstance(result, BatchItemError):
+                LLM_BATCH_PROMPTS.inc(outcome="failed")
+                request.future.set_exception(result)
+            else:
+                LLM_BATCH_PROMPTS.inc(outcome="answered")
+                if request.custom_id in usages:
+                    usage = usages[request.custom_id]
+                    record_llm_tokens(detect_prompt_family(request.prompt), usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+                request.future.set_result(result)
+
+
+BATCH_EXECUTOR = BatchExecutor()
@@ -0,0 +1,232 @@
+"""
+The admission control of the LLM calls, used by utils._get_response instead of a plain semaphore.
+At most max_concurrency calls run at the same time, the waiting calls are served by priority class
+(interactive > generation > background), each class is capped at its own number of running calls.
+Within a class the users share the slots by start-time fair queuing: a call is tagged with
+max(virtual time, the finish tag of the previous call of its user) + its cost / the weight of the user,
+so a user sending many prompts only delays their own calls. The cost is the estimated number of prompt tokens,
+which are also charged to a token bucket of the user, the calls over the quota wait for the bucket to refill.
+A call is rejected with LLMRejected when the queue of its class is full or it would wait longer than the max wait of the class.
+
+The priority class and the user of the calls are set by llm_context() in the endpoints and kept in context variables,
+use submit_in_context() to keep them in the threads of a pool.
+"""
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from concurrent.futures import Executor, Future
+from threading import Condition, Lock
+from llm_backend import estimate_tokens
+from metrics import REGISTRY
+from constants import LLM_MAX_CONCURRENCY, LLM_CLASS_CONCURRENCY, LLM_CLASS_QUEUE_LIMIT, LLM_CLASS_MAX_WAIT, \
+    LLM_USER_TOKENS_PER_MINUTE, LLM_USER_TOKEN_BURST
+
+INTERACTIVE = 'interactive'
+GENERATION = 'generation'
+BACKGROUND = 'background'
+PRIORITY_CLASSES = (INTERACTIVE, GENERATION, BACKGROUND)
+
+LLM_PRIORITY: ContextVar[str] = ContextVar('llm_priority', default=GENERATION)
+LLM_USER: ContextVar[int | None] = ContextVar('llm_user', default=None)
+
+LLM_QUEUE_SECONDS = REGISTRY.histogram(
+    "readhub_llm_queue_seconds", "The time the LLM calls waited for a slot and the token quota", ("priority",))
+LLM_REJECTED = REGISTRY.counter(
+    "readhub_llm_rejected_total", "The LLM calls rejected by the scheduler", ("priority", "reason"))
+
+
+class LLMRejected(RuntimeError):
+    """
+    the scheduler is saturated, the caller should give up the call instead of retrying it
+    """
+
+
+@contextmanager
+def llm_context(priority: str, user_id: int | None = None):
+    """
+    the LLM calls in the block are scheduled in the priority class on behalf of the user
+    """
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class {priority}")
+    priority_token = LLM_PRIORITY.set(priority)
+    user_token = LLM_USER.set(user_id)
+    try:
+        yield
+    finally:
+        LLM_USER.reset(user_token)
+        LLM_PRIORITY.reset(priority_token)
+
+
+def submit_in_context(pool: Executor, func, *args, **kwargs) -> Future:
+    """
+    pool.submit which runs the function with the context variables of the caller, e.g. the priority class of the LLM calls
+    """
+    return pool.submit(copy_context().run, func, *args, **kwargs)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.update_time = time.monotonic()
+
+    def reserve(self, cost: float) -> float:
+        """
+        take the tokens, the bucket may go into debt
+        return:
+            the seconds to wait until the tokens taken before are paid
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.update_time) * self.rate)
+        self.update_time = now
+        wait = max(0.0, -self.tokens) / self.rate
+        self.tokens -= cost
+        return wait
+
+    def refund(self, cost: float):
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+class Waiter:
+    __slots__ = ('priority', 'user_id', 'start_tag', 'granted')
+
+    def __init__(self, priority: str, user_id: int | None, start_tag: float):
+        self.priority = priority
+        self.user_id = user_id
+        self.start_tag = start_tag
+        self.granted = False
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        class_concurrency: dict[str, int] = LLM_CLASS_CONCURRENCY,
+        queue_limit: dict[str, int] = LLM_CLASS_QUEUE_LIMIT,
+        max_wait: dict[str, float] = LLM_CLASS_MAX_WAIT,
+        tokens_per_minute: float | None = LLM_USER_TOKENS_PER_MINUTE,
+        token_burst: float = LLM_USER_TOKEN_BURST,
+        user_weights: dict[int, float] | None = None,
+    ):
+        """
+        args:
+            max_concurrency: the max number of running calls
+            class_concurrency: priority class -> the max number of its running calls
+            queue_limit: priority class -> the max number of its waiting calls
+            max_wait: priority class -> the max seconds a call waits
+            tokens_per_minute: the token quota of a user, None to disable the quota
+            user_weights: user id -> the share of the user in the fair queuing, 1 by default
+        """
+        self.max_concurrency = max_concurrency
+        self.class_concurrency = class_concurrency
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self.tokens_per_minute = tokens_per_minute
+        self.token_burst = token_burst
+        self.user_weights = user_weights or {}
+        self.condition = Condition(Lock())
+        self.running = {priority: 0 for priority in PRIORITY_CLASSES}
+        # priority class -> heap of (finish tag, sequence number, waiter)
+        self.queues: dict[str, list[tuple[float, int, Waiter]]] = {priority: [] for priority in PRIORITY_CLASSES}
+        self.virtual_time = {priority: 0.0 for priority in PRIORITY_CLASSES}
+        self.user_finish_tags: dict[str, dict[int | None, float]] = {priority: {} for priority in PRIORITY_CLASSES}
+        self.buckets: dict[int | None, TokenBucket] = {}
+        self.sequence = itertools.count()
+
+    def _can_run(self, priority: str) -> bool:
+        return sum(self.running.values()) < self.max_concurrency and self.running[priority] < self.class_concurrency[priority]
+
+    def _dispatch(self):
+        # called with the lock held, grant the free slots to the head of the highest priority classes
+        granted = False
+        for priority in PRIORITY_CLASSES:
+            queue = self.queues[priority]
+            while queue and self._can_run(priority):
+                _, _, waiter = heapq.heappop(queue)
+                waiter.granted = True
+                self.running[priority] += 1
+                self.virtual_time[priority] = max(self.virtual_time[priority], waiter.start_tag)
+                granted = True
+            if not queue:
+                # the users without waiting calls start again from the virtual time
+                self.user_finish_tags[priority] = {
+                    user_id: tag for user_id, tag in self.user_finish_tags[priority].items() if tag > self.virtual_time[priority]
+                }
+        if granted:
+            self.condition.notify_all()
+
+    def _reserve_tokens(self, user_id: int | None, cost: float) -> float:
+        with self.condition:
+            bucket = self.buckets.get(user_id)
+            if bucket is None:
+                bucket = self.buckets[user_id] = TokenBucket(self.tokens_per_minute / 60, self.token_burst)
+            return bucket.reserve(cost)
+
+    def _reject(self, priority: str, reason: str, message: str):
+        LLM_REJECTED.inc(priority=priority, reason=reason)
+        raise LLMRejected(message)
+
+    def acquire(self, priority: str, user_id: int | None, cost: float):
+        start = time.monotonic()
+        deadline = start + self.max_wait[priority]
+        if self.tokens_per_minute is not None and priority != INTERACTIVE:
+            wait = self._reserve_tokens(user_id, cost)
+            if wait > self.max_wait[priority]:
+                with self.condition:
+                    self.buckets[user_id].refund(cost)
+                self._reject(priority, "quota", f"The LLM token quota of the user is used up, retry in {wait:.0f}s")
+            # defer the call until the quota is refilled
+            time.sleep(wait)
+        with self.condition:
+            queue = self.queues[priority]
+            if len(queue) >= self.queue_limit[priority]:
+                self._reject(priority, "queue_full", "Too many LLM calls are waiting, please retry later")
+            start_tag = max(self.virtual_time[priority], self.user_finish_tags[priority].get(user_id, 0.0))
+            finish_tag = start_tag + cost / self.user_weights.get(user_id, 1.0)
+            self.user_finish_tags[priority][user_id] = finish_tag
+            waiter = Waiter(priority, user_id, start_tag)
+            heapq.heappush(queue, (finish_tag, next(self.sequence), waiter))
+            self._dispatch()
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue[:] = [item for item in queue if item[2] is not waiter]
+                    heapq.heapify(queue)
+                    self._reject(priority, "timeout", "The LLM calls are saturated, please retry later")
+                self.condition.wait(remaining)
+        LLM_QUEUE_SECONDS.observe(time.monotonic() - start, priority=priority)
+
+    def release(self, priority: str):
+        with self.condition:
+            self.running[priority] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, prompt: str):
+        """
+        hold a slot for an LLM call in the priority class and on behalf of the user of the current context
+        """
+        priority = LLM_PRIORITY.get()
+        self.acquire(priority, LLM_USER.get(), estimate_tokens(prompt))
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def waiting_calls(self) -> int:
+        with self.condition:
+            return sum(map(len, self.queues.values()))
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                priority: {'running': self.running[priority], 'waiting': len(self.queues[priority])}
+                for priority in PRIORITY_CLASSES
+            }
+
+
+LLM_SCHEDULER = LLMScheduler()
+REGISTRY.gauge("readhub_llm_waiting_calls", "The LLM calls waiting for a slot", LLM_SCHEDULER.waiting_calls)
@@ -0,0 +1,231 @@
+"""
+In-process metrics rendered in the Prometheus text format at /metrics.
+The stages of the requests are timed by span(), e.g. the LLM calls, the pdf decoding, the chunking, the arXiv fetches and
+the DB commits, the spans are aggregated into the readhub_span_seconds histogram labelled by the stage.
+"""
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+import time
+from typing import Callable
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# the upper bounds of the latency buckets in seconds, the LLM calls take up to minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_labels(labelnames: tuple[str, ...], labelvalues: tuple[str, ...], extra: str = "") -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    labels = [f'{name}="{escape(str(value))}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+
+    def label_values(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"The labels of {self.name} should be {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"] + self.samples())
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.label_values(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """
+    a gauge whose value is read from a function when the metrics are rendered
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {format_value(self.function())}"]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # label values -> (the count of each bucket, not cumulative, the sum of the observed values)
+        self.values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        counts, _ = self.values.get(self.label_values(labels), ([0], 0.0))
+        return sum(counts)
+
+    def samples(self) -> list[str]:
+        lines = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bucket, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, f'le={chr(34)}{format_value(bucket)}{chr(34)}')} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.lock = Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"The metric {metric.name} is registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, documentation, function))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "readhub_http_request_seconds", "The latency of the requests by endpoint", ("endpoint", "method", "status"))
+HTTP_HANDLED_ERRORS = REGISTRY.counter(
+    "readhub_http_handled_errors_total", "The requests answered with success false by endpoint", ("endpoint",))
+SPAN_SECONDS = REGISTRY.histogram(
+    "readhub_span_seconds", "The latency of the stages of the requests", ("span",))
+SPAN_ERRORS = REGISTRY.counter(
+    "readhub_span_errors_total", "The stages which raised an exception", ("span",))
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "readhub_llm_request_seconds", "The latency of the LLM calls by prompt type", ("prompt_type", "outcome"))
+LLM_RETRIES = REGISTRY.counter(
+    "readhub_llm_retries_total", "The LLM calls repeated because the previous response was invalid", ("prompt_type",))
+LLM_INVALID_RESPONSES = REGISTRY.counter(
+    "readhub_llm_invalid_responses_total", "The LLM responses which could not be parsed or checked", ("prompt_type",))
+LLM_TOKENS = REGISTRY.counter(
+    "readhub_llm_tokens_total", "The tokens used by the LLM calls", ("prompt_type", "kind"))
+
+
+@contextmanager
+def span(name: str):
+    """
+    time a stage, the exceptions are counted and raised again
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SPAN_ERRORS.inc(span=name)
+        raise
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - start, span=name)
+
+
+def timed(name: str):
+    """
+    the decorator version of span()
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def llm_span(prompt_type: str):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, prompt_type=prompt_type, outcome=outcome)
+
+
+def record_llm_tokens(prompt_type: str, prompt_tokens: int, completion_tokens: int):
+    LLM_TOKENS.inc(prompt_tokens, prompt_type=prompt_type, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, prompt_type=prompt_type, kind="completion")
+
+
+# the DB commits of every session, including the flush of the pending changes
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session: Session):
+    session.info['commit_start'] = time.perf_counter()
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session: Session):
+    start = session.info.pop('commit_start', None)
+    if start is not None:
+        SPAN_SECONDS.observe(time.perf_counter() - start, span="db_commit")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session: Session):
+    if session.info.pop('commit_start', None) is not None:
+        SPAN_ERRORS.inc(span="db_commit")
@@ -0,0 +1,277 @@
+"""
+Lifecycle of the models in clip_model.py. Every model is loaded lazily once per process and shared by all the threads,
+the idle models are unloaded when the loaded models exceed the memory budget or are unused for a long time, except the
+most recently used one, so a model larger than the budget is not reloaded for every batch.
+"""
+from contextlib import contextmanager
+import gc
+import logging
+import os
+from threading import Lock, Thread
+import time
+from typing import Callable
+from constants import MODEL_MEMORY_BUDGET_MB, MODEL_IDLE_UNLOAD_SECONDS, MODEL_LOAD_RETRY_SECONDS, MODEL_LOAD_RETRY_MAX_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def get_resident_memory() -> int:
+    """
+    return:
+        the resident memory of the process in bytes, 0 if it is unknown
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ByteCounter:
+    """
+    a file-like sink which only counts the bytes written to it
+    """
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def state_dict_size(module) -> int:
+    """
+    the serialized size of the state dict of a torch module, the int8 packed weights of the dynamically quantized
+    modules are in the state dict but not in parameters() or buffers()
+    """
+    import torch
+    counter = ByteCounter()
+    torch.save(module.state_dict(), counter)
+    return counter.size
+
+
+def get_model_memory(model, resident_memory_delta: int) -> int:
+    """
+    the serialized size of the state dicts of the torch modules of the model, the growth of the resident memory
+    during loading is used if the model has no torch module
+    """
+    memory = 0
+    for value in vars(model).values():
+        if hasattr(value, 'state_dict') and hasattr(value, 'parameters'):
+            memory += state_dict_size(value)
+    return memory or max(resident_memory_delta, 0)
+
+
+def get_model_key(model_name: str, quantize: bool = False) -> str:
+    """
+    the key of a model in the registry, the int8 quantized variant is registered as <model_name>:int8
+    """
+    return f"{model_name}:int8" if quantize else model_name
+
+
+def load_clip_model(model_key: str):
+    import clip_model
+    model_name, _, variant = model_key.partition(':')
+    return getattr(clip_model, model_name)(quantize=(variant == 'int8'))
+
+
+class LoadedModel:
+    def __init__(self, model, memory: int, load_time: float):
+        self.model = model
+        self.memory = memory
+        self.load_time = load_time
+        self.last_used_time = time.monotonic()
+        self.in_use = 0
+
+
+class LoadError:
+    def __init__(self, error: Exception, failure_number: int, retry_seconds: float):
+        """
+        args:
+            failure_number: the number of the failed loads in a row
+            retry_seconds: the model is not loaded again before it
+        """
+        self.error = error
+        self.failure_number = failure_number
+        self.retry_time = time.monotonic() + retry_seconds
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        loaders: dict[str, Callable[[], object]] | None = None,
+        memory_budget: int = MODEL_MEMORY_BUDGET_MB * 1024 * 1024,
+        idle_unload_seconds: float = MODEL_IDLE_UNLOAD_SECONDS,
+        load_retry_seconds: float = MODEL_LOAD_RETRY_SECONDS,
+        load_retry_max_seconds: float = MODEL_LOAD_RETRY_MAX_SECONDS,
+    ):
+        """
+        args:
+            loaders: model name -> function to load the model, the models not in it are the classes in clip_model.py
+            memory_budget: the max memory in bytes of the loaded models, the models in use and the most recently used
+                model are never unloaded
+            idle_unload_seconds: unload the models which are unused for such a long time, None to disable
+            load_retry_seconds: the wait before loading a model again after a failure, doubled after each failure
+        """
+        self.loaders = loaders or {}
+        self.memory_budget = memory_budget
+        self.idle_unload_seconds = idle_unload_seconds
+        self.load_retry_seconds = load_retry_seconds
+        self.load_retry_max_seconds = load_retry_max_seconds
+        self.models: dict[str, LoadedModel] = {}
+        self.load_errors: dict[str, LoadError] = {}
+        self.lock = Lock()
+        self.load_locks: dict[str, Lock] = {}
+        self.reaper: Thread | None = None
+
+    def _load(self, model_name: str) -> LoadedModel:
+        loader = self.loaders.get(model_name, lambda: load_clip_model(model_name))
+        resident_memory = get_resident_memory()
+        start = time.monotonic()
+        model = loader()
+        memory = get_model_memory(model, get_resident_memory() - resident_memory)
+        logger.info(f"Model {model_name} loaded in {time.monotonic() - start:.1f}s, memory: {memory / 1024 / 1024:.0f}MB")
+        return LoadedModel(model=model, memory=memory, load_time=time.monotonic() - start)
+
+    def _acquire(self, model_name: str) -> LoadedModel:
+        with self.lock:
+            load_error = self.load_errors.get(model_name)
+            if load_error is not None and time.monotonic() < load_error.retry_time:
+                raise RuntimeError(f"Model {model_name} can not be loaded: {load_error.error}")
+            loaded_model = self.models.get(model_name)
+            if loaded_model is not None:
+                loaded_model.in_use += 1
+                return loaded_model
+            load_lock = self.load_locks.setdefault(model_name, Lock())
+        # only one thread loads a model, the others wait for it
+        with load_lock:
+            with self.lock:
+                loaded_model = self.models.get(model_name)
+                if loaded_model is not None:
+                    loaded_model.in_use += 1
+                    return loaded_model
+                # the threads waiting for a failed load do not load it again before the retry time
+                load_error = self.load_errors.get(model_name)
+                if load_error is not None and time.monotonic() < load_error.retry_time:
+                    raise RuntimeError(f"Model {model_name} can not be loaded: {load_error.error}")
+            try:
+                loaded_model = self._load(model_name)
+            except Exception as e:
+                with self.lock:
+                    failure_number = self.load_errors[model_name].failure_number + 1 if model_name in self.load_errors else 1
+                    retry_seconds = min(self.load_retry_seconds * 2 ** (failure_number - 1), self.load_retry_max_seconds)
+                    self.load_errors[model_name] = LoadError(e, failure_number, retry_seconds)
+                raise RuntimeError(f"Model {model_name} can not be loaded: {e}")
+            with self.lock:
+                self.load_errors.pop(model_name, None)
+                loaded_model.in_use += 1
+                self.models[model_name] = loaded_model
+                self._enforce_budget()
+        self._start_reaper()
+        return loaded_model
+
+    def _release(self, loaded_model: LoadedModel):
+        with self.lock:
+            loaded_model.in_use -= 1
+            loaded_model.last_used_time = time.monotonic()
+            self._enforce_budget()
+
+    @contextmanager
+    def use(self, model_name: str):
+        """
+        the model is not unloaded while it is used
+        """
+        loaded_model = self._acquire(model_name)
+        try:
+            yield loaded_model.model
+        finally:
+            self._release(loaded_model)
+
+    def is_available(self, model_name: str) -> bool:
+        """
+        whether the model is loaded or may be loaded, i.e. its last load did not fail within the retry time,
+        the model is not loaded here, see preload()
+        """
+        with self.lock:
+            if model_name in self.models:
+                return True
+            load_error = self.load_errors.get(model_name)
+            return load_error is None or time.monotonic() >= load_error.retry_time
+
+    @property
+    def memory(self) -> int:
+        return sum(loaded_model.memory for loaded_model in self.models.values())
+
+    def _unload(self, model_name: str):
+        loaded_model = self.models.pop(model_name)
+        logger.info(f"Model {model_name} unloaded, memory: {loaded_model.memory / 1024 / 1024:.0f}MB")
+        del loaded_model
+        gc.collect()
+
+    def _enforce_budget(self):
+        """
+        unload the least recently used idle models until the memory is under the budget, the lock must be held,
+        the most recently used model is kept even if it is larger than the budget
+        """
+        model_names = sorted(self.models, key=lambda model_name: self.models[model_name].last_used_time)
+        idle_model_names = [model_name for model_name in model_names[:-1] if self.models[model_name].in_use == 0]
+        for model_name in idle_model_names:
+            if self.memory <= self.memory_budget:
+                break
+            self._unload(model_name)
+
+    def unload_idle_models(self, idle_seconds: float | None = None):
+        idle_seconds = self.idle_unload_seconds if idle_seconds is None else idle_seconds
+        now = time.monotonic()
+        with self.lock:
+            for model_name, loaded_model in list(self.models.items()):
+                if loaded_model.in_use == 0 and now - loaded_model.last_used_time >= idle_seconds:
+                    self._unload(model_name)
+
+    def _start_reaper(self):
+        if self.idle_unload_seconds is None:
+            return
+        with self.lock:
+            if self.reaper is not None:
+                return
+            self.reaper = Thread(target=self._reap, daemon=True)
+        self.reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(self.idle_unload_seconds / 4, 1))
+            self.unload_idle_models()
+
+    def preload(self, model_names: list[str]):
+        """
+        load the models before the first requests, a model which can not be loaded is retried by its first use after the retry time
+        """
+        for model_name in model_names:
+            try:
+                with self.use(model_name):
+                    pass
+            except RuntimeError as e:
+                logger.warning(str(e))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'resident_memory': get_resident_memory(),
+                'memory': self.memory,
+                'memory_budget': self.memory_budget,
+                'models': {
+                    model_name: {
+                        'memory': loaded_model.memory,
+                        'load_time': loaded_model.load_time,
+                        'idle_seconds': time.monotonic() - loaded_model.last_used_time,
+                        'in_use': loaded_model.in_use,
+                    } for model_name, loaded_model in self.models.items()
+                },
+                'load_errors': {model_name: str(load_error.error) for model_name, load_error in self.load_errors.items()},
+            }
+
+
+MODEL_REGISTRY = ModelRegistry()
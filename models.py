@@ -2,9 +2,11 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 from flask_login import UserMixin
 import numpy as np
-from utils import judge_answer
+from utils import judge_answer, judge_answers
+from grading import local_grade_blank_answer
 from constants import PASSED_SCORE
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import insert, inspect, literal, text
 
 db = SQLAlchemy()
 
@@ -17,6 +19,18 @@ class QuestionType:
 
 QUESTION_TYPE_LIST = ['choice', 'tf', 'blank', 'review']
 
+# the stages of the ingestion of an uploaded document in order, see ingestion.py
+INGESTION_STAGE_LIST = ['metadata', 'download', 'parse', 'chunk', 'index', 'derive']
+
+# the status of a document is pending, the last completed stage, ready or failed
+class DocumentStatus:
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+
+# the documents whose chunks are in the keyword and semantic indexes
+INDEXED_DOCUMENT_STATUS_LIST = INGESTION_STAGE_LIST[INGESTION_STAGE_LIST.index('index'):] + [DocumentStatus.READY]
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -56,9 +70,10 @@ class User(db.Model, UserMixin):
         """
         # sorted by created_time, the latest document is the first
         documents = sorted(self.documents, key=lambda x: x.created_time, reverse=True)
+        # the title and the abstract are fetched by the metadata stage of the ingestion
         return [
             (document.title, document.abstract)
-            for document in documents
+            for document in documents if document.status not in (DocumentStatus.PENDING, DocumentStatus.FAILED)
         ]
 
 
@@ -89,6 +104,27 @@ class Document(db.Model):
     chunks = db.relationship('Chunk', backref='document', lazy=True)
     questions = db.relationship('Question', backref='document', lazy=True)
     reading_plan_id = db.Column(db.Integer, db.ForeignKey('reading_plan.id'), nullable=True, default=None)
+    # the documents created before the ingestion pipeline are ready
+    status = db.Column(db.String(20), default=DocumentStatus.READY, nullable=False)
+    ingestion_error = db.Column(db.Text, nullable=True)
+    # the bulk import which created the document, see bulk_import.py
+    import_id = db.Column(db.Integer, db.ForeignKey('document_import.id'), nullable=True, default=None)
+
+    @property
+    def ready(self) -> bool:
+        return self.status == DocumentStatus.READY
+
+    @property
+    def ingesting(self) -> bool:
+        return self.status not in (DocumentStatus.READY, DocumentStatus.FAILED)
+
+    @property
+    def completed_stage_number(self) -> int:
+        if self.status == DocumentStatus.READY:
+            return len(INGESTION_STAGE_LIST)
+        if self.status in INGESTION_STAGE_LIST:
+            return INGESTION_STAGE_LIST.index(self.status) + 1
+        return 0
 
     def get_question_score(self):
         question_score = np.zeros((4, 2))
@@ -99,6 +135,17 @@ class Document(db.Model):
                 question_score[question.question_type][1] += 1
         return question_score
     
+class DocumentImport(db.Model):
+    """
+    a bulk import of papers, the profile of the user is refreshed once when all its documents are ingested
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_time = db.Column(db.DateTime, default=datetime.now)
+    # True after the profile is refreshed, the unfinished imports are continued when the app starts
+    finished = db.Column(db.Boolean, default=False, nullable=False)
+    documents = db.relationship('Document', backref='document_import', lazy=True)
+
 class Chunk(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
@@ -108,6 +155,21 @@ class Chunk(db.Model):
     def chunk_text(self):
         with open(self.file_path, 'r', encoding='utf-8') as f:
             return f.read()
+
+    @staticmethod
+    def bulk_create(document_id: int, chunk_path_list: list[str]) -> list[int]:
+        """
+        insert the chunks of a document with a single executemany statement instead of the unit of work
+        args:
+            document_id: the id of the document, the document must be flushed before
+            chunk_path_list: the path of each chunk file
+        return:
+            the ids of the inserted chunks, in the same order as chunk_path_list
+        """
+        if not chunk_path_list:
+            return []
+        rows = [{'document_id': document_id, 'file_path': chunk_path} for chunk_path in chunk_path_list]
+        return list(db.session.scalars(insert(Chunk).returning(Chunk.id, sort_by_parameter_order=True), rows))
     
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -135,7 +197,31 @@ class Question(db.Model):
         else:
             return self.score > PASSED_SCORE
         
-    def set_user_answer(self, user_answer: str):
+    @property
+    def need_judge(self) -> bool:
+        """
+        whether the answer of the question is judged by the LLM
+        """
+        return self.question_type == QuestionType.FILL_IN_THE_BLANK or self.question_type == QuestionType.REVIEW
+
+    @property
+    def judge_prior_knowledge(self) -> str | None:
+        return self.document.abstract if self.question_type == QuestionType.REVIEW else None
+
+    def local_judgement(self, user_answer: str) -> tuple[int, str] | None:
+        """
+        grade the answer without the LLM, return None if the answer should be judged by the LLM
+        """
+        if self.question_type == QuestionType.FILL_IN_THE_BLANK:
+            return local_grade_blank_answer(user_answer, self.standard_answer)
+        return None
+
+    def set_user_answer(self, user_answer: str, judgement: tuple[int, str] | None = None):
+        """
+        args:
+            user_answer: the answer of the user
+            judgement: (score, review) judged in advance, only used for the questions which need judge
+        """
         self.answer_time = datetime.now()
         self.user_answer = user_answer
         if self.question_type == QuestionType.MULTIPLE_CHOICE or self.question_type == QuestionType.TRUE_OR_FALSE:
@@ -143,12 +229,38 @@ class Question(db.Model):
         # elif self.question_type == QuestionType.FILL_IN_THE_BLANK:
         #     self.score = 100 if calculate_similarity(self.user_answer, self.standard_answer) > SIMILARITY_THRESHOLD else 0
         # elif self.question_type == QuestionType.REVIEW:
-        elif self.question_type == QuestionType.FILL_IN_THE_BLANK:
-            self.score, self.standard_review = judge_answer(self.user_answer, self.standard_answer)
-        elif self.question_type == QuestionType.REVIEW:
-            self.score, self.standard_review = judge_answer(self.user_answer, self.standard_answer, self.document.abstract)
+        elif self.need_judge:
+            if judgement is None:
+                judgement = self.local_judgement(self.user_answer)
+            if judgement is None:
+                judgement = judge_answer(self.user_answer, self.standard_answer, self.judge_prior_knowledge)
+            self.score, self.standard_review = judgement
         else:
             raise ValueError("Invalid question type")
+
+    @staticmethod
+    def bulk_create(exam_id: int, document_id: int, question_data_list: list[dict], chunk_id_list: list[int | None]):
+        """
+        insert the questions of an exam with a single executemany statement instead of the unit of work
+        args:
+            exam_id: the id of the exam, the exam must be flushed before
+            document_id: the id of the document
+            question_data_list: list of dict with question_type, question_content and standard_answer
+            chunk_id_list: the chunk id of each question, None for the questions which belong to the document summary
+        """
+        if not question_data_list:
+            return
+        rows = [
+            {
+                'exam_id': exam_id,
+                'document_id': document_id,
+                'chunk_id': chunk_id,
+                'question_type': question_data['question_type'],
+                'question_content': question_data['question_content'],
+                'standard_answer': question_data['standard_answer'],
+            } for question_data, chunk_id in zip(question_data_list, chunk_id_list)
+        ]
+        db.session.execute(insert(Question), rows)
         
 class Exam(db.Model):
     """
@@ -158,9 +270,11 @@ class Exam(db.Model):
     questions = db.relationship('Question', backref='exam', lazy=True)
     document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
     created_time = db.Column(db.DateTime, default=datetime.now)
+    # False while the questions generated after the deadline of generate_exam are not appended yet
+    is_complete = db.Column(db.Boolean, default=True, nullable=False)
     @property
     def done(self):
-        return all(question.done for question in self.questions)
+        return self.is_complete and all(question.done for question in self.questions)
     
     @property
     def done_number(self):
@@ -169,6 +283,33 @@ class Exam(db.Model):
     @property
     def question_number(self):
         return len(self.questions)
+
+    def set_user_answers(self, user_answers: dict[int, str]) -> list[Question]:
+        """
+        answer several questions of the exam at once, the answers which can not be graded locally
+        are judged by the LLM concurrently
+        args:
+            user_answers: question_id -> user_answer, the questions which are done are ignored
+        return:
+            the answered questions
+        """
+        question_dict = {question.id: question for question in self.questions}
+        if any(question_id not in question_dict for question_id in user_answers):
+            raise ValueError("Question not in the exam")
+        questions = [question_dict[question_id] for question_id in user_answers if not question_dict[question_id].done]
+        question_id_to_judgement = {
+            question.id: question.local_judgement(user_answers[question.id])
+            for question in questions if question.need_judge
+        }
+        judge_questions = [question for question in questions if question.need_judge and question_id_to_judgement[question.id] is None]
+        judgements = judge_answers([
+            (user_answers[question.id], question.standard_answer, question.judge_prior_knowledge, QUESTION_TYPE_LIST[question.question_type])
+            for question in judge_questions
+        ])
+        question_id_to_judgement.update({question.id: judgement for question, judgement in zip(judge_questions, judgements)})
+        for question in questions:
+            question.set_user_answer(user_answers[question.id], question_id_to_judgement.get(question.id))
+        return questions
     
 class ReadingPlan(db.Model):
     @staticmethod
@@ -203,3 +344,36 @@ class Recommendation(db.Model):
     @staticmethod
     def transform_authors_to_text(authors: list[str]) -> str:
         return ','.join(authors)
+
+
+def add_missing_columns() -> list[str]:
+    """
+    db.create_all() only creates the missing tables, so the columns added to a model after its table is created are
+    added by ALTER TABLE, with the default of the column for the existing rows. call it in the app context after
+    db.create_all()
+    return:
+        the added columns, table.column
+    """
+    dialect = db.engine.dialect
+    inspector = inspect(db.engine)
+    added_column_list = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        exist_column_names = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in exist_column_names:
+                continue
+            definition = f"{column.name} {column.type.compile(dialect=dialect)}"
+            if column.default is not None and column.default.is_scalar:
+                default = literal(column.default.arg, column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+                definition += f" DEFAULT {default}"
+            if not column.nullable:
+                # sqlite only adds a NOT NULL column with a default
+                if column.default is None or not column.default.is_scalar:
+                    raise ValueError(f"The new column {table.name}.{column.name} needs a scalar default")
+                definition += " NOT NULL"
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+            added_column_list.append(f"{table.name}.{column.name}")
+    db.session.commit()
+    return added_column_list
@@ -0,0 +1,141 @@
+"""
+The compression of the chunks in the problem prompts, a chunk has up to MAX_ARTICLE_WORDS words even if one question is asked.
+The sentences of the chunk are scored by the cosine similarity of their TF-IDF vectors to the whole chunk (the salience)
+and picked by maximal marginal relevance: (1 - diversity) * salience - diversity * the max similarity to the picked sentences,
+until the word budget base_words + words_per_question * the number of the questions is used up.
+The picked sentences are kept in their order in the chunk. The compressed chunks are cached per chunk and budget.
+"""
+import re
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+from llm_backend import prompt_hash
+from metrics import REGISTRY
+from constants import PROMPT_COMPRESSION_BASE_WORDS, PROMPT_COMPRESSION_WORDS_PER_QUESTION, PROMPT_COMPRESSION_DIVERSITY, \
+    PROMPT_COMPRESSION_CACHE_SIZE
+
+PROMPT_COMPRESSION_WORDS = REGISTRY.counter(
+    "readhub_prompt_compression_words_total", "The words of the compressed chunks before and after the compression", ("kind",))
+PROMPT_COMPRESSION_CACHE = REGISTRY.counter(
+    "readhub_prompt_compression_cache_total", "The lookups of the compressed chunks in the cache", ("outcome",))
+
+# a sentence ends with . ! ? followed by a space, 。！？ or the end of a line
+SENTENCE_PATTERN = re.compile(r"\S.*?(?:[.!?](?=\s|$)|[。！？]|$)", re.M)
+TOKEN_PATTERN = re.compile(r"[a-z][a-z\-]+|\d+|[一-鿿]")
+
+
+def split_sentences(text: str) -> list[tuple[int, int]]:
+    """
+    return:
+        the (start, end) character offsets of the sentences
+    """
+    return [match.span() for match in SENTENCE_PATTERN.finditer(text)]
+
+
+def tfidf_matrix(sentences: list[str]) -> np.ndarray:
+    """
+    return:
+        the l2 normalized TF-IDF vectors of the sentences, the document frequencies are counted over the sentences
+    """
+    vocabulary: dict[str, int] = {}
+    rows, columns = [], []
+    for i, sentence in enumerate(sentences):
+        for token in TOKEN_PATTERN.findall(sentence.lower()):
+            rows.append(i)
+            columns.append(vocabulary.setdefault(token, len(vocabulary)))
+    counts = np.zeros((len(sentences), max(len(vocabulary), 1)), dtype=np.float32)
+    np.add.at(counts, (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)), 1)
+    document_frequency = (counts > 0).sum(axis=0)
+    idf = np.log((1 + len(sentences)) / (1 + document_frequency)) + 1
+    matrix = np.log1p(counts) * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def select_sentences(matrix: np.ndarray, lengths: np.ndarray, budget: int, diversity: float) -> list[int]:
+    """
+    pick the sentences by maximal marginal relevance until the budget of words is used up
+    return:
+        the indexes of the picked sentences, in the order of the sentences
+    """
+    centroid = matrix.sum(axis=0)
+    centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+    salience = matrix @ centroid
+    similarity = matrix @ matrix.T
+    redundancy = np.zeros(len(lengths), dtype=np.float32)
+    available = lengths <= budget
+    selected = []
+    words = 0
+    while available.any():
+        scores = np.where(available, (1 - diversity) * salience - diversity * redundancy, -np.inf)
+        index = int(np.argmax(scores))
+        available[index] = False
+        if words + lengths[index] > budget:
+            continue
+        selected.append(index)
+        words += int(lengths[index])
+        redundancy = np.maximum(redundancy, similarity[:, index])
+        available &= lengths <= budget - words
+    return sorted(selected)
+
+
+class PromptCompressor:
+    def __init__(
+        self,
+        base_words: int = PROMPT_COMPRESSION_BASE_WORDS,
+        words_per_question: int = PROMPT_COMPRESSION_WORDS_PER_QUESTION,
+        diversity: float = PROMPT_COMPRESSION_DIVERSITY,
+        cache_size: int = PROMPT_COMPRESSION_CACHE_SIZE,
+    ):
+        self.base_words = base_words
+        self.words_per_question = words_per_question
+        self.diversity = diversity
+        self.cache_size = cache_size
+        # (the hash of the chunk, the budget) -> the compressed chunk, least recently used first
+        self.cache: OrderedDict[tuple[str, int], str] = OrderedDict()
+        self.lock = Lock()
+
+    def budget(self, question_number: int) -> int:
+        return self.base_words + self.words_per_question * question_number
+
+    def compress(self, text: str, question_number: int) -> str:
+        """
+        return:
+            the salient and diverse sentences of the text for the number of the questions, the text itself if it is short enough
+        """
+        budget = self.budget(question_number)
+        word_number = len(text.split())
+        if word_number <= budget:
+            return text
+        key = (prompt_hash(text), budget)
+        with self.lock:
+            compressed = self.cache.get(key)
+            if compressed is not None:
+                self.cache.move_to_end(key)
+        PROMPT_COMPRESSION_CACHE.inc(outcome="hit" if compressed is not None else "miss")
+        if compressed is None:
+            compressed = self._compress(text, budget)
+            with self.lock:
+                self.cache[key] = compressed
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        PROMPT_COMPRESSION_WORDS.inc(word_number, kind="original")
+        PROMPT_COMPRESSION_WORDS.inc(len(compressed.split()), kind="compressed")
+        return compressed
+
+    def _compress(self, text: str, budget: int) -> str:
+        spans = split_sentences(text)
+        sentences = [text[start:end] for start, end in spans]
+        lengths = np.array([len(sentence.split()) for sentence in sentences], dtype=np.int64)
+        selected = select_sentences(tfidf_matrix(sentences), lengths, budget, self.diversity)
+        if not selected:
+            return " ".join(text.split()[:budget])
+        # the adjacent sentences are joined as in the text, the gaps between the others become line breaks
+        parts = [sentences[selected[0]]]
+        for previous, index in zip(selected, selected[1:]):
+            parts.append(text[spans[previous][1]:spans[index][0]] if index == previous + 1 else "\n")
+            parts.append(sentences[index])
+        return "".join(parts)
+
+
+PROMPT_COMPRESSOR = PromptCompressor()
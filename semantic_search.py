@@ -0,0 +1,189 @@
+"""
+Semantic search over the chunks of a user's documents.
+Each chunk is split into short passages, the passage embeddings are computed when the document is uploaded and kept
+in the embedding store, the vector index of a user is built from the store on the first search of the user, without
+blocking the other users or the ingestion.
+"""
+import logging
+import re
+from threading import Lock
+import numpy as np
+from sqlalchemy import event
+from constants import SEARCH_PASSAGE_WORDS
+from embedding_service import EmbeddingService, get_embedding_service
+from models import Chunk, Document, INDEXED_DOCUMENT_STATUS_LIST
+from vector_index import VectorIndex
+
+# the payload of each passage in the vector index
+CHUNK_ID, DOCUMENT_ID, PASSAGE_START, PASSAGE_END = range(4)
+
+logger = logging.getLogger(__name__)
+
+
+def split_passages(text: str, max_words: int = SEARCH_PASSAGE_WORDS) -> list[tuple[int, int]]:
+    """
+    return:
+        the (start, end) character offsets of the passages, each passage has at most max_words words
+    """
+    words = [match.span() for match in re.finditer(r'\S+', text)]
+    return [
+        (words[begin][0], words[min(begin + max_words, len(words)) - 1][1])
+        for begin in range(0, len(words), max_words)
+    ]
+
+
+class IndexBuild:
+    """
+    the changes of the library of a user while its index is being built, applied to the index when it is built
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.added: list[tuple[np.ndarray, np.ndarray]] = []
+        self.removed_document_ids: list[int] = []
+
+
+class LibraryIndex:
+    def __init__(self, service: EmbeddingService | None = None):
+        """
+        args:
+            service: the embedding service of the passages and the queries, None for the shared one
+        """
+        self.service = service
+        self.user_indexes: dict[int, VectorIndex] = {}
+        # user id -> the running build of the index of the user
+        self.builds: dict[int, IndexBuild] = {}
+        # guards user_indexes and builds only, the passages are never encoded under it
+        self.lock = Lock()
+
+    def get_service(self) -> EmbeddingService:
+        return self.service or get_embedding_service()
+
+    def embed_chunks(self, chunk_id_list: list[int], document_id_list: list[int], chunk_text_list: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        return:
+            the embeddings of the passages with shape (n, dim) and their payloads with shape (n, 4)
+        """
+        passage_text_list, payload_list = [], []
+        for chunk_id, document_id, chunk_text in zip(chunk_id_list, document_id_list, chunk_text_list):
+            for start, end in split_passages(chunk_text):
+                passage_text_list.append(chunk_text[start:end])
+                payload_list.append((chunk_id, document_id, start, end))
+        if not passage_text_list:
+            return np.zeros((0, 0), dtype=np.float32), np.zeros((0, 4), dtype=np.int64)
+        return self.get_service().encode_cached(passage_text_list), np.array(payload_list, dtype=np.int64)
+
+    def index_chunks(self, user_id: int, chunk_id_list: list[int], document_id_list: list[int], chunk_text_list: list[str]) -> bool:
+        """
+        compute the passage embeddings of the new chunks, they are added to the index of the user if it is loaded
+        or being built, otherwise they are only stored, so that building the index later does not encode them again
+        return:
+            whether the chunks are indexed
+        """
+        if not self.get_service().available:
+            return False
+        try:
+            embeddings, payloads = self.embed_chunks(chunk_id_list, document_id_list, chunk_text_list)
+        except Exception as e:
+            logger.exception(f"Failed to index the chunks: {e}")
+            return False
+        if not payloads.shape[0]:
+            return True
+        with self.lock:
+            index = self.user_indexes.get(user_id)
+            if index is None and user_id in self.builds:
+                self.builds[user_id].added.append((embeddings, payloads))
+        if index is not None:
+            index.add(embeddings, payloads)
+        return True
+
+    def remove_document(self, user_id: int, document_id: int):
+        with self.lock:
+            index = self.user_indexes.get(user_id)
+            if index is None and user_id in self.builds:
+                self.builds[user_id].removed_document_ids.append(document_id)
+        if index is not None:
+            index.remove(DOCUMENT_ID, [document_id])
+
+    def get_user_index(self, user_id: int) -> VectorIndex | None:
+        """
+        the index is built on the first search of the user, the searches of the other users and the index stage of the
+        ingestion do not wait for it, the chunks indexed and the documents removed during the building are merged after
+        return:
+            the vector index of the user, None if the user has no chunk
+        """
+        with self.lock:
+            if user_id in self.user_indexes:
+                return self.user_indexes[user_id]
+            build = self.builds.setdefault(user_id, IndexBuild())
+        # the concurrent searches of the user wait for one build
+        with build.lock:
+            with self.lock:
+                if user_id in self.user_indexes:
+                    return self.user_indexes[user_id]
+                self.builds[user_id] = build
+            try:
+                # the chunks of the documents still ingesting are added by the index stage
+                chunks: list[Chunk] = Chunk.query.join(Document).filter(
+                    Document.user_id == user_id, Document.status.in_(INDEXED_DOCUMENT_STATUS_LIST)
+                ).all()
+                embeddings, payloads = self.embed_chunks(
+                    [chunk.id for chunk in chunks], [chunk.document_id for chunk in chunks], [chunk.chunk_text for chunk in chunks]
+                )
+            except Exception:
+                with self.lock:
+                    self.builds.pop(user_id, None)
+                raise
+            with self.lock:
+                self.builds.pop(user_id, None)
+                parts = [(embeddings, payloads)] if payloads.shape[0] else []
+                # the chunks committed before the query are already in it
+                chunk_ids = set(payloads[:, CHUNK_ID].tolist())
+                for added_embeddings, added_payloads in build.added:
+                    keep = ~np.isin(added_payloads[:, CHUNK_ID], list(chunk_ids))
+                    if keep.any():
+                        parts.append((added_embeddings[keep], added_payloads[keep]))
+                if not parts:
+                    return None
+                index = VectorIndex(parts[0][0].shape[1], payload_width=parts[0][1].shape[1])
+                for part_embeddings, part_payloads in parts:
+                    index.add(part_embeddings, part_payloads)
+                if build.removed_document_ids:
+                    index.remove(DOCUMENT_ID, build.removed_document_ids)
+                self.user_indexes[user_id] = index
+                return index
+
+    def search(self, user_id: int, query: str, top_k: int) -> list[dict]:
+        """
+        return:
+            the top_k chunks of the user's documents most similar to the query, sorted by the score,
+            each one is a dict of chunk_id, document_id, score and the offsets of its best passage
+        """
+        index = self.get_user_index(user_id)
+        if index is None:
+            return []
+        query_embedding = self.get_service().encode([query])[0]
+        # a chunk may have several passages in the top results
+        payloads, scores = index.search(query_embedding, top_k * 4)
+        results, chunk_ids = [], set()
+        for payload, score in zip(payloads.tolist(), scores.tolist()):
+            if payload[CHUNK_ID] in chunk_ids:
+                continue
+            chunk_ids.add(payload[CHUNK_ID])
+            results.append({
+                'chunk_id': payload[CHUNK_ID],
+                'document_id': payload[DOCUMENT_ID],
+                'score': score,
+                'passage_start': payload[PASSAGE_START],
+                'passage_end': payload[PASSAGE_END],
+            })
+            if len(results) == top_k:
+                break
+        return results
+
+
+LIBRARY_INDEX = LibraryIndex()
+
+
+@event.listens_for(Document, 'after_delete')
+def remove_document(mapper, connection, document: Document):
+    LIBRARY_INDEX.remove_document(document.user_id, document.id)
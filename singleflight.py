@@ -0,0 +1,61 @@
+"""
+Coalesce the concurrent calls of the same expensive work: the first caller of a key (the leader) runs the function,
+the callers of the same key arriving before it finishes (the followers) wait and get the same result or exception.
+A key is forgotten as soon as its call finishes, so a later call runs the function again.
+"""
+from threading import Event, Lock
+from typing import Any, Callable, Hashable
+from metrics import REGISTRY
+
+SINGLEFLIGHT_CALLS = REGISTRY.counter(
+    "readhub_singleflight_calls_total", "The calls which ran the work (leader) or waited for another call (follower)", ("group", "role"))
+
+
+class Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """
+        args:
+            name: the label of the group in the metrics
+        """
+        self.name = name
+        self.lock = Lock()
+        self.calls: dict[Hashable, Call] = {}
+
+    def do(self, key: Hashable, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        return func(*args, **kwargs), or the result of the running call of the same key
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+        SINGLEFLIGHT_CALLS.inc(group=self.name, role="leader" if leader else "follower")
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.calls
@@ -0,0 +1,154 @@
+import io
+import threading
+import time
+import unittest
+from unittest import mock
+import feedparser
+from basic_test import Basic_Tests
+import app as app_module
+import arxiv
+from bulk_import import read_arxiv_id_list, read_bibtex_arxiv_id_list
+from ingestion import IngestionPipeline
+from models import db, Document, DocumentImport, DocumentStatus, User
+
+BIBTEX = """
+@string{acl = "Association for Computational Linguistics"}
+@article{baichuan,
+  title={Baichuan 2: Open Large-scale Language Models},
+  journal={arXiv preprint arXiv:2309.10305},
+  year={2023}
+}
+@misc{attention,
+  title = {Attention Is All You Need},
+  eprint = {1706.03762v7},
+  archivePrefix = {arXiv},
+}
+@inproceedings{bert,
+  title = "{BERT}: Pre-training of Deep Bidirectional Transformers",
+  url = "https://arxiv.org/abs/1810.04805",
+}
+@article{gpt3, doi = {10.48550/ARXIV.2005.14165}, title = {Language Models are Few-Shot Learners}}
+@article{resnet,
+  title={Deep residual learning for image recognition},
+  booktitle={CVPR},
+}
+"""
+
+
+def atom_feed(arxiv_id_list: list[str]) -> str:
+    entries = "".join(f"""<entry>
+<id>http://arxiv.org/abs/{arxiv_id}v1</id>
+<published>2024-01-01T00:00:00Z</published>
+<title>Paper {arxiv_id}</title>
+<summary>The abstract of {arxiv_id}</summary>
+<author><name>A. Author</name></author>
+<link title="pdf" href="http://arxiv.org/pdf/{arxiv_id}v1" rel="related" type="application/pdf"/>
+</entry>""" for arxiv_id in arxiv_id_list)
+    return f"""<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom">{entries}</feed>"""
+
+
+class Test_Bulk_Import(Basic_Tests):
+
+    def setUp(self):
+        super().setUp()
+        self.queries = []
+        self.known_ids = {"2309.10305", "1706.03762", "1810.04805", "2005.14165"}
+
+    def get_arxiv_response(self, url: str):
+        self.queries.append(url)
+        arxiv_id_list = url.split("id_list=")[1].split("&")[0].split(",")
+        return feedparser.parse(atom_feed([arxiv_id for arxiv_id in arxiv_id_list if arxiv_id in self.known_ids]))
+
+    def test_read_arxiv_id_list(self):
+        arxiv_id_list, unrecognized_list = read_arxiv_id_list(
+            "https://arxiv.org/abs/2309.10305v2, 1706.03762\nhttps://arxiv.org/pdf/1810.04805.pdf hep-th/9901001 2309.10305 nonsense"
+        )
+        self.assertEqual(arxiv_id_list, ["2309.10305", "1706.03762", "1810.04805", "hep-th/9901001"])
+        self.assertEqual(unrecognized_list, ["nonsense"])
+
+    def test_read_bibtex(self):
+        arxiv_id_list, unrecognized_list = read_bibtex_arxiv_id_list(BIBTEX)
+        self.assertEqual(arxiv_id_list, ["2309.10305", "1706.03762", "1810.04805", "2005.14165"])
+        self.assertEqual(unrecognized_list, ["resnet"])
+
+    def test_batched_metadata(self):
+        with mock.patch.object(arxiv, "get_arxiv_response", side_effect=self.get_arxiv_response), \
+                mock.patch.object(arxiv, "ARXIV_LIMIT_TIME_PER_REQUEST", 0):
+            paper_info_dict = arxiv.get_base_info_with_paper_id_list(["2309.10305", "1706.03762", "0000.00000", "1810.04805", "2005.14165"], batch_size=2)
+        self.assertEqual(len(self.queries), 3)
+        self.assertEqual(list(paper_info_dict), ["2309.10305", "1706.03762", "1810.04805", "2005.14165"])
+        self.assertEqual(paper_info_dict["1706.03762"]['title'], "Paper 1706.03762")
+
+    def test_import_documents(self):
+        self.register()
+        calls = []
+        stages = [(name, lambda document, name=name: calls.append((name, document.id))) for name in ['metadata', 'download', 'parse', 'chunk', 'index']]
+        pipeline = IngestionPipeline(self.app, stages + [('derive', app_module.derive_document)], on_ready=app_module.refresh_after_ingestion)
+        refreshed = threading.Event()
+        with mock.patch.object(arxiv, "get_arxiv_response", side_effect=self.get_arxiv_response), \
+                mock.patch.object(app_module, "INGESTION_PIPELINE", pipeline), \
+                mock.patch.object(app_module, "refresh_user_profile_in_background", side_effect=lambda user_id: refreshed.set()) as refresh_user_profile:
+            response = self.client.post('/import_documents', data={
+                'arxiv_ids': "2309.10305 0000.00000 nonsense",
+                'bibtex': (io.BytesIO(BIBTEX.encode()), "library.bib"),
+                'myusername': 'test',
+            }, content_type='multipart/form-data')
+            self.assertTrue(response.json['success'])
+            self.assertEqual(len(response.json['document_ids']), 4)
+            self.assertEqual(response.json['not_found'], ["0000.00000"])
+            self.assertEqual(response.json['unrecognized'], ["nonsense", "resnet"])
+            # one metadata query for all the papers
+            self.assertEqual(len(self.queries), 1)
+            self.assertTrue(refreshed.wait(timeout=10))
+            # the metadata stage is done by the import
+            self.assertNotIn('metadata', [name for name, _ in calls])
+            with self.app.app_context():
+                documents = Document.query.filter(Document.id.in_(response.json['document_ids'])).all()
+                self.assertEqual({document.status for document in documents}, {DocumentStatus.READY})
+                self.assertEqual(sorted(document.title for document in documents)[0], "Paper 1706.03762")
+                self.assertEqual(documents[0].user.upload_document_number, 4)
+            # one refresh for the import instead of one after each document
+            self.assertTrue(pipeline.wait_idle(timeout=10))
+            refresh_user_profile.assert_called_once()
+            self.wait_import_finished()
+            response = self.client.post('/import_documents', data={'arxiv_ids': "1706.03762", 'myusername': 'test'})
+            self.assertEqual(response.json['duplicated'], ["1706.03762"])
+            self.assertEqual(response.json['document_ids'], [])
+
+    def wait_import_finished(self, timeout: float = 10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.app.app_context():
+                if all(document_import.finished for document_import in DocumentImport.query.all()):
+                    return
+            time.sleep(0.05)
+        self.fail("the import is not finished")
+
+    def test_resume_import(self):
+        self.register()
+        # an import interrupted by a restart, one document is ingested and one is left after its download
+        with self.app.app_context():
+            user = User.query.filter_by(username='test').first()
+            document_import = DocumentImport(user_id=user.id)
+            db.session.add(document_import)
+            db.session.add_all([
+                Document(user=user, base_dir="unused/0", title="0", arxiv_id="2401.00000", status=DocumentStatus.READY, document_import=document_import),
+                Document(user=user, base_dir="unused/1", title="1", arxiv_id="2401.00001", status='download', document_import=document_import),
+            ])
+            db.session.commit()
+        calls = []
+        stages = [(name, lambda document, name=name: calls.append(name)) for name in ['metadata', 'download', 'parse', 'chunk', 'index']]
+        pipeline = IngestionPipeline(self.app, stages + [('derive', app_module.derive_document)], on_ready=app_module.refresh_after_ingestion)
+        with mock.patch.object(app_module, "INGESTION_PIPELINE", pipeline), \
+                mock.patch.object(app_module, "refresh_user_profile_in_background") as refresh_user_profile:
+            with self.app.app_context():
+                self.assertEqual(pipeline.resume(), 1)
+                self.assertEqual(app_module.resume_imports(), 1)
+            self.wait_import_finished()
+            self.assertTrue(pipeline.wait_idle(timeout=10))
+        self.assertEqual(calls, ['parse', 'chunk', 'index'])
+        refresh_user_profile.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+from basic_test import Basic_Tests
+from cache_manager import DocumentCache
+from models import db, Document, Chunk, User, DocumentStatus
+
+HOUR = 3600
+
+
+class Test_Cache_Manager(Basic_Tests):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, "documents")
+        os.makedirs(self.cache_dir)
+        self.cache = DocumentCache(self.cache_dir, os.path.join(self.temp_dir, "index.json"), max_bytes=250, grace_seconds=HOUR)
+
+    def tearDown(self):
+        super().tearDown()
+        if hasattr(self, 'temp_dir'):
+            shutil.rmtree(self.temp_dir)
+
+    def write(self, name: str, size: int, age: float = 0) -> str:
+        path = os.path.join(self.cache_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def create_document(self, arxiv_id: str, status: str, with_chunk: bool = True) -> str:
+        base_dir = os.path.join(self.cache_dir, str(uuid.uuid4()))
+        chunk_path = self.write(os.path.join(os.path.basename(base_dir), "0.txt"), 10)
+        with self.app.app_context():
+            document = Document(user=User.query.filter_by(username='default').first(), base_dir=base_dir, title=arxiv_id, arxiv_id=arxiv_id, status=status)
+            db.session.add(document)
+            db.session.flush()
+            if with_chunk:
+                Chunk.bulk_create(document.id, [chunk_path])
+            db.session.commit()
+        return base_dir
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.cache_dir, name))
+
+    def test_evict_lru(self):
+        for i, age in enumerate([3, 1, 2, 4]):
+            self.write(f"2401.0000{i}.pkl", 100, age * HOUR)
+        # the paper being ingested is kept even if it is the least recently used
+        self.create_document("2401.00003", 'download')
+        # an access makes the oldest paper the most recent one
+        self.cache.touch(os.path.join(self.cache_dir, "2401.00000.pkl"))
+        with self.app.app_context():
+            removed = self.cache.evict()
+        self.assertEqual([os.path.basename(path) for path in removed], ["2401.00002.pkl", "2401.00001.pkl"])
+        self.assertTrue(self.exists("2401.00000.pkl"))
+        self.assertTrue(self.exists("2401.00003.pkl"))
+        # the access times are saved for the next process
+        cache = DocumentCache(self.cache_dir, os.path.join(self.temp_dir, "index.json"), max_bytes=100)
+        with self.app.app_context():
+            self.assertEqual([os.path.basename(path) for path in cache.evict()], ["2401.00000.pkl"])
+
+    def test_compact(self):
+        self.write("2401.00000.pkl", 100)
+        self.write("2401.00000.pdf", 100)
+        self.write("2401.00001.pdf", 100)
+        self.write("2401.00002.pkl", 100)
+        self.write("2401.00002.pdf", 100)
+        self.write(".2401.00003.pkl.abc.tmp", 100, 2 * HOUR)
+        self.create_document("2401.00002", 'parse')
+        ready_dir = self.create_document("2401.00004", DocumentStatus.READY)
+        # the document is deleted, the dir of its chunks is left
+        orphan_dir = self.write(os.path.join(str(uuid.uuid4()), "0.txt"), 10)
+        os.utime(os.path.dirname(orphan_dir), (time.time() - 2 * HOUR, time.time() - 2 * HOUR))
+        # the dir of a document being imported, its row is not committed yet
+        new_dir = self.write(os.path.join(str(uuid.uuid4()), "paper_info.json"), 10)
+        with self.app.app_context():
+            stats = self.cache.stats()
+            self.assertEqual((stats['pkl_files'], stats['pdf_files'], stats['protected_files']), (2, 3, 2))
+            self.assertEqual((stats['chunk_dirs'], stats['orphan_dirs'], stats['temp_files']), (2, 2, 1))
+            removed = self.cache.compact()
+        self.assertEqual(len(removed), 3)
+        # the pdf of a parsed paper is removed unless the paper is ingesting
+        self.assertFalse(self.exists("2401.00000.pdf"))
+        self.assertTrue(self.exists("2401.00001.pdf"))
+        self.assertTrue(self.exists("2401.00002.pdf"))
+        self.assertFalse(os.path.exists(os.path.dirname(orphan_dir)))
+        self.assertTrue(os.path.exists(os.path.dirname(new_dir)))
+        self.assertTrue(os.path.exists(ready_dir))
+
+    def test_clear(self):
+        self.write("2401.00000.pkl", 100)
+        self.write("2401.00001.pkl", 100)
+        ingesting_dir = self.create_document("2401.00001", DocumentStatus.PENDING, with_chunk=False)
+        ready_dir = self.create_document("2401.00002", DocumentStatus.READY)
+        with self.app.app_context():
+            self.cache.clear()
+        self.assertFalse(self.exists("2401.00000.pkl"))
+        self.assertTrue(self.exists("2401.00001.pkl"))
+        self.assertTrue(os.path.exists(ingesting_dir))
+        self.assertTrue(os.path.exists(ready_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,11 @@
 from basic_test import Basic_Tests
+import time
 import unittest
 from models import Document, Question, QUESTION_TYPE_LIST
 
+# the seconds to wait for the ingestion of the uploaded document
+INGESTION_TIMEOUT = 600
+
 class Test_Document(Basic_Tests):
     
     def upload_document(self):
@@ -16,6 +20,17 @@ class Test_Document(Basic_Tests):
         response = self.client.post('/upload_document', data=data)
         assert response.status_code == 200
         assert response.json['success'] == True
+        # the document is ingested in the background
+        document_id = response.json['document_id']
+        deadline = time.monotonic() + INGESTION_TIMEOUT
+        while True:
+            response = self.client.get('/get_document_status', query_string={'document_id': document_id})
+            assert response.json['success'] == True
+            if response.json['status'] in ('ready', 'failed'):
+                break
+            assert time.monotonic() < deadline, f"the document is not ingested in {INGESTION_TIMEOUT}s: {response.json}"
+            time.sleep(1)
+        assert response.json['status'] == 'ready', response.json['error']
         # TODO add other judgement here
         # Test recomendation paper and person_labels
 
@@ -0,0 +1,161 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import unittest
+from unittest import mock
+import numpy as np
+import model_registry
+from embedding_service import EmbeddingService
+from model_registry import ModelRegistry
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.batch_size_list = []
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        self.batch_size_list.append(len(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+class Test_Embedding_Service(unittest.TestCase):
+
+    def test_encode(self):
+        encoder = FakeEncoder()
+        registry = ModelRegistry({'fake': lambda: encoder}, idle_unload_seconds=None)
+        service = EmbeddingService('fake', registry, max_batch_size=4, max_wait_ms=1, torch_threads=None)
+        embeddings = service.encode(["a", "bbb", "a"])
+        self.assertEqual(embeddings.shape, (3, 2))
+        np.testing.assert_allclose(np.linalg.norm(embeddings, axis=-1), 1, rtol=1e-6)
+        np.testing.assert_array_equal(embeddings[0], embeddings[2])
+        # the duplicated text is only encoded once
+        self.assertEqual(encoder.batch_size_list, [2])
+
+    def test_dynamic_batching(self):
+        encoder = FakeEncoder()
+        registry = ModelRegistry({'fake': lambda: encoder}, idle_unload_seconds=None)
+        service = EmbeddingService('fake', registry, max_batch_size=64, max_wait_ms=50, torch_threads=None)
+        texts = ["x" * i for i in range(1, 33)]
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(lambda text: service.encode([text]), texts))
+        for text, embedding in zip(texts, results):
+            np.testing.assert_allclose(embedding[0], np.array([len(text), 1.0]) / np.hypot(len(text), 1), rtol=1e-6)
+        self.assertLess(service.batch_number, len(texts))
+        self.assertTrue(all(batch_size <= 64 for batch_size in encoder.batch_size_list))
+
+    def test_similarity(self):
+        registry = ModelRegistry({'fake': FakeEncoder}, idle_unload_seconds=None)
+        service = EmbeddingService('fake', registry, torch_threads=None)
+        self.assertAlmostEqual(service.similarity("ab", "cd"), 1.0, places=6)
+        self.assertEqual(service.pairwise_similarity([("a", "b"), ("a", "abcdef")]).shape, (2,))
+        self.assertEqual(service.similarity_matrix(["a", "b", "c"], ["d", "e"]).shape, (3, 2))
+
+    def test_load_error(self):
+        def load_encoder():
+            raise ImportError("no torch")
+        registry = ModelRegistry({'fake': load_encoder}, idle_unload_seconds=None)
+        service = EmbeddingService('fake', registry, torch_threads=None)
+        # the encoder is not loaded by the check
+        self.assertTrue(service.available)
+        with self.assertRaises(RuntimeError):
+            service.encode(["a"])
+        self.assertFalse(service.available)
+
+
+class Test_Model_Registry(unittest.TestCase):
+
+    def test_lazy_shared_loading(self):
+        load_number = []
+        def load_model():
+            load_number.append(1)
+            return FakeEncoder()
+        registry = ModelRegistry({'fake': load_model}, idle_unload_seconds=None)
+        self.assertEqual(len(load_number), 0)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            models = list(pool.map(lambda _: registry.use('fake').__enter__(), range(8)))
+        self.assertEqual(len(load_number), 1)
+        self.assertTrue(all(model is models[0] for model in models))
+
+    def test_memory_budget(self):
+        registry = ModelRegistry({'a': FakeEncoder, 'b': FakeEncoder}, memory_budget=150, idle_unload_seconds=None)
+        with registry.use('a'):
+            registry.models['a'].memory = 100
+        with registry.use('b'):
+            registry.models['b'].memory = 100
+            # the models in use are never unloaded
+            self.assertIn('b', registry.models)
+        # the least recently used idle model is unloaded
+        self.assertEqual(set(registry.models), {'b'})
+
+    def test_model_larger_than_budget(self):
+        load_number = []
+        def load_model():
+            load_number.append(1)
+            return FakeEncoder()
+        registry = ModelRegistry({'big': load_model, 'a': FakeEncoder}, memory_budget=50, idle_unload_seconds=None)
+        for _ in range(3):
+            with registry.use('big'):
+                registry.models['big'].memory = 100
+        # the most recently used model is kept loaded between the batches
+        self.assertEqual(len(load_number), 1)
+        with registry.use('a'):
+            pass
+        self.assertEqual(set(registry.models), {'a'})
+
+    def test_load_retry(self):
+        failures = [MemoryError("out of memory"), MemoryError("out of memory")]
+        def load_model():
+            if failures:
+                raise failures.pop(0)
+            return FakeEncoder()
+        registry = ModelRegistry({'a': load_model}, idle_unload_seconds=None, load_retry_seconds=60)
+        self.assertTrue(registry.is_available('a'))
+        self.assertEqual(len(failures), 2)
+        registry.preload(['a'])
+        self.assertFalse(registry.is_available('a'))
+        # the model is not loaded again before the retry time
+        with self.assertRaises(RuntimeError):
+            registry.use('a').__enter__()
+        self.assertEqual(len(failures), 1)
+        # the retry time has passed
+        registry.load_errors['a'].retry_time = 0
+        self.assertTrue(registry.is_available('a'))
+        registry.preload(['a'])
+        # the wait doubles after each failure
+        self.assertEqual(registry.load_errors['a'].failure_number, 2)
+        self.assertGreater(registry.load_errors['a'].retry_time - time.monotonic(), 100)
+        registry.load_errors['a'].retry_time = 0
+        registry.preload(['a'])
+        self.assertIn('a', registry.models)
+        self.assertEqual(registry.load_errors, {})
+
+    def test_unload_idle_models(self):
+        registry = ModelRegistry({'a': FakeEncoder}, idle_unload_seconds=None)
+        registry.preload(['a'])
+        self.assertIn('a', registry.models)
+        registry.unload_idle_models(idle_seconds=0)
+        self.assertNotIn('a', registry.models)
+        self.assertTrue(registry.is_available('a'))
+
+    def test_model_memory(self):
+        class QuantizedModule:
+            # the packed int8 weights are not parameters
+            def parameters(self):
+                return []
+
+            def state_dict(self):
+                return {'_packed_params': b"x" * 100}
+
+        encoder = FakeEncoder()
+        encoder.model = QuantizedModule()
+        with mock.patch.object(model_registry, "state_dict_size", side_effect=lambda module: len(module.state_dict()['_packed_params'])):
+            self.assertEqual(model_registry.get_model_memory(encoder, 10), 100)
+        # the growth of the resident memory is used for the models without a torch module
+        self.assertEqual(model_registry.get_model_memory(FakeEncoder(), 10), 10)
+        counter = model_registry.ByteCounter()
+        counter.write(b"abc")
+        counter.write(memoryview(b"de"))
+        self.assertEqual(counter.size, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
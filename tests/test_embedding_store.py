@@ -0,0 +1,61 @@
+import tempfile
+import unittest
+import numpy as np
+from embedding_store import EmbeddingStore
+
+
+def fake_compute(texts: list[str]) -> np.ndarray:
+    return np.array([[len(text), 1, 2, 3] for text in texts], dtype=np.float32)
+
+
+class Test_Embedding_Store(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store_dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_or_compute(self):
+        store = EmbeddingStore(self.store_dir)
+        computed_texts = []
+        def compute(texts):
+            computed_texts.extend(texts)
+            return fake_compute(texts)
+        embeddings = store.get_or_compute(["a", "bb", "a"], compute)
+        np.testing.assert_array_equal(embeddings, fake_compute(["a", "bb", "a"]))
+        self.assertEqual(computed_texts, ["a", "bb"])
+        computed_texts.clear()
+        embeddings = store.get_or_compute(["bb", "ccc"], compute)
+        np.testing.assert_array_equal(embeddings, fake_compute(["bb", "ccc"]))
+        self.assertEqual(computed_texts, ["ccc"])
+        self.assertEqual(len(store), 3)
+        self.assertIsInstance(store.get("bb").base, np.memmap)
+
+    def test_reload(self):
+        store = EmbeddingStore(self.store_dir)
+        store.put_many(["a", "bb"], fake_compute(["a", "bb"]))
+        store = EmbeddingStore(self.store_dir)
+        embeddings, missing_index_list = store.get_many(["bb", "x", "a"])
+        self.assertEqual(missing_index_list, [1])
+        np.testing.assert_array_equal(embeddings[[0, 2]], fake_compute(["bb", "a"]))
+
+    def test_evict_and_compact(self):
+        store = EmbeddingStore(self.store_dir, max_rows=2, compact_ratio=1.0)
+        store.put_many(["a", "bb"], fake_compute(["a", "bb"]))
+        store.get("a")
+        store.put_many(["ccc"], fake_compute(["ccc"]))
+        # "bb" is the least recently used one
+        self.assertIsNone(store.get("bb"))
+        self.assertEqual(store.stats()['file_rows'], 3)
+        store.compact()
+        self.assertEqual(store.stats()['file_rows'], 2)
+        store = EmbeddingStore(self.store_dir)
+        self.assertEqual(len(store), 2)
+        np.testing.assert_array_equal(store.get("ccc"), fake_compute(["ccc"])[0])
+        np.testing.assert_array_equal(store.get("a"), fake_compute(["a"])[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import time
+import unittest
+from unittest import mock
+import utils
+from llm_backend import StandInBackend, detect_prompt_family
+from utils import get_problems_for_article, get_problems
+
+CHUNKS = [
+    "We introduce a retrieval augmented transformer for question answering. The retriever selects passages from a large corpus.",
+    "The generator reads the passages and writes the answer. Experiments show that retrieval improves the accuracy.",
+    "We analyze the errors of the generator and find that most of them come from the passages which are not retrieved.",
+]
+
+
+class Test_Exam_Deadline(unittest.TestCase):
+
+    def call_llm(self, family_latency: dict[str, float]):
+        backend = StandInBackend(latency_scale=0)
+
+        def call(prompt):
+            time.sleep(family_latency.get(detect_prompt_family(prompt), 0))
+            return backend.chat(prompt)
+        return call
+
+    def generate(self, family_latency: dict[str, float], deadline: float | None):
+        with mock.patch.object(utils, "_call_llm", side_effect=self.call_llm(family_latency)), \
+                mock.patch.object(utils, "USE_HEDGING", False):
+            return get_problems_for_article(CHUNKS, deadline)
+
+    def test_no_deadline(self):
+        questions, chunk_index_list, late_questions = self.generate({'review': 0.1}, None)
+        self.assertIsNone(late_questions)
+        self.assertEqual(len(questions), 10)
+        self.assertEqual(chunk_index_list[-1], -1)
+
+    def test_late_review(self):
+        start = time.monotonic()
+        questions, chunk_index_list, late_questions = self.generate({'review': 0.5}, time.monotonic() + 0.2)
+        # the questions ready by the deadline are returned at the deadline
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(len(questions), 9)
+        self.assertNotIn(-1, chunk_index_list)
+        late_question_list, late_chunk_index_list = late_questions.result(timeout=5)
+        self.assertEqual([question['question_type'] for question in late_question_list], [3])
+        self.assertEqual(late_chunk_index_list, [-1])
+
+    def test_no_retry_after_deadline(self):
+        calls = []
+
+        def invalid(prompt):
+            calls.append(prompt)
+            return "no json"
+
+        with mock.patch.object(utils, "_call_llm", side_effect=invalid), mock.patch.object(utils, "USE_HEDGING", False):
+            self.assertEqual(get_problems(CHUNKS[0], "tf", 3, deadline=time.monotonic()), [])
+            self.assertEqual(len(calls), 1)
+            get_problems(CHUNKS[0], "tf", 3)
+            self.assertEqual(len(calls), 1 + utils.MAX_PROBLEM_GEN_TRIES)
+
+
+if __name__ == "__main__":
+    unittest.main()
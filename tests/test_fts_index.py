@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from basic_test import Basic_Tests, app, db
+from models import User, Document, Chunk, DocumentStatus
+from fts_index import index_document, search_keywords, rebuild
+
+
+class Test_FTS_Index(Basic_Tests):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        if hasattr(self, 'temp_dir'):
+            self.temp_dir.cleanup()
+
+    def add_document(self, user: User, title: str, abstract: str, chunk_text_list: list[str], status: str = DocumentStatus.READY) -> Document:
+        document = Document(user=user, base_dir=self.temp_dir.name, title=title, abstract=abstract, status=status)
+        db.session.add(document)
+        db.session.flush()
+        chunk_path_list = []
+        for i, chunk_text in enumerate(chunk_text_list):
+            chunk_path = os.path.join(self.temp_dir.name, f"{document.id}_{i}.txt")
+            with open(chunk_path, "w", encoding='utf-8') as f:
+                f.write(chunk_text)
+            chunk_path_list.append(chunk_path)
+        index_document(document, Chunk.bulk_create(document.id, chunk_path_list), chunk_text_list)
+        db.session.commit()
+        return document
+
+    def test_search_keywords(self):
+        with app.app_context():
+            user, other_user = User(username='a'), User(username='b')
+            db.session.add_all([user, other_user])
+            db.session.commit()
+            transformer = self.add_document(user, "Attention is all you need", "The transformer architecture", [
+                "We propose the Transformer, based solely on attention mechanisms.",
+                "Multi-head attention allows the model to attend to information jointly.",
+            ])
+            self.add_document(user, "Deep residual learning", "Residual networks", ["Residual blocks ease the training."])
+            self.add_document(other_user, "Attention again", "attention", ["attention attention"])
+
+            results = search_keywords(user.id, "attention")
+            self.assertEqual({result['document_id'] for result in results}, {transformer.id})
+            # the title has the highest weight
+            self.assertIsNone(results[0]['chunk_id'])
+            self.assertIn("<b>", results[0]['snippet'])
+            results = search_keywords(user.id, "multi-head attention")
+            self.assertEqual(len(results), 1)
+            self.assertIsNotNone(results[0]['chunk_id'])
+            self.assertEqual(search_keywords(user.id, 'AND OR "'), [])
+
+            for chunk in transformer.chunks:
+                db.session.delete(chunk)
+            db.session.delete(transformer)
+            db.session.commit()
+            self.assertEqual(search_keywords(user.id, "attention"), [])
+
+            user_id, other_user_id = user.id, other_user.id
+            self.assertEqual(rebuild(batch_size=1), 2)
+            self.assertEqual(len(search_keywords(user_id, "residual")), 2)
+            self.assertEqual(len(search_keywords(other_user_id, "attention")), 2)
+
+    def test_rebuild_skips_documents_not_indexed(self):
+        with app.app_context():
+            user = User(username='a')
+            db.session.add(user)
+            db.session.commit()
+            self.add_document(user, "Residual ready", "residual", ["residual"])
+            self.add_document(user, "Residual indexed", "residual", ["residual"], status='index')
+            # the chunks of the pending document are indexed by the index stage, the failed one has partial chunks
+            self.add_document(user, "Residual pending", "residual", ["residual"], status=DocumentStatus.PENDING)
+            self.add_document(user, "Residual failed", "residual", ["residual"], status=DocumentStatus.FAILED)
+            user_id = user.id
+            self.assertEqual(rebuild(), 2)
+            self.assertEqual({result['title'] for result in search_keywords(user_id, "residual")}, {"Residual ready", "Residual indexed"})
+
+
+if __name__ == "__main__":
+    unittest.main()
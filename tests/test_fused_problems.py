@@ -0,0 +1,59 @@
+import json
+import unittest
+from unittest import mock
+import utils
+from llm_backend import StandInBackend, detect_prompt_family
+from utils import PROBLEM_FUSED_PROMPT, check_fused_problem_format, get_fused_problems
+
+ARTICLE = (
+    "We introduce a retrieval augmented transformer for question answering. "
+    "The retriever selects passages from a large corpus with dense embeddings. "
+    "Experiments on several benchmarks show that retrieval improves the accuracy of the generator."
+)
+CHOICE = {'问题': "What does the retriever select?", 'A': "passages", 'B': "tables", 'C': "images", 'D': "labels", '正确答案': "A"}
+TF = {'问题': "The generator is frozen.", '答案': "错误"}
+
+
+class Test_Fused_Problems(unittest.TestCase):
+
+    def test_prompt(self):
+        prompt = PROBLEM_FUSED_PROMPT(ARTICLE, {'choice': 2, 'tf': 1, 'blank': 3})
+        self.assertEqual(detect_prompt_family(prompt), 'fused')
+        # the article is sent once
+        self.assertEqual(prompt.count(ARTICLE), 1)
+        self.assertIn("2道四选一选择题", prompt)
+        self.assertNotIn("填空题", PROBLEM_FUSED_PROMPT(ARTICLE, {'tf': 1}))
+
+    def test_stand_in_response(self):
+        nums = {'choice': 2, 'tf': 1, 'blank': 3}
+        response = StandInBackend(latency_scale=0).chat(PROBLEM_FUSED_PROMPT(ARTICLE, nums))
+        problems = check_fused_problem_format(response, list(nums))
+        self.assertEqual({problem_type: len(data) for problem_type, data in problems.items()}, nums)
+
+    def test_check_sections(self):
+        # the invalid section is empty, the valid ones are kept
+        response = json.dumps({'选择题': [CHOICE], '判断题': [{'问题': "x", '答案': "maybe"}]}, ensure_ascii=False)
+        self.assertEqual(check_fused_problem_format(response, ['choice', 'tf', 'blank']), {'choice': [CHOICE], 'tf': [], 'blank': []})
+        with self.assertRaises(ValueError):
+            check_fused_problem_format(json.dumps({'填空题': []}), ['choice', 'tf', 'blank'])
+
+    def test_request_missing_types(self):
+        prompts = []
+
+        def call_llm(prompt):
+            prompts.append(prompt)
+            if len(prompts) == 1:
+                return json.dumps({'选择题': [CHOICE, CHOICE]}, ensure_ascii=False)
+            return json.dumps({'判断题': [TF]}, ensure_ascii=False)
+
+        with mock.patch.object(utils, "_call_llm", side_effect=call_llm), mock.patch.object(utils, "USE_HEDGING", False):
+            problems = get_fused_problems(ARTICLE, {'choice': 2, 'tf': 1})
+        self.assertEqual(problems, {'choice': [CHOICE, CHOICE], 'tf': [TF]})
+        self.assertEqual(len(prompts), 2)
+        # only the tf problems are requested again
+        self.assertNotIn("选择题", prompts[1])
+        self.assertIn("1道判断题", prompts[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
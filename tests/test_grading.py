@@ -0,0 +1,65 @@
+import unittest
+from unittest import mock
+import grading
+from constants import PASSED_SCORE
+
+
+class Test_Grading(unittest.TestCase):
+
+    def test_normalize_answer(self):
+        self.assertEqual(grading.normalize_answer(" Self-Attention。"), "selfattention")
+        self.assertEqual(grading.normalize_answer("ＢＥＲＴ（模型）"), "bert模型")
+
+    def test_normalize_numbers(self):
+        self.assertEqual(grading.normalize_answer("1.5"), "1.5")
+        self.assertEqual(grading.normalize_answer("-3。"), "-3")
+        self.assertEqual(grading.normalize_answer("GPT-3"), "gpt3")
+        self.assertEqual(grading.normalize_answer("1,000 个"), "1000个")
+        self.assertEqual(grading.extract_numbers("学习率为0.10，批大小为-32"), [grading.Decimal("0.1"), grading.Decimal("-32")])
+
+    def test_numbers_differ(self):
+        for user_answer, standard_answer in [("15", "1.5"), ("01", "0.1"), ("3", "-3"), ("学习率为0.001", "学习率为0.0001")]:
+            score, review = grading.local_grade_blank_answer(user_answer, standard_answer)
+            self.assertLessEqual(score, PASSED_SCORE)
+            self.assertIn(review, grading.BAD_REVIEWS)
+        self.assertEqual(grading.local_grade_blank_answer("1.50", "1.5")[0], 100)
+        # the numbers may be written in words
+        with mock.patch.object(grading, "embedding_similarity") as embedding_similarity:
+            self.assertIsNone(grading.local_grade_blank_answer("三层", "3层"))
+            embedding_similarity.assert_not_called()
+
+    def test_similarity(self):
+        self.assertEqual(grading.ngram_similarity("注意力机制", "注意力机制"), 1.0)
+        self.assertEqual(grading.edit_similarity("kitten", "sitting"), 1 - 3 / 7)
+        self.assertEqual(grading.lexical_similarity("abc", "xyz"), 0.0)
+
+    def test_exact_match(self):
+        score, review = grading.local_grade_blank_answer("Transformer ", "transformer")
+        self.assertEqual(score, 100)
+        self.assertIn(review, grading.GOOD_REVIEWS)
+
+    def test_lexical_pass(self):
+        score, _ = grading.local_grade_blank_answer("多头自注意力机制", "多头注意力机制")
+        self.assertGreater(score, PASSED_SCORE)
+
+    def test_empty_answer(self):
+        score, review = grading.local_grade_blank_answer("。。", "注意力")
+        self.assertEqual(score, 0)
+        self.assertIn(review, grading.BAD_REVIEWS)
+
+    def test_escalate_without_encoder(self):
+        with mock.patch.object(grading, "embedding_similarity", return_value=None):
+            self.assertIsNone(grading.local_grade_blank_answer("卷积神经网络", "循环神经网络"))
+
+    def test_embedding_tier(self):
+        with mock.patch.object(grading, "embedding_similarity") as embedding_similarity:
+            embedding_similarity.return_value = 0.99
+            self.assertGreater(grading.local_grade_blank_answer("变换器", "transformer")[0], PASSED_SCORE)
+            embedding_similarity.return_value = 0.1
+            self.assertLessEqual(grading.local_grade_blank_answer("变换器", "transformer")[0], PASSED_SCORE)
+            embedding_similarity.return_value = 0.7
+            self.assertIsNone(grading.local_grade_blank_answer("变换器", "transformer"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import time
+import unittest
+from threading import Lock
+from unittest import mock
+import utils
+from hedging import LatencyTracker, HedgeBudget, Hedger
+from llm_scheduler import LLMScheduler, PRIORITY_CLASSES, GENERATION
+
+
+class Test_Hedging(unittest.TestCase):
+
+    def create_hedger(self, budget_ratio: float = 1.0, key: str = "key", is_saturated=lambda: False) -> Hedger:
+        tracker = LatencyTracker(window=100, min_samples=10)
+        for _ in range(10):
+            tracker.record(key, 0.02)
+        return Hedger(percentile=0.9, tracker=tracker, budget=HedgeBudget(budget_ratio), max_workers=4, is_saturated=is_saturated)
+
+    def slow_then_fast(self, slow: float = 1.0, fail_first: bool = False):
+        """
+        the first call takes slow seconds, the others 0.01 seconds
+        """
+        lock = Lock()
+        calls = []
+
+        def func():
+            with lock:
+                index = len(calls)
+                calls.append(index)
+            time.sleep(slow if index == 0 else 0.01)
+            if index == 0 and fail_first:
+                raise ValueError("invalid")
+            return index
+        return func, calls
+
+    def test_tracker(self):
+        tracker = LatencyTracker(window=10, min_samples=5)
+        self.assertIsNone(tracker.percentile("key", 0.5))
+        for latency in range(1, 21):
+            tracker.record("key", latency)
+        # only the last 10 latencies are kept
+        self.assertEqual(tracker.percentile("key", 0.5), 15)
+        self.assertEqual(tracker.percentile("key", 1.0), 20)
+
+    def test_budget(self):
+        budget = HedgeBudget(0.25)
+        spent = 0
+        for _ in range(100):
+            budget.earn()
+            spent += budget.spend()
+        self.assertEqual(spent, 25)
+
+    def test_hedge(self):
+        hedger = self.create_hedger()
+        func, calls = self.slow_then_fast()
+        start = time.perf_counter()
+        self.assertEqual(hedger.call("key", func), 1)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(len(calls), 2)
+
+    def test_no_samples(self):
+        hedger = self.create_hedger()
+        func, calls = self.slow_then_fast(slow=0.1)
+        self.assertEqual(hedger.call("other", func), 0)
+        self.assertEqual(len(calls), 1)
+
+    def test_budget_exhausted(self):
+        hedger = self.create_hedger(budget_ratio=0.0)
+        func, calls = self.slow_then_fast(slow=0.1)
+        self.assertEqual(hedger.call("key", func), 0)
+        self.assertEqual(len(calls), 1)
+
+    def test_saturated(self):
+        hedger = self.create_hedger(is_saturated=lambda: True)
+        func, calls = self.slow_then_fast(slow=0.1)
+        self.assertEqual(hedger.call("key", func), 0)
+        self.assertEqual(len(calls), 1)
+
+    def test_hedge_in_scheduler_slot(self):
+        scheduler = LLMScheduler(max_concurrency=1, class_concurrency={priority: 1 for priority in PRIORITY_CLASSES}, tokens_per_minute=None)
+        prompt = "prompt"
+        hedger = self.create_hedger(key=utils.detect_prompt_family(prompt), is_saturated=lambda: scheduler.waiting_calls() > 0)
+        func, calls = self.slow_then_fast(slow=0.3)
+        running = []
+
+        def chat(prompt: str):
+            running.append(scheduler.stats()[GENERATION]['running'])
+            return func()
+        backend = mock.Mock()
+        backend.chat.side_effect = chat
+        with mock.patch.object(utils, "LLM_SCHEDULER", scheduler), mock.patch.object(utils, "HEDGER", hedger), \
+                mock.patch.object(utils, "get_backend", return_value=backend), mock.patch.object(utils, "USE_HEDGING", True), \
+                mock.patch.object(utils, "use_batch", return_value=False):
+            self.assertEqual(utils._call_llm(prompt), 1)
+        # the hedge runs in the slot of the admitted call instead of taking another one
+        self.assertEqual(running, [1, 1])
+        self.assertEqual(scheduler.stats()[GENERATION]['running'], 0)
+
+    def test_failed_call(self):
+        hedger = self.create_hedger()
+        # the slow call is invalid, the hedged one is used
+        func, calls = self.slow_then_fast(slow=0.1, fail_first=True)
+        self.assertEqual(hedger.call("key", func), 1)
+
+        def failed():
+            time.sleep(0.05)
+            raise ValueError("invalid")
+        with self.assertRaises(ValueError):
+            hedger.call("key", failed)
+
+
+if __name__ == "__main__":
+    unittest.main()
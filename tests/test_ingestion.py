@@ -0,0 +1,201 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from basic_test import Basic_Tests
+import app as app_module
+import arxiv
+import ingestion
+from ingestion import IngestionPipeline, fetch_metadata, load_paper_info
+from sqlalchemy import update
+from models import db, Document, Chunk, User, DocumentStatus
+from error_message import DOCUMENT_NOT_READY
+
+STAGE_NAMES = ['metadata', 'download', 'parse', 'chunk', 'index', 'derive']
+
+
+class Unreadable_PDF:
+    """
+    the decoded pdf which fails the test if it is unpickled
+    """
+    def __reduce__(self):
+        return (Unreadable_PDF.load, ())
+
+    @staticmethod
+    def load():
+        raise AssertionError("the pdf is unpickled")
+
+
+class Test_Ingestion(Basic_Tests):
+
+    def create_pipeline(self, stage_workers: dict[str, int] = {}, fail_stage: str | None = None, barrier: threading.Barrier | None = None):
+        """
+        return:
+            the pipeline of the stages recording (stage, document id), the calls
+        """
+        calls = []
+        lock = threading.Lock()
+
+        def stage(name):
+            def run(document: Document):
+                with lock:
+                    calls.append((name, document.id))
+                if name == fail_stage:
+                    raise ValueError("broken pdf")
+                if barrier is not None and name == 'parse':
+                    barrier.wait(timeout=5)
+                if name == 'metadata':
+                    document.title = f"title of {document.arxiv_id}"
+            return run
+
+        pipeline = IngestionPipeline(self.app, [(name, stage(name)) for name in STAGE_NAMES], stage_workers, queue_size=2)
+        return pipeline, calls
+
+    def create_documents(self, status_list: list[str]) -> list[int]:
+        with self.app.app_context():
+            user = User.query.filter_by(username='default').first()
+            documents = [
+                Document(user=user, base_dir=f"unused/{i}", title=f"{i}", arxiv_id=f"2401.{i:05d}", status=status)
+                for i, status in enumerate(status_list)
+            ]
+            db.session.add_all(documents)
+            db.session.commit()
+            return [document.id for document in documents]
+
+    def get_status(self, document_id: int) -> tuple[str, str | None]:
+        with self.app.app_context():
+            document = db.session.get(Document, document_id)
+            return document.status, document.ingestion_error
+
+    def test_stages_in_order(self):
+        pipeline, calls = self.create_pipeline()
+        document_id_list = self.create_documents([DocumentStatus.PENDING] * 5)
+        for document_id in document_id_list:
+            self.assertTrue(pipeline.submit(document_id))
+        self.assertTrue(pipeline.wait_idle(timeout=10))
+        for document_id in document_id_list:
+            self.assertEqual([name for name, i in calls if i == document_id], STAGE_NAMES)
+            self.assertEqual(self.get_status(document_id), (DocumentStatus.READY, None))
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Document, document_id_list[0]).title, "title of 2401.00000")
+        # a ready document is not ingested again
+        self.assertFalse(pipeline.submit(document_id_list[0], DocumentStatus.READY))
+
+    def test_failure(self):
+        pipeline, calls = self.create_pipeline(fail_stage='parse')
+        document_id, = self.create_documents([DocumentStatus.PENDING])
+        pipeline.submit(document_id)
+        self.assertTrue(pipeline.wait_idle(timeout=10))
+        self.assertEqual([name for name, _ in calls], ['metadata', 'download', 'parse'])
+        self.assertEqual(self.get_status(document_id), (DocumentStatus.FAILED, "parse: broken pdf"))
+
+    def test_resume(self):
+        pipeline, calls = self.create_pipeline()
+        # the documents left by a crash after the download and after the index stage
+        document_id_list = self.create_documents(['download', 'index', DocumentStatus.READY, DocumentStatus.FAILED])
+        with self.app.app_context():
+            self.assertEqual(pipeline.resume(), 2)
+        self.assertTrue(pipeline.wait_idle(timeout=10))
+        self.assertEqual([name for name, i in calls if i == document_id_list[0]], ['parse', 'chunk', 'index', 'derive'])
+        self.assertEqual([name for name, i in calls if i == document_id_list[1]], ['derive'])
+        self.assertEqual([self.get_status(document_id)[0] for document_id in document_id_list],
+                         [DocumentStatus.READY, DocumentStatus.READY, DocumentStatus.READY, DocumentStatus.FAILED])
+
+    def test_stage_run_by_another_process(self):
+        document_id, = self.create_documents(['parse'])
+
+        def save_chunks(document: Document):
+            # another process resumed the same document and commits the chunk stage first
+            with self.app.app_context(), db.engine.begin() as connection:
+                connection.execute(update(Document).where(Document.id == document.id).values(status='chunk'))
+            Chunk.bulk_create(document.id, ["unused/0.txt", "unused/1.txt"])
+
+        calls = []
+        stages = [(name, lambda document, name=name: calls.append(name)) for name in STAGE_NAMES]
+        stages[STAGE_NAMES.index('chunk')] = ('chunk', save_chunks)
+        pipeline = IngestionPipeline(self.app, stages)
+        self.assertTrue(pipeline.submit(document_id, 'parse'))
+        self.assertTrue(pipeline.wait_idle(timeout=10))
+        # the chunks of the losing worker are rolled back and the document is left to the other process
+        self.assertEqual(calls, [])
+        self.assertEqual(self.get_status(document_id), ('chunk', None))
+        with self.app.app_context():
+            self.assertEqual(Chunk.query.filter_by(document_id=document_id).count(), 0)
+        # a document already past the stage is not run again
+        self.assertTrue(pipeline.submit(document_id, 'parse'))
+        self.assertTrue(pipeline.wait_idle(timeout=10))
+        self.assertEqual(self.get_status(document_id), ('chunk', None))
+
+    def test_profile_refresh_failure(self):
+        document_id, = self.create_documents([DocumentStatus.PENDING])
+        stages = [(name, lambda document: None) for name in STAGE_NAMES[:-1]]
+        pipeline = IngestionPipeline(self.app, stages + [('derive', app_module.derive_document)], on_ready=app_module.refresh_after_ingestion)
+        refreshed = threading.Event()
+
+        def refresh_user_profile(user: User):
+            refreshed.set()
+            raise RuntimeError("LLM unavailable")
+
+        with mock.patch.object(app_module, "refresh_user_profile", side_effect=refresh_user_profile):
+            pipeline.submit(document_id)
+            self.assertTrue(pipeline.wait_idle(timeout=10))
+            self.assertTrue(refreshed.wait(timeout=10))
+        # the refresh runs after the ready status is committed, its failure does not fail the document
+        self.assertEqual(self.get_status(document_id), (DocumentStatus.READY, None))
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Document, document_id).user.upload_document_number, 1)
+
+    def test_stage_parallelism(self):
+        # the parse stage passes only if its 3 workers parse 3 documents at the same time
+        pipeline, calls = self.create_pipeline({'parse': 3}, barrier=threading.Barrier(3))
+        document_id_list = self.create_documents([DocumentStatus.PENDING] * 3)
+        for document_id in document_id_list:
+            pipeline.submit(document_id)
+        self.assertTrue(pipeline.wait_idle(timeout=10))
+        self.assertEqual({self.get_status(document_id)[0] for document_id in document_id_list}, {DocumentStatus.READY})
+
+    def test_upload_document(self):
+        self.register()
+        pipeline, _ = self.create_pipeline({'parse': 2}, barrier=threading.Barrier(2))
+        with mock.patch.object(app_module, "INGESTION_PIPELINE", pipeline):
+            response = self.client.post('/upload_document', data={'pdf_url': 'https://arxiv.org/abs/2309.10305', 'myusername': 'test'})
+            self.assertTrue(response.json['success'])
+            self.assertEqual(response.json['status'], DocumentStatus.PENDING)
+            document_id = response.json['document_id']
+            # the parse stage waits for a second document at the barrier, so the exam of the document is rejected
+            response = self.client.post('/generate_exam', data={'document_id': document_id, 'myusername': 'test'})
+            self.assertEqual(response.json['message'], DOCUMENT_NOT_READY)
+            response = self.client.get('/get_documents', query_string={'myusername': 'test'})
+            self.assertNotEqual(response.json['documents'][0]['status'], DocumentStatus.READY)
+            pipeline.submit(*self.create_documents([DocumentStatus.PENDING]))
+            self.assertTrue(pipeline.wait_idle(timeout=10))
+            response = self.client.get('/get_document_status', query_string={'document_id': document_id, 'myusername': 'test'})
+            self.assertEqual(response.json['status'], DocumentStatus.READY)
+            self.assertEqual(response.json['completed_stage_number'], response.json['stage_number'])
+
+
+    def test_metadata_from_parse_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        paper_info = {'title': "paper", 'abstract': "abstract", 'authors': "author", 'date': "2024", 'link': "unused"}
+        arxiv.write_document_data(os.path.join(temp_dir, "2401.00000.pkl"), paper_info, Unreadable_PDF())
+        with open(os.path.join(temp_dir, "2401.00001.pkl"), "wb") as f:
+            # the cache written before the pdf was pickled separately
+            pickle.dump({**paper_info, 'doc': "pdf"}, f)
+        with mock.patch.object(arxiv, "DOCUMENT_DIR_PREFIX", temp_dir), mock.patch.object(arxiv, "DOCUMENT_CACHE"), \
+                mock.patch.object(ingestion, "get_base_info_with_paper_id", side_effect=AssertionError("fetched")):
+            for arxiv_id in ["2401.00000", "2401.00001"]:
+                document = Document(base_dir=os.path.join(temp_dir, arxiv_id), arxiv_id=arxiv_id)
+                os.makedirs(document.base_dir)
+                fetch_metadata(document)
+                self.assertEqual((document.title, load_paper_info(document)), ("paper", paper_info))
+            self.assertEqual(arxiv.load_document_data("2401.00001")['doc'], "pdf")
+            with self.assertRaises(AssertionError):
+                arxiv.load_document_data("2401.00000")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import json
+import unittest
+from json_salvage import salvage_json
+from utils import jsonfy_response, check_problem_format
+
+QUESTIONS = [
+    {'问题': "What does the retriever select?", '答案': "正确"},
+    {'问题': "Is the generator frozen?", '答案': "错误"},
+    {'问题': "Does retrieval improve the accuracy?", '答案': "正确"},
+]
+
+
+class Test_JSON_Salvage(unittest.TestCase):
+
+    def assertSalvaged(self, text: str, value, repairs: list[str]):
+        result = salvage_json(text)
+        self.assertEqual(result.value, value)
+        for repair in repairs:
+            self.assertIn(repair, result.repairs)
+        return result
+
+    def test_valid(self):
+        text = json.dumps(QUESTIONS, ensure_ascii=False)
+        result = self.assertSalvaged(text, QUESTIONS, [])
+        self.assertEqual(len(result.repairs), 0)
+        self.assertSalvaged(f"好的，以下是题目：\n```json\n{text}\n```\n希望对你有帮助。", QUESTIONS, ['prose'])
+
+    def test_quotes(self):
+        self.assertSalvaged("[{'问题': 'the model's output', '答案': '正确'}]", [{'问题': "the model's output", '答案': "正确"}],
+                            ['single_quotes', 'unescaped_quote'])
+        self.assertSalvaged('[{"问题": "the "best" model", "答案": "正确"}]', [{'问题': 'the "best" model', '答案': "正确"}],
+                            ['unescaped_quote'])
+
+    def test_commas(self):
+        self.assertSalvaged('[{"a": 1,}, {"b": 2},]', [{'a': 1}, {'b': 2}], ['trailing_comma'])
+        self.assertSalvaged('[{"a": 1 "b": 2}\n{"c": 3}]', [{'a': 1, 'b': 2}, {'c': 3}], ['missing_comma'])
+        self.assertSalvaged('[{"a": 1},, {"b": 2}]', [{'a': 1}, {'b': 2}], ['extra_comma'])
+
+    def test_python_and_comments(self):
+        self.assertSalvaged('{"a": True, "b": None} // the end', {'a': True, 'b': None}, ['python_literal'])
+        self.assertSalvaged('[\n{"a": 1},\n// the second one\n{"b": 2},\n...\n]', [{'a': 1}, {'b': 2}], ['comment'])
+        self.assertSalvaged('[{问题： "a"}]', [{'问题': "a"}], ['unquoted_key', 'fullwidth_colon'])
+
+    def test_truncated(self):
+        text = json.dumps(QUESTIONS, ensure_ascii=False)
+        result = self.assertSalvaged(text[:len(text) - 10], QUESTIONS[:2], ['truncated'])
+        self.assertEqual(result.dropped_items, 1)
+        self.assertSalvaged('{"优点": "fast", "缺点": "slow', {'优点': "fast"}, ['truncated'])
+        with self.assertRaises(ValueError):
+            salvage_json('[{"问题": "What')
+
+    def test_broken_item(self):
+        result = self.assertSalvaged('[{"a": 1}, {"b": @@}, {"c": 3}]', [{'a': 1}, {'c': 3}], ['dropped_item'])
+        self.assertEqual(result.dropped_items, 1)
+
+    def test_leading_brackets(self):
+        self.assertSalvaged('根据论文[1]的内容，总结如下：{"总结": "abc"}', {'总结': "abc"}, ['prose'])
+        with self.assertRaises(ValueError):
+            salvage_json("no json here")
+
+    def test_problem_format(self):
+        # the complete questions of a truncated response are kept
+        text = json.dumps(QUESTIONS, ensure_ascii=False)[:-10]
+        self.assertEqual(check_problem_format(text, 'tf'), QUESTIONS[:2])
+        self.assertEqual(jsonfy_response("{'分数': 8, '评价': 'It's right'}"), {'分数': 8, '评价': "It's right"})
+
+
+if __name__ == "__main__":
+    unittest.main()
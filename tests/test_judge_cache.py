@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+from judge_cache import JudgementCache
+
+
+def fake_embed(texts: list[str]) -> np.ndarray:
+    # the embedding of a text only depends on its first character
+    embeddings = np.zeros((len(texts), 8), dtype=np.float32)
+    for i, text in enumerate(texts):
+        embeddings[i, ord(text[0]) % 8] = 1
+    return embeddings
+
+
+class Test_Judge_Cache(unittest.TestCase):
+
+    def test_hit_within_radius(self):
+        cache = JudgementCache(embed=fake_embed, similarity_threshold=0.9, enabled=True)
+        self.assertIsNone(cache.lookup("a answer", "standard"))
+        cache.add("a answer", "standard", (90, "good"))
+        self.assertEqual(cache.lookup("a similar answer", "standard"), (90, "good"))
+        self.assertIsNone(cache.lookup("b answer", "standard"))
+        self.assertIsNone(cache.lookup("a answer", "another standard"))
+        self.assertEqual((cache.hit_number, cache.miss_number), (1, 1))
+
+    def test_eviction(self):
+        cache = JudgementCache(embed=fake_embed, max_standard_answers=2, max_answers_per_standard_answer=2, enabled=True)
+        for standard_answer in ["s1", "s2", "s3"]:
+            cache.add("a", standard_answer, (90, "good"))
+        self.assertIsNone(cache.lookup("a", "s1"))
+        self.assertEqual(cache.lookup("a", "s3"), (90, "good"))
+        for text in ["b", "c", "d"]:
+            cache.add(text, "s3", (10, "bad"))
+        self.assertIsNone(cache.lookup("a", "s3"))
+        self.assertEqual(cache.lookup("d", "s3"), (10, "bad"))
+
+    def test_no_encoder(self):
+        cache = JudgementCache(embed=lambda texts: None, enabled=True)
+        cache.add("a", "standard", (90, "good"))
+        self.assertIsNone(cache.lookup("a", "standard"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from llm_backend import LLMBackend, StandInBackend, StandInError, RecordReplayBackend, detect_prompt_family
+from utils import PROBLEM_PROMPT_FUNC, JUDGE_ANSWER_PROMPT, JUDGE_BLANK_ANSWERS_PROMPT, check_problem_format, jsonfy_response
+from user_profile import get_user_profile_prompt
+from arxiv import get_recommendation_prompt
+
+ARTICLE = (
+    "We introduce a retrieval augmented transformer for question answering. "
+    "The retriever selects passages from a large corpus with dense embeddings. "
+    "Experiments on several benchmarks show that retrieval improves the accuracy of the generator."
+)
+
+
+def paper_info(paper_id: str) -> dict[str, str]:
+    return {'id': paper_id, 'title': f"paper {paper_id}", 'date': "2024-01-01", 'abstract': ARTICLE}
+
+
+class Test_LLM_Backend(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = StandInBackend(latency_scale=0)
+
+    def test_detect_prompt_family(self):
+        for problem_type, prompt_func in PROBLEM_PROMPT_FUNC.items():
+            self.assertEqual(detect_prompt_family(prompt_func(ARTICLE, 3)), problem_type)
+        self.assertEqual(detect_prompt_family(JUDGE_ANSWER_PROMPT("a", "b", ARTICLE)), 'judge')
+        self.assertEqual(detect_prompt_family(JUDGE_BLANK_ANSWERS_PROMPT([("a", "b"), ("c", "d")])), 'judge_blank')
+        self.assertEqual(detect_prompt_family(get_user_profile_prompt([("title", ARTICLE)])), 'profile')
+        self.assertEqual(detect_prompt_family(get_recommendation_prompt([paper_info("1")], ["nlp"], "description", 1)), 'recommendation')
+
+    def test_problem_responses(self):
+        for problem_type, prompt_func in PROBLEM_PROMPT_FUNC.items():
+            response = self.backend.chat(prompt_func(ARTICLE, 3))
+            problems = check_problem_format(response, problem_type)
+            if problem_type in ['choice', 'tf', 'blank']:
+                self.assertEqual(len(problems), 3)
+
+    def test_other_responses(self):
+        data = jsonfy_response(self.backend.chat(JUDGE_ANSWER_PROMPT("dense retrieval", "dense retrieval")))
+        self.assertEqual(data['评分'], 100)
+        data = jsonfy_response(self.backend.chat(JUDGE_BLANK_ANSWERS_PROMPT([("a", "b"), ("c", "c")])))
+        self.assertEqual([item['编号'] for item in data], [0, 1])
+        data = jsonfy_response(self.backend.chat(get_user_profile_prompt([("title", ARTICLE)])))
+        self.assertIsInstance(data['领域'], list)
+        self.assertIsInstance(data['描述'], str)
+        prompt = get_recommendation_prompt([paper_info(str(i)) for i in range(5)], ["nlp"], "description", 2)
+        data = jsonfy_response(self.backend.chat(prompt))
+        self.assertEqual(len(data), 2)
+        self.assertTrue(all(item['paper_id'] in [str(i) for i in range(5)] for item in data))
+
+    def test_deterministic(self):
+        prompt = PROBLEM_PROMPT_FUNC['choice'](ARTICLE, 3)
+        self.assertEqual(self.backend.chat(prompt), StandInBackend(latency_scale=0).chat(prompt))
+
+    def test_failure_injection(self):
+        with self.assertRaises(StandInError):
+            StandInBackend(latency_scale=0, error_rate=1.0).chat("hello")
+        backend = StandInBackend(latency_scale=0, malformed_rate=1.0)
+        for _ in range(5):
+            # the complete questions of the malformed response are salvaged
+            self.assertGreater(len(check_problem_format(backend.chat(PROBLEM_PROMPT_FUNC['tf'](ARTICLE, 3)), 'tf')), 0)
+
+    def test_record_replay(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            record_file = os.path.join(temp_dir, "record.jsonl")
+            recorder = RecordReplayBackend(record_file, backend=self.backend)
+            prompt = PROBLEM_PROMPT_FUNC['blank'](ARTICLE, 2)
+            response = recorder.chat(prompt)
+            player = RecordReplayBackend(record_file, replay_latency=False)
+            self.assertEqual(player.chat(prompt), response)
+            with self.assertRaises(LookupError):
+                player.chat("not recorded")
+
+    def test_incomplete_backend(self):
+        class Incomplete_Backend(LLMBackend):
+            pass
+        with self.assertRaises(TypeError):
+            Incomplete_Backend()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import llm_batch
+import utils
+from llm_backend import StandInBackend
+from llm_batch import BatchEndpoint, BatchExecutor, StandInBatchEndpoint, BatchItemError
+from llm_scheduler import llm_context, BACKGROUND, INTERACTIVE, submit_in_context
+
+PROMPTS = [f"Summarize the paper {i}. {{'总结': **}}" for i in range(5)]
+
+
+class Test_LLM_Batch(unittest.TestCase):
+
+    def setUp(self):
+        self.batch_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.batch_dir.cleanup()
+
+    def create_executor(self, backend: StandInBackend | None = None, max_size: int = 100) -> tuple[BatchExecutor, StandInBatchEndpoint]:
+        endpoint = StandInBatchEndpoint(backend=backend, latency="constant:20", latency_scale=1)
+        executor = BatchExecutor(endpoint, batch_dir=self.batch_dir.name, max_size=max_size, max_delay=0.05, poll_interval=0.01, max_wait=10)
+        return executor, endpoint
+
+    def test_fan_out(self):
+        executor, endpoint = self.create_executor()
+        with ThreadPoolExecutor(max_workers=len(PROMPTS)) as pool:
+            responses = list(pool.map(executor.chat, PROMPTS))
+        backend = StandInBackend(latency_scale=0)
+        self.assertEqual(responses, [backend.chat(prompt) for prompt in PROMPTS])
+        # the prompts are sent in one job and the job files are removed
+        self.assertEqual(next(endpoint.job_ids), 1)
+        self.assertEqual(os.listdir(self.batch_dir.name), [])
+
+    def test_max_size(self):
+        executor, endpoint = self.create_executor(max_size=2)
+        futures = [executor.submit(prompt) for prompt in PROMPTS]
+        self.assertEqual(len([future.result(timeout=10) for future in futures]), len(PROMPTS))
+        self.assertEqual(next(endpoint.job_ids), 3)
+
+    def test_failed_items(self):
+        executor, _ = self.create_executor(backend=StandInBackend(latency_scale=0, error_rate=1.0))
+        with self.assertRaises(BatchItemError):
+            executor.chat(PROMPTS[0])
+
+    def test_routing(self):
+        executor, endpoint = self.create_executor()
+        with mock.patch.object(llm_batch, "USE_LLM_BATCH", True), mock.patch.object(utils, "BATCH_EXECUTOR", executor), \
+                mock.patch.object(utils, "get_backend", return_value=StandInBackend(latency_scale=0)):
+            with llm_context(INTERACTIVE):
+                utils._call_llm(PROMPTS[0])
+            # the background calls in the threads of a pool are batched as well
+            with llm_context(BACKGROUND), ThreadPoolExecutor() as pool:
+                futures = [submit_in_context(pool, utils._call_llm, prompt) for prompt in PROMPTS]
+                self.assertEqual(len([future.result() for future in futures]), len(PROMPTS))
+            # only the background calls are sent in a job
+            self.assertEqual(next(endpoint.job_ids), 1)
+
+    def test_incomplete_endpoint(self):
+        class Incomplete_Endpoint(BatchEndpoint):
+            def submit(self, input_file: str) -> str:
+                return "job"
+        with self.assertRaises(TypeError):
+            Incomplete_Endpoint()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+from llm_scheduler import LLMScheduler, LLMRejected, llm_context, submit_in_context, LLM_PRIORITY, LLM_USER, \
+    INTERACTIVE, GENERATION, BACKGROUND
+
+CLASS_CONCURRENCY = {INTERACTIVE: 1, GENERATION: 1, BACKGROUND: 1}
+QUEUE_LIMIT = {INTERACTIVE: 8, GENERATION: 8, BACKGROUND: 8}
+MAX_WAIT = {INTERACTIVE: 5, GENERATION: 5, BACKGROUND: 5}
+
+
+class Test_LLM_Scheduler(unittest.TestCase):
+
+    def create_scheduler(self, **kwargs) -> LLMScheduler:
+        return LLMScheduler(**{
+            'max_concurrency': 1,
+            'class_concurrency': CLASS_CONCURRENCY,
+            'queue_limit': QUEUE_LIMIT,
+            'max_wait': MAX_WAIT,
+            'tokens_per_minute': None,
+            **kwargs,
+        })
+
+    def run_waiting_calls(self, scheduler: LLMScheduler, calls: list[tuple[str, int, float]]) -> list[tuple[str, int]]:
+        """
+        queue the calls behind a running one in the given order
+        return:
+            the (priority, user id) of the calls in the order they got the slot
+        """
+        order = []
+        lock = Lock()
+
+        def call(priority: str, user_id: int, cost: float):
+            scheduler.acquire(priority, user_id, cost)
+            with lock:
+                order.append((priority, user_id))
+            scheduler.release(priority)
+
+        scheduler.acquire(GENERATION, 0, 1)
+        threads = []
+        for priority, user_id, cost in calls:
+            thread = Thread(target=call, args=(priority, user_id, cost))
+            thread.start()
+            threads.append(thread)
+            # wait until the call is queued, so that the calls are queued in order
+            while sum(map(len, scheduler.queues.values())) < len(threads):
+                time.sleep(0.001)
+        scheduler.release(GENERATION)
+        for thread in threads:
+            thread.join()
+        return order
+
+    def test_priority(self):
+        scheduler = self.create_scheduler()
+        order = self.run_waiting_calls(scheduler, [(BACKGROUND, 1, 1), (GENERATION, 1, 1), (INTERACTIVE, 1, 1)])
+        self.assertEqual([priority for priority, _ in order], [INTERACTIVE, GENERATION, BACKGROUND])
+
+    def test_fair_queuing(self):
+        scheduler = self.create_scheduler()
+        # user 1 queues four calls before user 2 queues one, user 2 is served after the first call of user 1
+        order = self.run_waiting_calls(scheduler, [(GENERATION, 1, 10)] * 4 + [(GENERATION, 2, 10)])
+        self.assertEqual([user_id for _, user_id in order], [1, 2, 1, 1, 1])
+
+    def test_class_concurrency(self):
+        scheduler = self.create_scheduler(max_concurrency=2, class_concurrency={INTERACTIVE: 2, GENERATION: 2, BACKGROUND: 1},
+                                          max_wait={INTERACTIVE: 5, GENERATION: 5, BACKGROUND: 0.05})
+        scheduler.acquire(BACKGROUND, 1, 1)
+        # the second background call can not take the slot left for the other classes
+        with self.assertRaises(LLMRejected):
+            scheduler.acquire(BACKGROUND, 1, 1)
+        scheduler.acquire(INTERACTIVE, 1, 1)
+        self.assertEqual(scheduler.stats()[BACKGROUND], {'running': 1, 'waiting': 0})
+
+    def test_queue_limit(self):
+        scheduler = self.create_scheduler(queue_limit={INTERACTIVE: 8, GENERATION: 8, BACKGROUND: 0})
+        scheduler.acquire(GENERATION, 1, 1)
+        start = time.monotonic()
+        with self.assertRaises(LLMRejected):
+            scheduler.acquire(BACKGROUND, 1, 1)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_token_quota(self):
+        scheduler = self.create_scheduler(max_concurrency=16, class_concurrency={INTERACTIVE: 16, GENERATION: 16, BACKGROUND: 16},
+                                          max_wait={INTERACTIVE: 5, GENERATION: 0.5, BACKGROUND: 5},
+                                          tokens_per_minute=60, token_burst=100)
+        scheduler.acquire(GENERATION, 1, 100)
+        # the bucket is empty, the next call waits for 1 token
+        scheduler.acquire(GENERATION, 1, 1)
+        # the debt of 1 token takes 1 second to pay, more than the max wait
+        with self.assertRaises(LLMRejected):
+            scheduler.acquire(GENERATION, 1, 1)
+        # the quota is per user and the grading is not limited
+        scheduler.acquire(GENERATION, 2, 1)
+        scheduler.acquire(INTERACTIVE, 1, 1000)
+
+    def test_context(self):
+        self.assertEqual(LLM_PRIORITY.get(), GENERATION)
+        with llm_context(INTERACTIVE, 3):
+            with ThreadPoolExecutor() as pool:
+                context = submit_in_context(pool, lambda: (LLM_PRIORITY.get(), LLM_USER.get())).result()
+        self.assertEqual(context, (INTERACTIVE, 3))
+        self.assertEqual((LLM_PRIORITY.get(), LLM_USER.get()), (GENERATION, None))
+        with self.assertRaises(ValueError):
+            with llm_context("urgent"):
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from basic_test import Basic_Tests
+from metrics import MetricsRegistry, span, SPAN_SECONDS, SPAN_ERRORS, LLM_TOKENS
+from llm_backend import StandInBackend
+from utils import PROBLEM_PROMPT_FUNC
+
+ARTICLE = "We introduce a retrieval augmented transformer for question answering."
+
+
+class Test_Metrics(unittest.TestCase):
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("test_total", "A counter", ("kind",))
+        histogram = registry.histogram("test_seconds", "A histogram", ("stage",), buckets=(0.1, 1))
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        counter.inc(kind='b"c')
+        for value in [0.05, 0.5, 0.5, 5]:
+            histogram.observe(value, stage='x')
+        text = registry.render()
+        self.assertIn("# TYPE test_total counter", text)
+        self.assertIn('test_total{kind="a"} 3', text)
+        self.assertIn('test_total{kind="b\\"c"} 1', text)
+        # the buckets are cumulative
+        self.assertIn('test_seconds_bucket{stage="x",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{stage="x",le="1"} 3', text)
+        self.assertIn('test_seconds_bucket{stage="x",le="+Inf"} 4', text)
+        self.assertIn('test_seconds_sum{stage="x"} 6.05', text)
+        self.assertIn('test_seconds_count{stage="x"} 4', text)
+        with self.assertRaises(ValueError):
+            counter.inc(stage='a')
+        with self.assertRaises(ValueError):
+            registry.counter("test_total", "A counter")
+
+    def test_span(self):
+        count = SPAN_SECONDS.count(span='test_span')
+        with span('test_span'):
+            pass
+        with self.assertRaises(KeyError):
+            with span('test_span'):
+                raise KeyError()
+        self.assertEqual(SPAN_SECONDS.count(span='test_span'), count + 2)
+        self.assertEqual(SPAN_ERRORS.get(span='test_span'), 1)
+
+    def test_stand_in_tokens(self):
+        tokens = LLM_TOKENS.get(prompt_type='tf', kind='prompt')
+        StandInBackend(latency_scale=0, malformed_rate=0).chat(PROBLEM_PROMPT_FUNC['tf'](ARTICLE, 3))
+        self.assertGreater(LLM_TOKENS.get(prompt_type='tf', kind='prompt'), tokens)
+
+
+class Test_Metrics_Endpoint(Basic_Tests):
+
+    def test_metrics(self):
+        self.register()
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        self.assertIn('readhub_http_request_seconds_count{endpoint="/register",method="POST",status="200"}', text)
+        self.assertIn('readhub_span_seconds_count{span="db_commit"}', text)
+        self.assertIn("readhub_model_memory_bytes", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from sqlalchemy import text
+from basic_test import Basic_Tests
+from models import db, add_missing_columns, Exam, Document, DocumentStatus, Chunk, Question, QuestionType, User
+
+
+class Test_Models(Basic_Tests):
+
+    def test_add_missing_columns(self):
+        with self.app.app_context():
+            # the exam table of a database created before the is_complete column
+            db.session.execute(text("DROP TABLE exam"))
+            db.session.execute(text("CREATE TABLE exam (id INTEGER PRIMARY KEY, document_id INTEGER NOT NULL, created_time DATETIME)"))
+            db.session.execute(text("INSERT INTO exam (id, document_id) VALUES (1, 1)"))
+            db.session.commit()
+            self.assertEqual(add_missing_columns(), ["exam.is_complete"])
+            self.assertTrue(db.session.get(Exam, 1).is_complete)
+            self.assertEqual(add_missing_columns(), [])
+
+    def test_documents_before_ingestion_pipeline(self):
+        with self.app.app_context():
+            # the document table of a database created before the ingestion pipeline
+            db.session.execute(text("ALTER TABLE document DROP COLUMN status"))
+            db.session.execute(text("ALTER TABLE document DROP COLUMN ingestion_error"))
+            db.session.execute(text("INSERT INTO document (id, title, base_dir, user_id) VALUES (1, 'paper', 'unused', 1)"))
+            db.session.commit()
+            self.assertEqual(add_missing_columns(), ["document.status", "document.ingestion_error"])
+            document = db.session.get(Document, 1)
+            # the documents created before the pipeline are ready and not resumed
+            self.assertEqual((document.status, document.ingestion_error), (DocumentStatus.READY, None))
+            self.assertEqual(Document.query.filter(Document.status.notin_([DocumentStatus.READY, DocumentStatus.FAILED])).count(), 0)
+
+    def test_bulk_create(self):
+        with self.app.app_context():
+            document = Document(user=User.query.filter_by(username='default').first(), base_dir="unused", title="paper")
+            exam = Exam(document=document)
+            db.session.add(exam)
+            db.session.flush()
+            chunk_path_list = [f"unused/{i}.txt" for i in [3, 0, 2, 1]]
+            chunk_id_list = Chunk.bulk_create(document.id, chunk_path_list)
+            self.assertEqual(Chunk.bulk_create(document.id, []), [])
+            # the returned ids are in the order of the chunk paths
+            self.assertEqual([db.session.get(Chunk, chunk_id).file_path for chunk_id in chunk_id_list], chunk_path_list)
+            # the question of the document summary has no chunk
+            question_chunk_id_list = [chunk_id_list[2], None, chunk_id_list[0]]
+            Question.bulk_create(exam.id, document.id, [
+                {'question_type': QuestionType.FILL_IN_THE_BLANK, 'question_content': f"question {i}", 'standard_answer': f"answer {i}"}
+                for i in range(len(question_chunk_id_list))
+            ], question_chunk_id_list)
+            db.session.commit()
+            questions = Question.query.filter_by(exam_id=exam.id).order_by(Question.id).all()
+            self.assertEqual([(question.question_content, question.chunk_id) for question in questions],
+                             [(f"question {i}", chunk_id) for i, chunk_id in enumerate(question_chunk_id_list)])
+            self.assertTrue(all(question.document_id == document.id for question in questions))
+
+
+if __name__ == "__main__":
+    unittest.main()
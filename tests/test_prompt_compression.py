@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+import utils
+from prompt_compression import PromptCompressor, split_sentences
+
+TOPIC = [
+    "The retriever selects passages from a large corpus with dense embeddings.",
+    "Dense retrieval of passages improves the accuracy of the answer generator.",
+    "The generator reads the retrieved passages and writes the answer.",
+    "Retrieval with dense embeddings is faster than the sparse retrieval of passages.",
+]
+NOISE = "Our lab thanks the funding agency for the support of this project."
+
+
+class Test_Prompt_Compression(unittest.TestCase):
+
+    def test_split_sentences(self):
+        text = "Section 3\nThe model is fast. It uses 3.5 GB! 模型很快。最后一句"
+        self.assertEqual([text[start:end] for start, end in split_sentences(text)],
+                         ["Section 3", "The model is fast.", "It uses 3.5 GB!", "模型很快。", "最后一句"])
+
+    def test_short_text(self):
+        compressor = PromptCompressor(base_words=100, words_per_question=10)
+        self.assertEqual(compressor.compress(" ".join(TOPIC), 1), " ".join(TOPIC))
+
+    def test_salient_and_diverse(self):
+        compressor = PromptCompressor(base_words=20, words_per_question=5, diversity=0.3)
+        text = " ".join(TOPIC[:2] + [TOPIC[0], NOISE] + TOPIC[2:])
+        compressed = compressor.compress(text, 1)
+        self.assertLessEqual(len(compressed.split()), 25)
+        self.assertNotIn(NOISE, compressed)
+        # the duplicated sentence is picked once
+        self.assertEqual(compressed.count(TOPIC[0]), 1)
+        # the sentences keep their order in the text
+        kept = [sentence for sentence in TOPIC if sentence in compressed]
+        self.assertEqual(kept, sorted(kept, key=text.index))
+
+    def test_cache(self):
+        compressor = PromptCompressor(base_words=10, words_per_question=5, cache_size=1)
+        text = " ".join(TOPIC)
+        self.assertEqual(compressor.compress(text, 1), compressor.compress(text, 1))
+        compressor.compress(text, 2)
+        self.assertEqual(len(compressor.cache), 1)
+
+    def test_problem_prompt(self):
+        prompts = []
+
+        def call_llm(prompt):
+            prompts.append(prompt)
+            if "'总结'" in prompt:
+                return '{"总结": "The retriever selects passages."}'
+            return '[{"问题": "The retriever selects passages.", "答案": "正确"}]'
+
+        compressor = PromptCompressor(base_words=20, words_per_question=5)
+        text = " ".join(TOPIC * 5)
+        with mock.patch.object(utils, "_call_llm", side_effect=call_llm), mock.patch.object(utils, "USE_HEDGING", False), \
+                mock.patch.object(utils, "PROMPT_COMPRESSOR", compressor), mock.patch.object(utils, "USE_PROMPT_COMPRESSION", True):
+            utils.get_problems(text, "tf", 1)
+            utils.get_problems(text, "sum", 1)
+        self.assertEqual(len(prompts), 2)
+        self.assertLessEqual(len(prompts[0].split("\n\n以上是", 1)[0].split()), 25)
+        # the summary prompts are not compressed
+        self.assertIn(text, prompts[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
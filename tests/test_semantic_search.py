@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+from basic_test import Basic_Tests
+from models import db, Document, Chunk, User, DocumentStatus
+from semantic_search import LibraryIndex, CHUNK_ID
+
+
+class Fake_Service:
+    """
+    one-hot embeddings of the first word of the texts, the encoding of the texts with a blocked word waits for release
+    """
+    available = True
+
+    def __init__(self, blocked_word: str):
+        self.blocked_word = blocked_word
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def encode_cached(self, texts: list[str]) -> np.ndarray:
+        if any(text.startswith(self.blocked_word) for text in texts):
+            self.started.set()
+            assert self.release.wait(timeout=10)
+        embeddings = np.zeros((len(texts), 8), dtype=np.float32)
+        for i, text in enumerate(texts):
+            embeddings[i, hash(text.split()[0]) % 8] = 1
+        return embeddings
+
+    encode = encode_cached
+
+
+class Test_Semantic_Search(Basic_Tests):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super().tearDown()
+        if hasattr(self, 'temp_dir'):
+            shutil.rmtree(self.temp_dir)
+
+    def create_document(self, username: str, chunk_text_list: list[str]) -> tuple[int, int, list[int]]:
+        """
+        return:
+            the user id, the document id and the chunk ids
+        """
+        with self.app.app_context():
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                user = User(username=username)
+                db.session.add(user)
+            document = Document(user=user, base_dir=self.temp_dir, title=username, status=DocumentStatus.READY)
+            db.session.add(document)
+            db.session.flush()
+            chunk_path_list = []
+            for chunk_text in chunk_text_list:
+                chunk_path_list.append(os.path.join(self.temp_dir, f"{len(os.listdir(self.temp_dir))}.txt"))
+                with open(chunk_path_list[-1], "w", encoding='utf-8') as f:
+                    f.write(chunk_text)
+            chunk_id_list = Chunk.bulk_create(document.id, chunk_path_list)
+            db.session.commit()
+            return user.id, document.id, chunk_id_list
+
+    def test_build_does_not_block_other_users(self):
+        service = Fake_Service("slow")
+        library_index = LibraryIndex(service)
+        slow_user_id, slow_document_id, slow_chunk_id_list = self.create_document('default', ["slow transformer", "slow attention"])
+        fast_user_id, _, _ = self.create_document('fast', ["fast convolution"])
+
+        def build():
+            with self.app.app_context():
+                library_index.get_user_index(slow_user_id)
+
+        thread = threading.Thread(target=build)
+        thread.start()
+        self.assertTrue(service.started.wait(timeout=10))
+        # the other users search and the ingestion indexes while the slow user's index is being built
+        with self.app.app_context():
+            self.assertEqual(len(library_index.search(fast_user_id, "fast", 1)), 1)
+        self.assertTrue(library_index.index_chunks(slow_user_id, [1000], [slow_document_id], ["new chunk"]))
+        # a chunk of the query indexed again by the ingestion is not added twice
+        self.assertTrue(library_index.index_chunks(slow_user_id, [slow_chunk_id_list[0]], [slow_document_id], ["again chunk"]))
+        service.release.set()
+        thread.join(timeout=10)
+        with self.app.app_context():
+            index = library_index.get_user_index(slow_user_id)
+        chunk_ids = index.payloads[:index.size, CHUNK_ID].tolist()
+        self.assertEqual(sorted(chunk_ids), sorted(slow_chunk_id_list + [1000]))
+        self.assertEqual(library_index.builds, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
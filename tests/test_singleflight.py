@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from singleflight import SingleFlight
+from utils import atomic_write
+
+
+class Test_SingleFlight(unittest.TestCase):
+
+    def test_coalesce(self):
+        flight = SingleFlight("test")
+        lock = Lock()
+        calls = []
+        started = Event()
+
+        def work(key: str) -> str:
+            with lock:
+                calls.append(key)
+            started.set()
+            time.sleep(0.2)
+            return f"result of {key}"
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            leader = pool.submit(flight.do, "a", work, "a")
+            started.wait()
+            followers = [pool.submit(flight.do, "a", work, "a") for _ in range(6)]
+            other = pool.submit(flight.do, "b", work, "b")
+            results = [future.result() for future in [leader] + followers]
+            self.assertEqual(other.result(), "result of b")
+        self.assertEqual(results, ["result of a"] * 7)
+        self.assertEqual(sorted(calls), ["a", "b"])
+        # the key is forgotten after the call
+        self.assertFalse(flight.in_flight("a"))
+        flight.do("a", work, "a")
+        self.assertEqual(calls.count("a"), 2)
+
+    def test_error(self):
+        flight = SingleFlight("test")
+        started = Event()
+
+        def work():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("failed")
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(flight.do, "a", work)
+            started.wait()
+            follower = pool.submit(flight.do, "a", work)
+            for future in [leader, follower]:
+                with self.assertRaises(ValueError):
+                    future.result()
+        self.assertFalse(flight.in_flight("a"))
+
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "cache", "data.json")
+            atomic_write(path, lambda f: json.dump({'a': 1}, f))
+            with open(path, "r") as f:
+                self.assertEqual(json.load(f), {'a': 1})
+
+            def failed_write(f):
+                f.write("{'a'")
+                raise RuntimeError("crashed")
+            with self.assertRaises(RuntimeError):
+                atomic_write(path, failed_write)
+            # the old content is kept and the temporary file is removed
+            with open(path, "r") as f:
+                self.assertEqual(json.load(f), {'a': 1})
+            self.assertEqual(os.listdir(os.path.dirname(path)), ["data.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
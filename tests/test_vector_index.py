@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+from vector_index import VectorIndex, top_k_indices
+from semantic_search import split_passages
+
+
+def random_embeddings(number: int, dim: int, seed: int = 0) -> np.ndarray:
+    embeddings = np.random.default_rng(seed).standard_normal((number, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class Test_Vector_Index(unittest.TestCase):
+
+    def test_top_k_indices(self):
+        scores = np.array([0.1, 0.9, 0.5, 0.7])
+        self.assertEqual(top_k_indices(scores, 2).tolist(), [1, 3])
+        self.assertEqual(top_k_indices(scores, 10).tolist(), [1, 3, 2, 0])
+
+    def test_brute_force(self):
+        embeddings = random_embeddings(3000, 32)
+        index = VectorIndex(32, payload_width=2, ivf_min_size=None)
+        index.add(embeddings, np.stack([np.arange(3000), np.arange(3000) // 10], axis=1))
+        payloads, scores = index.search(embeddings[42], 5)
+        self.assertEqual(payloads[0].tolist(), [42, 4])
+        self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+        index.remove(1, [4])
+        payloads, _ = index.search(embeddings[42], 5)
+        self.assertNotIn(4, payloads[:, 1].tolist())
+        self.assertEqual(len(index), 2990)
+
+    def test_ivf_recall(self):
+        # clustered embeddings, like the passages of the same paper
+        rng = np.random.default_rng(1)
+        centers = random_embeddings(50, 32, seed=2)
+        embeddings = centers[rng.integers(0, 50, 5000)] + 0.3 * random_embeddings(5000, 32, seed=3)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        brute_force = VectorIndex(32, ivf_min_size=None)
+        ivf = VectorIndex(32, ivf_min_size=1000, nprobe=8)
+        for begin in range(0, 5000, 500):
+            brute_force.add(embeddings[begin: begin + 500], np.arange(begin, begin + 500))
+            ivf.add(embeddings[begin: begin + 500], np.arange(begin, begin + 500))
+        self.assertTrue(ivf.is_ivf)
+        queries = random_embeddings(50, 32, seed=4)
+        recall = np.mean([
+            len(set(brute_force.search(query, 10)[0][:, 0].tolist()) & set(ivf.search(query, 10)[0][:, 0].tolist())) / 10
+            for query in queries
+        ])
+        self.assertGreater(recall, 0.9)
+
+    def test_split_passages(self):
+        text = "a b c\nd e  f g"
+        passages = split_passages(text, max_words=3)
+        self.assertEqual([text[start:end] for start, end in passages], ["a b c", "d e  f", "g"])
+        self.assertEqual(split_passages("  "), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,25 +1,32 @@
-from collections import defaultdict
 import pickle
 from llmsherpa.readers import LayoutPDFReader, Document
-from zhipuai import ZhipuAI
 import os
 import json
 from pathlib import Path
 import random
+import tempfile
 import time
-from concurrent.futures import ThreadPoolExecutor
-from constants import BAD_REVIEWS, GOOD_REVIEWS, PASSED_SCORE, MAX_ARTICLE_WORDS, MAX_PROBLEM_GEN_TRIES, PROBLEM_NUM_PER_TYPE, DOCUMENT_DIR_PREFIX, USE_CACHE, CACHE_FILE_DICT
-from threading import Semaphore
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from threading import Lock, Thread
+from typing import IO, Callable
+from constants import BAD_REVIEWS, GOOD_REVIEWS, PASSED_SCORE, MAX_ARTICLE_WORDS, MAX_PROBLEM_GEN_TRIES, PROBLEM_NUM_PER_TYPE, DOCUMENT_DIR_PREFIX, USE_CACHE, CACHE_FILE_DICT, MAX_JUDGE_WORKERS, PACK_BLANK_JUDGE, MAX_BLANK_JUDGE_PACK_SIZE, LLMSERPA_API_URL, USE_HEDGING, USE_FUSED_PROBLEM_PROMPT, USE_PROMPT_COMPRESSION
+from judge_cache import JUDGEMENT_CACHE
+from llm_backend import get_backend, detect_prompt_family, prompt_hash
+from metrics import span, timed, llm_span, LLM_RETRIES, LLM_INVALID_RESPONSES
+from llm_scheduler import LLM_SCHEDULER, LLMRejected, submit_in_context
+from singleflight import SingleFlight
+from hedging import HEDGER
+from json_salvage import parse_llm_json
+from llm_batch import BATCH_EXECUTOR, use_batch
+from prompt_compression import PROMPT_COMPRESSOR
 
 
 # Global variables
-API_KEY = os.environ.get("API_KEY")
-assert API_KEY is not None, "You must export the variable API_KEY in your os environment"
-CLIENT = ZhipuAI(api_key=API_KEY)
-
-LLMSERPA_API_URL = "https://readers.llmsherpa.com/api/document/developer/parseDocument?renderFormat=all"
-
-SEMAPHORE = Semaphore(16)
+# the identical prompts sent at the same time are answered by one LLM call
+PROMPT_FLIGHT = SingleFlight("prompt")
+# the read-modify-write of the response cache files
+CACHE_LOCK = Lock()
 
 
 def PROBLEM_CHOICE_PROMPT(text, num):
@@ -42,6 +49,20 @@ def PROBLEM_REVIEW_PROMPT(text, num):
     return f"{text.strip()}\n\n" + "以上是一篇arxiv论文的简要总结，你是一位该领域的审稿人，请你指出该论文的优点和缺点。注意，在分析缺点时，由于只给出了总结，你应该考虑总结中内容的缺点，而不要考虑总结中缺失或者未详细说明的内容。你的回复格式应该【严格采用json格式】，不要有多余的字眼：\
 \n{'优点': [**, **, ...], '缺点': [**, **, ...]}"
 
+# problem type -> (the key of its section in the fused response, the requirement, the format)
+FUSED_PROBLEM_SECTIONS = {
+    'choice': ("选择题", "四选一选择题", "[{'问题': **, 'A': *, 'B': *, 'C': *, 'D': *, '正确答案': *}, ...]"),
+    'tf': ("判断题", "判断题（答案用正确/错误表示，问题应该是一个【陈述句】）", "[{'问题': **, '答案': *}, ...]"),
+    'blank': ("填空题", "填空题（其中每一道题只能有一个空，用下划线表示，问题的【答案长度不超过20】）", "[{'问题': **, '答案': *}, ...]"),
+}
+
+def PROBLEM_FUSED_PROMPT(text, nums: dict[str, int]):
+    # 一次请求多种题型，nums: problem type -> 题目数量
+    requirements = "、".join(f"{num}道{FUSED_PROBLEM_SECTIONS[problem_type][1]}" for problem_type, num in nums.items())
+    sections = ", ".join(f"'{FUSED_PROBLEM_SECTIONS[problem_type][0]}': {FUSED_PROBLEM_SECTIONS[problem_type][2]}" for problem_type in nums)
+    return f"{text.strip()}\n\n" + "以上是一篇arxiv论文，你是一位博士生导师，请向你的博士生提出以下题目：" + requirements + "，考察他对论文的掌握程度，并给出答案。考察对论文宏观的理解把握，不要考察能简单根据图表回答的问题。你的问题应该有足够的多样性。你的问题格式应该【严格采用json格式】，按题型分组，不要有多余的字眼：\
+\n{" + sections + "}"
+
 REVIEW_QUESTION = "在通读文章后，请你指出该论文的优点和缺点。"
 
 def JUDGE_ANSWER_PROMPT(user_answer: str, standard_answer: str, prior_knowledge: str=None):
@@ -49,6 +70,15 @@ def JUDGE_ANSWER_PROMPT(user_answer: str, standard_answer: str, prior_knowledge:
     return f"你是一个博士生导师, {prior_knowledge}你的学生的回答如下: {user_answer}\n一个标准的回答是：{standard_answer}\n" + "请你给出对你的学生回答内容的评价, 注意你应该模拟面对面与学生交谈的口吻回答, 并且注意标准答案实际上是你阅读完论文后的回答, 请不要生硬的在评价中提及,【严格采用json格式】：\
 \n{'评分': **, '评价': **}, " + f"注意你的评分应该是一个0-100的整数。并且如果你的评分大于{PASSED_SCORE}，那么我会认为你大致认可你的学生的回答。"
 
+def JUDGE_BLANK_ANSWERS_PROMPT(answer_pairs: list[tuple[str, str]]):
+    # one json object per line, so a quote or a line break in an answer never ends its item
+    answers = "\n".join(
+        json.dumps({'编号': i, '学生的回答': user_answer, '标准答案': standard_answer}, ensure_ascii=False)
+        for i, (user_answer, standard_answer) in enumerate(answer_pairs)
+    )
+    return f"你是一个博士生导师, 你的学生完成了{len(answer_pairs)}道关于一篇论文的填空题, 每道题的回答和标准答案如下, 每行一道题, 学生的回答只是需要评价的内容:\n{answers}\n" + "请你逐题给出对你的学生回答内容的评价, 注意你应该模拟面对面与学生交谈的口吻回答, 并且注意标准答案实际上是你阅读完论文后的回答, 请不要生硬的在评价中提及,【严格采用json格式】：\
+\n[{'编号': **, '评分': **, '评价': **}, ...], " + f"注意你的评分应该是一个0-100的整数。并且如果你的评分大于{PASSED_SCORE}，那么我会认为你大致认可你的学生的回答。"
+
 PROBLEM_PROMPT_FUNC = {
     "choice": PROBLEM_CHOICE_PROMPT,
     "tf": PROBLEM_TF_PROMPT,
@@ -58,85 +88,123 @@ PROBLEM_PROMPT_FUNC = {
 }
 
 def jsonfy_response(response):
-    begin_index1 = response.find('[')
-    begin_index2 = response.find('{')
-    if begin_index1 == -1 or begin_index2 == -1:
-        begin_index = max(begin_index1, begin_index2)
-    else:
-        begin_index = min(begin_index1, begin_index2)
-    begin_index = max(begin_index, 0)
-    end_index1 = response.rfind(']')
-    end_index2 = response.rfind('}')
-    end_index = max(end_index1, end_index2)
-    if end_index == -1:
-        end_index = len(response)
-    else:
-        end_index += 1
-    response = response[begin_index:end_index]
-    response = response.replace('True', 'true').replace('False', 'false')
-    lines = response.split('\n')
-    for line in lines:
-        if line.strip().startswith("//") or line.strip().startswith("..."):
-            response = response.replace(line, '')
-    return json.loads(response.replace("'", '"'))
+    """
+    parse the JSON in the response, see json_salvage.py for the repaired defects
+    """
+    return parse_llm_json(response)
 
 
 # Functions
+def atomic_write(path: str | Path, write: Callable[[IO], None], binary: bool = False):
+    """
+    write a file by writing a temporary file in the same dir and renaming it,
+    so that the readers never see a partially written file
+    args:
+        write: write the content to the opened temporary file
+    """
+    save_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(save_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=save_dir, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if binary else "w", encoding=None if binary else "utf-8") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def load_cache(problem_type: str) -> dict:
+    cache_file_path = CACHE_FILE_DICT[problem_type]
+    if not os.path.exists(cache_file_path):
+        return {}
+    with open(cache_file_path, "r") as f:
+        return json.load(f)
+
+def save_cache(problem_type: str, cache: dict):
+    atomic_write(CACHE_FILE_DICT[problem_type], lambda f: json.dump(cache, f))
+
+def _call_llm(prompt: str):
+    if use_batch():
+        # the background calls wait for a batch job instead of a slot of the scheduler
+        return BATCH_EXECUTOR.chat(prompt)
+    with LLM_SCHEDULER.slot(prompt):
+        prompt_type = detect_prompt_family(prompt)
+        with llm_span(prompt_type):
+            if not USE_HEDGING:
+                return get_backend().chat(prompt)
+            # the slow call is hedged in its slot, the hedge is not admitted again
+            return HEDGER.call(prompt_type, partial(get_backend().chat, prompt))
+
 def _get_response(prompt: str):
-    with SEMAPHORE:
-        response = CLIENT.chat.completions.create(
-            model="glm-4",
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
-        )
-        return response.choices[0].message.content
+    return PROMPT_FLIGHT.do(prompt_hash(prompt), _call_llm, prompt)
 
 def get_response(prompt: str, problem_type: str, use_cache=USE_CACHE):
     if not use_cache:
         return _get_response(prompt)
-    cache_file_path = CACHE_FILE_DICT[problem_type]
-    if not os.path.exists(cache_file_path):
-        cache = {}
-    else:
-        with open(cache_file_path, "r") as f:
-            cache = json.load(f)
+    cache = load_cache(problem_type)
     if prompt in cache:
         return cache[prompt]
-    else:
-        cache[prompt] = _get_response(prompt)
-        with open(cache_file_path, "w") as f:
-            json.dump(cache, f)
-        return cache[prompt]
+    response = _get_response(prompt)
+    # reload the cache, other prompts may be saved during the call
+    with CACHE_LOCK:
+        cache = load_cache(problem_type)
+        cache[prompt] = response
+        save_cache(problem_type, cache)
+    return response
+
+def get_checked_response(prompt: str, problem_type: str, check: Callable[[str], object], use_cache=USE_CACHE):
+    """
+    get the response and check it
+    args:
+        check: parse and check the response, raise if it is invalid
+    return:
+        the result of check
+    """
+    return check(get_response(prompt, problem_type, use_cache))
 
 def get_json_response_with_max_try(prompt: str, check_response=lambda x: True, max_try: int=MAX_PROBLEM_GEN_TRIES):
+    def check_json(response: str):
+        data = jsonfy_response(response)
+        if not check_response(data):
+            raise ValueError("Invalid response")
+        return data
+
+    prompt_type = detect_prompt_family(prompt)
     for i in range(max_try):
+        if i > 0:
+            LLM_RETRIES.inc(prompt_type=prompt_type)
         try:
-            response = get_response(prompt, 'judge', use_cache=(USE_CACHE and i == 0))
-            data = jsonfy_response(response)
-            if check_response(data):
-                return data
+            return get_checked_response(prompt, 'judge', check_json, use_cache=(USE_CACHE and i == 0))
+        except LLMRejected:
+            raise
         except:
-            continue
+            pass
+        LLM_INVALID_RESPONSES.inc(prompt_type=prompt_type)
     return None
 
-def update_cache(prompt, problem_type, update_content: list | str):
-    with open(CACHE_FILE_DICT[problem_type], "r") as f:
-        cache: dict = json.load(f)
-    if problem_type == "sum" or problem_type == "review":
-        if not isinstance(update_content, list) or len(update_content) != 1:
-            cache.pop(prompt)
-        else:
-            cache[prompt] = json.dumps(update_content[0])
-    elif problem_type == "choice" or problem_type == "tf" or problem_type == "blank":
-        if not isinstance(update_content, list):
-            cache.pop(prompt)
+def update_cache(prompt, problem_type, update_content: list | dict | str):
+    with CACHE_LOCK:
+        cache = load_cache(problem_type)
+        if problem_type == "sum" or problem_type == "review":
+            if not isinstance(update_content, list) or len(update_content) != 1:
+                cache.pop(prompt)
+            else:
+                cache[prompt] = json.dumps(update_content[0])
+        elif problem_type == "choice" or problem_type == "tf" or problem_type == "blank":
+            if not isinstance(update_content, list):
+                cache.pop(prompt)
+            else:
+                cache[prompt] = json.dumps(update_content)
+        elif problem_type == "fused":
+            if not isinstance(update_content, dict) or not any(update_content.values()):
+                cache.pop(prompt)
+            else:
+                cache[prompt] = json.dumps({FUSED_PROBLEM_SECTIONS[key][0]: value for key, value in update_content.items()})
         else:
-            cache[prompt] = json.dumps(update_content)
-    else:
-        cache[prompt] = update_content
-    with open(CACHE_FILE_DICT[problem_type], "w") as f:
-        json.dump(cache, f)
+            cache[prompt] = update_content
+        save_cache(problem_type, cache)
 
 def word_count(text):
     return len(text.split())
@@ -144,11 +212,13 @@ def word_count(text):
 def check_max_word(text: str) -> bool:
     return word_count(text) > MAX_ARTICLE_WORDS
 
+@timed("pdf_decode")
 def decode_pdf(pdf_url: str) -> Document:
     pdf_reader = LayoutPDFReader(LLMSERPA_API_URL)
     doc = pdf_reader.read_pdf(pdf_url)
     return doc
 
+@timed("chunking")
 def save_pdf_text_chunks(doc: Document, save_dir: str | Path) -> list[str]:
     """
     save the document text chunks to the save_dir
@@ -240,7 +310,11 @@ def _judge_answer(user_answer: str, standard_answer: str, prior_knowledge: str=N
     return int(float(response_dict['评分'])), response_dict['评价']
 
 def judge_answer(user_answer: str, standard_answer: str, prior_knowledge: str=None) -> tuple[int, str]:
+    judgement = JUDGEMENT_CACHE.lookup(user_answer, standard_answer)
+    if judgement is not None:
+        return judgement
     score, review = _judge_answer(user_answer, standard_answer, prior_knowledge)
+    JUDGEMENT_CACHE.add(user_answer, standard_answer, (score, review))
     # if score is None:
     #     score = calculate_similarity(user_answer, standard_answer) * 100
     #     score = int(score)
@@ -249,17 +323,101 @@ def judge_answer(user_answer: str, standard_answer: str, prior_knowledge: str=No
     
     return score, review
 
+def judge_blank_answers(answer_pairs: list[tuple[str, str]]) -> list[tuple[int, str]]:
+    """
+    judge several fill-in-the-blank answers with one LLM call, the answers missed in the response are judged one by one
+    args:
+        answer_pairs: list of (user_answer, standard_answer)
+    return:
+        list of (score, review) in the same order as answer_pairs
+    """
+    def check_response_judge_list(data) -> bool:
+        if not isinstance(data, list):
+            return False
+        for item in data:
+            if not isinstance(item, dict) or not ('编号' in item and '评分' in item and '评价' in item):
+                return False
+            try:
+                int(float(item['编号']))
+                int(float(item['评分']))
+            except:
+                return False
+        return True
+
+    judgements: list[tuple[int, str] | None] = [JUDGEMENT_CACHE.lookup(*answer_pair) for answer_pair in answer_pairs]
+    index_list = [i for i, judgement in enumerate(judgements) if judgement is None]
+    if len(index_list) > 1:
+        prompt = JUDGE_BLANK_ANSWERS_PROMPT([answer_pairs[i] for i in index_list])
+        response_list = get_json_response_with_max_try(prompt, check_response_judge_list)
+        for item in response_list or []:
+            index = int(float(item['编号']))
+            if 0 <= index < len(index_list) and isinstance(item['评价'], str):
+                judgement = (int(float(item['评分'])), item['评价'])
+                judgements[index_list[index]] = judgement
+                JUDGEMENT_CACHE.add(*answer_pairs[index_list[index]], judgement)
+    for i, judgement in enumerate(judgements):
+        if judgement is None:
+            judgements[i] = judge_answer(*answer_pairs[i])
+    return judgements
+
+def judge_answers(judge_items: list[tuple[str, str, str | None, str]], pack_blank: bool=PACK_BLANK_JUDGE) -> list[tuple[int, str]]:
+    """
+    judge a list of answers concurrently
+    args:
+        judge_items: list of (user_answer, standard_answer, prior_knowledge, question_type), question_type is blank or review
+        pack_blank: pack the fill-in-the-blank answers into judging prompts of at most MAX_BLANK_JUDGE_PACK_SIZE answers
+    return:
+        list of (score, review) in the same order as judge_items
+    """
+    judgements: list[tuple[int, str] | None] = [None] * len(judge_items)
+    blank_index_list = [i for i, item in enumerate(judge_items) if pack_blank and item[3] == "blank"]
+    index_groups = [[i] for i, item in enumerate(judge_items) if not (pack_blank and item[3] == "blank")]
+    for begin in range(0, len(blank_index_list), MAX_BLANK_JUDGE_PACK_SIZE):
+        index_groups.append(blank_index_list[begin: begin + MAX_BLANK_JUDGE_PACK_SIZE])
+    with ThreadPoolExecutor(max_workers=MAX_JUDGE_WORKERS) as pool:
+        futures = [
+            submit_in_context(pool, judge_blank_answers, [judge_items[i][:2] for i in index_list])
+            if pack_blank and judge_items[index_list[0]][3] == "blank" else
+            submit_in_context(pool, lambda item: [judge_answer(*item[:3])], judge_items[index_list[0]])
+            for index_list in index_groups
+        ]
+        for index_list, future in zip(index_groups, futures):
+            for i, judgement in zip(index_list, future.result()):
+                judgements[i] = judgement
+    return judgements
+
 def process_json(problem):
-    try:
-        return json.loads(problem.replace("'", '"').strip(), strict=False)
-    except:
-        problem = problem.replace("```json", '').replace("```", "").strip()
-        return json.loads(problem.replace("'", '"').strip(), strict=False)
+    return parse_llm_json(problem)
             
             
 def check_problem_format(problem, problem_type):
     try:
         data = process_json(problem)
+    except:
+        raise ValueError("Invalid json format")
+    return check_problem_data(data, problem_type)
+
+def check_fused_problem_format(problem, problem_types: list[str]) -> dict[str, list]:
+    # 分别检查每种题型的题目，缺失或格式错误的题型为空列表，所有题型都没有题目时抛出异常
+    try:
+        data = process_json(problem)
+    except:
+        raise ValueError("Invalid json format")
+    if not isinstance(data, dict):
+        raise ValueError("Invalid json format")
+    problems = {}
+    for problem_type in problem_types:
+        try:
+            problems[problem_type] = check_problem_data(data.get(FUSED_PROBLEM_SECTIONS[problem_type][0], []), problem_type)
+        except ValueError:
+            problems[problem_type] = []
+    if not any(problems.values()):
+        raise ValueError("Invalid json format")
+    return problems
+
+def check_problem_data(data, problem_type):
+    # 检查解码后的题目，返回格式正确的题目
+    try:
         formated_data = []
         if problem_type == "choice":
             for d in data:
@@ -307,8 +465,15 @@ def check_problem_format(problem, problem_type):
         # print(problem)
         raise ValueError("Invalid json format")
 
-def get_problems(text, problem_type, num):
+def past_deadline(deadline: float | None) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+def get_problems(text, problem_type, num, deadline: float | None = None):
     # 得到模型回复，并解码json, 如果失败重复到最大次数，这里保证返回的长度在0-num之间，且0的情况是重复了最大次数的
+    # deadline: time.monotonic()的截止时间，截止后不再重试，正在进行的请求仍然完成
+    if USE_PROMPT_COMPRESSION and problem_type in ["choice", "tf", "blank"]:
+        # 只保留与题目数量相称的关键句子
+        text = PROMPT_COMPRESSOR.compress(text, num)
     try:
         func = PROBLEM_PROMPT_FUNC[problem_type]
         prompt = func(text, num)
@@ -316,74 +481,109 @@ def get_problems(text, problem_type, num):
         raise ValueError("Invalid problem type")
     problems = []
     for i in range(MAX_PROBLEM_GEN_TRIES):
+        if i > 0 and past_deadline(deadline):
+            break
+        if i > 0:
+            LLM_RETRIES.inc(prompt_type=problem_type)
         try:
-            response = get_response(prompt, problem_type, use_cache=(USE_CACHE and i == 0))
-            problem_data = check_problem_format(response, problem_type)
+            problem_data = get_checked_response(
+                prompt, problem_type, lambda response: check_problem_format(response, problem_type), use_cache=(USE_CACHE and i == 0)
+            )
             if type(problem_data) == list:
                 problems.extend(problem_data)
             else:
                 problems.append(problem_data)
             if len(problems) >= num:
                 break
+        except LLMRejected:
+            raise
         except Exception as e:
-            continue
+            LLM_INVALID_RESPONSES.inc(prompt_type=problem_type)
     if USE_CACHE:
         update_cache(prompt, problem_type, problems)
     return problems[:num]
 
-def get_problem_for_each_article_per_type(chunks: list[str], problem_type: str, nums: int)-> tuple[tuple[list, list[int]], str]:
-    # 对于每个chunk分配问题，总共得到PROBLEM_NUM_PER_TYPE个问题，所以每个chunk得到PROBLEM_NUM_PER_TYPE/len(chunks)个问题。
-    # 如果PROBLEM_NUM_PER_TYPE不能整除len(chunks)，则最后一个chunk得到的问题数为PROBLEM_NUM_PER_TYPE%len(chunks) + PROBLEM_NUM_PER_TYPE//len(chunks)
-    # 如果PROBLEM_NUM_PER_TYPE < len(chunks)，则随机sample PROBLEM_NUM_PER_TYPE个chunk
+def get_fused_problems(text, nums: dict[str, int], deadline: float | None = None) -> dict[str, list]:
+    # 一次请求得到多种题型的题目，只对数量不足的题型重新请求，每种题型返回的长度在0-num之间，截止后不再重试
+    if USE_PROMPT_COMPRESSION:
+        # 重新请求缺失的题型时使用同样的压缩结果
+        text = PROMPT_COMPRESSOR.compress(text, sum(nums.values()))
+    problems = {problem_type: [] for problem_type in nums}
+    first_prompt = None
+    for i in range(MAX_PROBLEM_GEN_TRIES):
+        missing = {problem_type: num - len(problems[problem_type]) for problem_type, num in nums.items() if len(problems[problem_type]) < num}
+        if not missing or (i > 0 and past_deadline(deadline)):
+            break
+        if i > 0:
+            LLM_RETRIES.inc(prompt_type="fused")
+        prompt = PROBLEM_FUSED_PROMPT(text, missing)
+        first_prompt = first_prompt or prompt
+        try:
+            problem_data = get_checked_response(
+                prompt, "fused", lambda response: check_fused_problem_format(response, list(missing)), use_cache=(USE_CACHE and i == 0)
+            )
+            for problem_type, data in problem_data.items():
+                problems[problem_type].extend(data)
+        except LLMRejected:
+            raise
+        except Exception as e:
+            LLM_INVALID_RESPONSES.inc(prompt_type="fused")
+    if USE_CACHE:
+        update_cache(first_prompt, "fused", problems)
+    return {problem_type: problems[problem_type][:num] for problem_type, num in nums.items()}
+
+def allocate_problems(chunks: list[str], nums: int) -> list[tuple[int, str, int]]:
+    # 对于每个chunk分配问题，总共得到nums个问题，所以每个chunk得到nums/len(chunks)个问题。
+    # 如果nums不能整除len(chunks)，则第一个chunk得到的问题数为nums%len(chunks) + nums//len(chunks)
+    # 如果nums < len(chunks)，则随机sample nums个chunk
+    # 返回 (chunk_index, chunk, num) 的列表
     chunks = list(enumerate(chunks))
     if len(chunks) <= nums:
         chunks_sample = chunks
     else:
         chunks_sample = random.sample(chunks, nums)
-        
-    problems = []
-    chunk_index_list = []
+
+    allocation = []
     for i, (chunk_index, chunk) in enumerate(chunks_sample):
         num = nums // len(chunks_sample)
         if i == 0:
             num += nums % len(chunks_sample)
-        problems.extend(get_problems(chunk, problem_type, num))
-        chunk_index_list.extend([chunk_index] * num)
-    return (problems, chunk_index_list), problem_type
+        allocation.append((chunk_index, chunk, num))
+    return allocation
 
-def get_problems_for_article(chunks):
-    # problems = {
-    #     key : [] for key in ["choice", "tf", "blank"]
-    # }
-    question_type_list = ['choice', 'tf', 'blank']
-    problems: dict[str, list] = defaultdict(list)
-    start = time.time()
-    
-    threads = []
-    with ThreadPoolExecutor() as pool:
-        for key in question_type_list:
-            res = pool.submit(get_problem_for_each_article_per_type, *(chunks, key, PROBLEM_NUM_PER_TYPE))
-            threads.append(res)
-        summarization = ""
-        threads.append(pool.submit(get_problem_for_each_article_per_type, *(chunks, "sum", len(chunks))))
-    for thread in threads:
-        data, key = thread.result()
-        problems[key] = data if key != "sum" else data[0]
-        
-    # for key in problems:
-    #     problems[key] = get_problem_for_each_article_per_type(chunks, key, PROBLEM_NUM_PER_TYPE)[0]
-    
-    # summarization = ""
-    # problems['sum'], _ = get_problem_for_each_article_per_type(chunks, "sum", len(chunks))[0]
+def get_problem_for_each_article_per_type(chunks: list[str], problem_type: str, nums: int, deadline: float | None = None)-> tuple[tuple[list, list[int]], str]:
+    problems = []
+    chunk_index_list = []
+    for chunk_index, chunk, num in allocate_problems(chunks, nums):
+        chunk_problems = get_problems(chunk, problem_type, num, deadline)
+        problems.extend(chunk_problems)
+        chunk_index_list.extend([chunk_index] * len(chunk_problems))
+    return (problems, chunk_index_list), problem_type
 
-    print(f"time: {time.time() - start}")
-        
-    for data in problems["sum"]:
-        summarization += data["总结"]
+def get_review_problems(chunks: list[str], summaries: list[Future], deadline: float | None = None) -> list[dict]:
+    # 所有chunk的总结完成后立即生成review，不等待其他题目
+    summarization = ""
+    for summary in summaries:
+        for data in summary.result():
+            summarization += data["总结"]
     if not summarization:
         summarization = chunks[0]
-    problems["review"] = get_problems(summarization, "review", 1) # TODO: 如果模型说不出优缺点，这里处理不了
-    
+    return get_problems(summarization, "review", 1, deadline) # TODO: 如果模型说不出优缺点，这里处理不了
+
+def collect_questions(tasks: list[tuple[str, int, Future]]) -> tuple[list[dict], list[int]]:
+    # tasks: (题型或"fused"或"review", chunk_index, future)，等待并整理成题目
+    problems: dict[str, tuple[list, list[int]]] = {key: ([], []) for key in ["choice", "tf", "blank"]}
+    reviews = []
+    for key, chunk_index, task in tasks:
+        if key == "fused":
+            for problem_type, data in task.result().items():
+                problems[problem_type][0].extend(data)
+                problems[problem_type][1].extend([chunk_index] * len(data))
+        elif key == "review":
+            reviews.extend(task.result())
+        else:
+            problems[key] = task.result()[0]
+
     questions = []
     chunk_index_list = []
     # 按 choice, tf, blank, review的顺序排列
@@ -396,8 +596,8 @@ def get_problems_for_article(chunks):
                 "question_type": i
             })
             chunk_index_list.append(chunk_index)
-            
-    for data in problems["review"]:
+
+    for data in reviews:
         questions.append({
             "question_content": REVIEW_QUESTION,
             "standard_answer": f"优点: {'；'.join(data['优点'])}\n缺点: {'；'.join(data['缺点'])}", # TODO: 前端如果觉得这样解析有困难再改
@@ -405,4 +605,47 @@ def get_problems_for_article(chunks):
         })
         chunk_index_list.append(-1)
     return questions, chunk_index_list
- 
\ No newline at end of file
+
+def get_problems_for_article(chunks, deadline: float | None = None) -> tuple[list[dict], list[int], Future | None]:
+    """
+    generate the questions of an article
+    args:
+        deadline: the time.monotonic() by which the questions are returned, None to wait for all of them,
+            the generation after the deadline doesn't retry the invalid responses
+    return:
+        the questions ready by the deadline, their chunk indexes (-1 for the review),
+        the future of the (questions, chunk indexes) which are late, None if no question is late
+    """
+    question_type_list = ['choice', 'tf', 'blank']
+    pool = ThreadPoolExecutor()
+    tasks: list[tuple[str, int, Future]] = []
+    with span("problem_generation"):
+        if USE_FUSED_PROBLEM_PROMPT:
+            # 每个chunk只请求一次，同时得到所有题型的题目
+            for chunk_index, chunk, num in allocate_problems(chunks, PROBLEM_NUM_PER_TYPE):
+                res = submit_in_context(pool, get_fused_problems, *(chunk, {key: num for key in question_type_list}, deadline))
+                tasks.append(("fused", chunk_index, res))
+        else:
+            for key in question_type_list:
+                res = submit_in_context(pool, get_problem_for_each_article_per_type, *(chunks, key, PROBLEM_NUM_PER_TYPE, deadline))
+                tasks.append((key, -1, res))
+        # 每个chunk的总结并行生成，review的任务在总结之后提交，等待的总结不会因为线程池满而无法执行
+        summaries = [submit_in_context(pool, get_problems, *(chunk, "sum", 1, deadline)) for chunk in chunks]
+        tasks.append(("review", -1, submit_in_context(pool, get_review_problems, *(chunks, summaries, deadline))))
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        done, _ = wait([task for _, _, task in tasks], timeout=timeout)
+        pool.shutdown(wait=False)
+
+    questions, chunk_index_list = collect_questions([task for task in tasks if task[2] in done])
+    late_tasks = [task for task in tasks if task[2] not in done]
+    if not late_tasks:
+        return questions, chunk_index_list, None
+
+    late_questions = Future()
+    def collect_late_questions():
+        try:
+            late_questions.set_result(collect_questions(late_tasks))
+        except Exception as e:
+            late_questions.set_exception(e)
+    Thread(target=collect_late_questions, daemon=True).start()
+    return questions, chunk_index_list, late_questions
@@ -0,0 +1,146 @@
+"""
+In-memory vector index over l2 normalized embeddings, searched by inner product.
+Small indexes are searched by brute force, an IVF (inverted file) partition is trained when the index grows
+larger than ivf_min_size, then only the nprobe partitions nearest to the query are scanned.
+"""
+from threading import Lock
+import numpy as np
+from constants import VECTOR_INDEX_IVF_MIN_SIZE, VECTOR_INDEX_NPROBE
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    the indices of the k largest scores in descending order
+    """
+    if k >= scores.shape[0]:
+        return np.argsort(-scores)
+    indices = np.argpartition(-scores, k)[:k]
+    return indices[np.argsort(-scores[indices])]
+
+
+def spherical_kmeans(embeddings: np.ndarray, cluster_number: int, iteration_number: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    return:
+        the l2 normalized centroids with shape (cluster_number, dim)
+    """
+    rng = np.random.default_rng(seed)
+    centroids = embeddings[rng.choice(embeddings.shape[0], cluster_number, replace=False)].copy()
+    for _ in range(iteration_number):
+        assignments = np.argmax(embeddings @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, embeddings)
+        norm = np.linalg.norm(sums, axis=1, keepdims=True)
+        # the empty clusters keep their old centroids
+        centroids = np.where(norm > 0, sums / np.maximum(norm, 1e-12), centroids)
+    return centroids
+
+
+class VectorIndex:
+    def __init__(self, dim: int, payload_width: int = 1, ivf_min_size: int = VECTOR_INDEX_IVF_MIN_SIZE, nprobe: int = VECTOR_INDEX_NPROBE):
+        """
+        args:
+            dim: the dim of the embeddings
+            payload_width: the number of int64 values stored with each embedding, e.g. (chunk_id, document_id)
+            ivf_min_size: train the IVF partition when the index has more embeddings, None to always use brute force
+            nprobe: the number of partitions scanned by a query in the IVF mode
+        """
+        self.dim = dim
+        self.ivf_min_size = ivf_min_size
+        self.nprobe = nprobe
+        self.embeddings = np.zeros((1024, dim), dtype=np.float32)
+        self.payloads = np.zeros((1024, payload_width), dtype=np.int64)
+        self.alive = np.zeros(1024, dtype=bool)
+        self.size = 0
+        self.centroids: np.ndarray | None = None
+        self.assignments = np.zeros(1024, dtype=np.int64)
+        # the members of each partition, rebuilt lazily after the index is changed
+        self.partition_members: list[np.ndarray] | None = None
+        self.trained_size = 0
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return int(self.alive[:self.size].sum())
+
+    @property
+    def is_ivf(self) -> bool:
+        return self.centroids is not None
+
+    def _reserve(self, size: int):
+        capacity = self.embeddings.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ['embeddings', 'payloads', 'alive', 'assignments']:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, embeddings: np.ndarray, payloads: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        payloads = np.asarray(payloads, dtype=np.int64).reshape(embeddings.shape[0], -1)
+        with self.lock:
+            begin, end = self.size, self.size + embeddings.shape[0]
+            self._reserve(end)
+            self.embeddings[begin:end] = embeddings
+            self.payloads[begin:end] = payloads
+            self.alive[begin:end] = True
+            self.size = end
+            if self.is_ivf:
+                self.assignments[begin:end] = np.argmax(embeddings @ self.centroids.T, axis=1)
+                self.partition_members = None
+            # retrain the partition when the index has doubled since the last training
+            if self.ivf_min_size is not None and self.size >= self.ivf_min_size and self.size >= 2 * self.trained_size:
+                self._train()
+
+    def remove(self, column: int, values: list[int]):
+        """
+        remove the embeddings whose payload[column] is in values
+        """
+        with self.lock:
+            mask = np.isin(self.payloads[:self.size, column], values)
+            self.alive[:self.size][mask] = False
+            self.partition_members = None
+
+    def _train(self):
+        alive_indices = np.flatnonzero(self.alive[:self.size])
+        cluster_number = max(1, int(np.sqrt(alive_indices.shape[0])))
+        rng = np.random.default_rng(0)
+        sample_indices = rng.choice(alive_indices, min(alive_indices.shape[0], cluster_number * 64), replace=False)
+        self.centroids = spherical_kmeans(self.embeddings[sample_indices], cluster_number)
+        for begin in range(0, self.size, 65536):
+            end = min(begin + 65536, self.size)
+            self.assignments[begin:end] = np.argmax(self.embeddings[begin:end] @ self.centroids.T, axis=1)
+        self.trained_size = self.size
+        self.partition_members = None
+
+    def _get_partition_members(self) -> list[np.ndarray]:
+        if self.partition_members is None:
+            alive_indices = np.flatnonzero(self.alive[:self.size])
+            order = np.argsort(self.assignments[alive_indices], kind='stable')
+            sorted_indices = alive_indices[order]
+            bounds = np.searchsorted(self.assignments[sorted_indices], np.arange(self.centroids.shape[0] + 1))
+            self.partition_members = [sorted_indices[bounds[i]:bounds[i + 1]] for i in range(self.centroids.shape[0])]
+        return self.partition_members
+
+    def search(self, query: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        args:
+            query: the l2 normalized query embedding with shape (dim,)
+        return:
+            the payloads with shape (k, payload_width) and the scores with shape (k,) of the nearest embeddings
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        with self.lock:
+            if self.is_ivf:
+                partitions = top_k_indices(self.centroids @ query, self.nprobe)
+                partition_members = self._get_partition_members()
+                candidates = np.concatenate([partition_members[i] for i in partitions])
+                scores = self.embeddings[candidates] @ query
+            else:
+                candidates = np.flatnonzero(self.alive[:self.size])
+                scores = self.embeddings[:self.size] @ query
+                scores = scores[candidates] if candidates.shape[0] < self.size else scores
+            indices = top_k_indices(scores, top_k)
+            return self.payloads[candidates[indices]], scores[indices]